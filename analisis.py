@@ -1,134 +1,181 @@
 from database import get_db
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
 from collections import defaultdict
+import networkx as nx
+import statistics
+import heapq
 from sqlalchemy import text
+from concentracion import concentracion_caso
+from cubo import principales_por_rol, fijar_version_caso
+
+# Filas por detector en la vista de análisis
+LIMITE_RESUMEN = 100
+
+# Tope de trabajo al enumerar cadenas y ciclos: pasado este número de caminos
+# explorados la búsqueda se corta y el total informado es un mínimo
+MAX_CAMINOS_EXPLORADOS = 200000
 
 def analisis_principales_ordenantes(caso_id, top_n=10):
-    with get_db() as db:
-        query = text("""
-            SELECT 
-                p.persona_id,
-                p.documento_encriptado,
-                p.descripcion_ocupacion,
-                COUNT(DISTINCT t.transaccion_id) as total_operaciones,
-                SUM(t.monto) as monto_total,
-                AVG(t.monto) as monto_promedio,
-                MIN(t.fecha_operacion) as primera_operacion,
-                MAX(t.fecha_operacion) as ultima_operacion,
-                COUNT(DISTINCT t.beneficiario_id) as beneficiarios_unicos
-            FROM transacciones t
-            JOIN personas p ON t.ordenante_id = p.persona_id
-            WHERE t.ordenante_id IN (
-                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
-            )
-            GROUP BY p.persona_id
-            ORDER BY monto_total DESC
-            LIMIT :top_n
-        """)
-        return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id, 'top_n': top_n}).fetchall()]
+    return principales_por_rol(caso_id, 'ORDENANTE', 'beneficiarios_unicos', top_n)
 
 def analisis_principales_beneficiarios(caso_id, top_n=10):
+    return principales_por_rol(caso_id, 'BENEFICIARIO', 'ordenantes_unicos', top_n)
+
+def detectar_concentracion_montos(caso_id, umbral_porcentaje=70, limit=None, offset=0, solo_resumen=False):
+    concentracion = concentracion_caso(caso_id, umbral_porcentaje)
+    
+    # Personas que en conjunto reúnen el umbral_porcentaje del monto de cada lado
+    resultados = []
+    for rol, estadisticas in concentracion.items():
+        for fila in estadisticas['ranking']:
+            if fila['porcentaje_acumulado'] - fila['porcentaje_del_total'] >= umbral_porcentaje:
+                break
+            resultados.append({
+                'rol': rol,
+                'persona_id': fila['persona_id'],
+                'documento_encriptado': fila['documento_encriptado'],
+                'monto_persona': fila['monto'],
+                'num_operaciones': fila['num_operaciones'],
+                'porcentaje_del_total': fila['porcentaje_del_total'],
+                'porcentaje_acumulado': fila['porcentaje_acumulado'],
+                'hhi': estadisticas['hhi'],
+                'gini': estadisticas['gini']
+            })
+    
+    return paginar_detecciones(resultados, limit, offset, solo_resumen)
+
+def detectar_frecuencia_inusual(caso_id, ventana_dias=7, factor_incremento=3, metodo='mediana',
+                                periodos_base=8, umbral_z=3.5, periodo=None, limit=None, offset=0, solo_resumen=False):
+    periodo = periodo or periodo_por_ventana(ventana_dias)
+    
     with get_db() as db:
+        # caso_id None evalúa a todas las personas de la base
         query = text("""
             SELECT 
-                p.persona_id,
-                p.documento_encriptado,
-                p.descripcion_ocupacion,
-                COUNT(DISTINCT t.transaccion_id) as total_operaciones,
-                SUM(t.monto) as monto_total,
-                AVG(t.monto) as monto_promedio,
-                MIN(t.fecha_operacion) as primera_operacion,
-                MAX(t.fecha_operacion) as ultima_operacion,
-                COUNT(DISTINCT t.ordenante_id) as ordenantes_unicos
+                t.ordenante_id as persona_id,
+                DATE_TRUNC(:periodo, t.fecha_operacion)::date as periodo,
+                COUNT(*) as num_operaciones,
+                SUM(t.monto) as monto_total
             FROM transacciones t
-            JOIN personas p ON t.beneficiario_id = p.persona_id
-            WHERE t.beneficiario_id IN (
+            WHERE CAST(:caso_id AS INTEGER) IS NULL OR t.ordenante_id IN (
                 SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
             )
-            GROUP BY p.persona_id
-            ORDER BY monto_total DESC
-            LIMIT :top_n
+            GROUP BY t.ordenante_id, DATE_TRUNC(:periodo, t.fecha_operacion)
         """)
-        return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id, 'top_n': top_n}).fetchall()]
-
-def detectar_concentracion_montos(caso_id, umbral_porcentaje=70):
+        series = pd.DataFrame(
+            db.execute(query, {'caso_id': caso_id, 'periodo': periodo}).fetchall(),
+            columns=['persona_id', 'periodo', 'num_operaciones', 'monto_total']
+        )
+    
+    if series.empty:
+        return []
+    
+    puntajes = calcular_puntajes_anomalia(series, periodo, metodo, periodos_base)
+    picos = puntajes[
+        (puntajes['puntaje_z'] >= umbral_z) &
+        (puntajes['num_operaciones'] > puntajes['linea_base'] * factor_incremento)
+    ].sort_values('puntaje_z', ascending=False)
+    picos = picos.iloc[offset:None if limit is None else offset + limit]
+    
+    if picos.empty:
+        return []
+    
     with get_db() as db:
-        query = text("""
-            WITH totales AS (
-                SELECT SUM(monto) as monto_total_caso
-                FROM transacciones t
-                JOIN casos_personas cp ON t.ordenante_id = cp.persona_id 
-                    OR t.beneficiario_id = cp.persona_id
-                WHERE cp.caso_id = :caso_id
-            ),
-            ordenantes_ranking AS (
-                SELECT 
-                    p.persona_id,
-                    p.documento_encriptado,
-                    SUM(t.monto) as monto_persona,
-                    COUNT(*) as num_operaciones,
-                    SUM(SUM(t.monto)) OVER (ORDER BY SUM(t.monto) DESC) as monto_acumulado,
-                    (SELECT monto_total_caso FROM totales) as monto_total
-                FROM transacciones t
-                JOIN personas p ON t.ordenante_id = p.persona_id
-                JOIN casos_personas cp ON p.persona_id = cp.persona_id
-                WHERE cp.caso_id = :caso_id
-                GROUP BY p.persona_id
-            )
-            SELECT 
-                persona_id,
-                documento_encriptado,
-                monto_persona,
-                num_operaciones,
-                ROUND((monto_persona / monto_total * 100)::numeric, 2) as porcentaje_del_total,
-                ROUND((monto_acumulado / monto_total * 100)::numeric, 2) as porcentaje_acumulado
-            FROM ordenantes_ranking
-            WHERE (monto_acumulado / monto_total * 100) <= :umbral
-            ORDER BY monto_persona DESC
-        """)
-        return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id, 'umbral': umbral_porcentaje}).fetchall()]
+        documentos = db.execute(
+            text("SELECT persona_id, documento_encriptado FROM personas WHERE persona_id = ANY(:ids)"),
+            {'ids': [int(p) for p in picos['persona_id'].unique()]}
+        ).fetchall()
+    documentos = {row.persona_id: row.documento_encriptado for row in documentos}
+    
+    return paginar_detecciones([
+        {
+            'periodo': fila.periodo,
+            'persona_id': int(fila.persona_id),
+            'documento_encriptado': documentos.get(int(fila.persona_id)),
+            'num_operaciones': int(fila.num_operaciones),
+            'monto_total': float(fila.monto_total),
+            'linea_base': round(float(fila.linea_base), 2),
+            'puntaje_z': round(float(fila.puntaje_z), 2),
+            'factor_incremento': round(float(fila.num_operaciones / max(fila.linea_base, 1)), 2)
+        }
+        for fila in picos.itertuples()
+    ], solo_resumen=solo_resumen)
 
-def detectar_frecuencia_inusual(caso_id, ventana_dias=7, factor_incremento=3):
-    with get_db() as db:
-        query = text("""
-            WITH operaciones_por_periodo AS (
-                SELECT 
-                    DATE_TRUNC('week', t.fecha_operacion) as periodo,
-                    t.ordenante_id,
-                    COUNT(*) as num_operaciones,
-                    SUM(t.monto) as monto_total
-                FROM transacciones t
-                JOIN casos_personas cp ON t.ordenante_id = cp.persona_id
-                WHERE cp.caso_id = :caso_id
-                GROUP BY DATE_TRUNC('week', t.fecha_operacion), t.ordenante_id
-            ),
-            promedios AS (
-                SELECT 
-                    ordenante_id,
-                    AVG(num_operaciones) as promedio_operaciones,
-                    STDDEV(num_operaciones) as stddev_operaciones
-                FROM operaciones_por_periodo
-                GROUP BY ordenante_id
-                HAVING COUNT(*) > 2
-            )
-            SELECT 
-                op.periodo,
-                p.persona_id,
-                p.documento_encriptado,
-                op.num_operaciones,
-                op.monto_total,
-                ROUND(pr.promedio_operaciones::numeric, 2) as promedio_historico,
-                ROUND((op.num_operaciones / NULLIF(pr.promedio_operaciones, 0))::numeric, 2) as factor_incremento
-            FROM operaciones_por_periodo op
-            JOIN promedios pr ON op.ordenante_id = pr.ordenante_id
-            JOIN personas p ON op.ordenante_id = p.persona_id
-            WHERE op.num_operaciones > pr.promedio_operaciones * :factor
-            ORDER BY factor_incremento DESC
-        """)
-        return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id, 'factor': factor_incremento}).fetchall()]
+# Lunes, para que las semanas coincidan con DATE_TRUNC('week')
+INICIO_PERIODOS = pd.Timestamp('1969-12-29')
+
+def periodo_por_ventana(ventana_dias):
+    if ventana_dias <= 1:
+        return 'day'
+    if ventana_dias <= 7:
+        return 'week'
+    return 'month'
+
+def numerar_periodos(fechas, periodo):
+    fechas = pd.to_datetime(fechas)
+    if periodo == 'month':
+        return fechas.dt.year * 12 + fechas.dt.month - 1
+    dias = (fechas - INICIO_PERIODOS).dt.days
+    return dias // 7 if periodo == 'week' else dias
+
+def fecha_de_periodo(numeros, periodo):
+    if periodo == 'month':
+        return pd.to_datetime(pd.DataFrame({'year': numeros // 12, 'month': numeros % 12 + 1, 'day': 1}))
+    dias = numeros * 7 if periodo == 'week' else numeros
+    return INICIO_PERIODOS + pd.to_timedelta(dias, unit='D')
+
+def calcular_puntajes_anomalia(series, periodo='week', metodo='mediana', periodos_base=8, alpha=0.3):
+    # series: persona_id, periodo, num_operaciones, monto_total (un registro por
+    # periodo con actividad). Los periodos sin actividad dentro del rango de
+    # cada persona se completan con cero antes de calcular la línea base.
+    series = series.copy()
+    series['num_operaciones'] = series['num_operaciones'].astype(float)
+    series['monto_total'] = series['monto_total'].astype(float)
+    series['numero'] = numerar_periodos(series['periodo'], periodo)
+    
+    rangos = series.groupby('persona_id')['numero'].agg(['min', 'max'])
+    largos = (rangos['max'] - rangos['min'] + 1).to_numpy()
+    inicios = np.repeat(rangos['min'].to_numpy(), largos)
+    desplazamientos = np.arange(largos.sum()) - np.repeat(np.cumsum(largos) - largos, largos)
+    
+    completa = pd.DataFrame({
+        'persona_id': np.repeat(rangos.index.to_numpy(), largos),
+        'numero': inicios + desplazamientos
+    }).merge(
+        series[['persona_id', 'numero', 'num_operaciones', 'monto_total']],
+        on=['persona_id', 'numero'], how='left'
+    ).fillna({'num_operaciones': 0.0, 'monto_total': 0.0})
+    completa = completa.sort_values(['persona_id', 'numero'], ignore_index=True)
+    
+    # La línea base de cada periodo usa solo los periodos anteriores
+    por_persona = completa.groupby('persona_id')['num_operaciones']
+    anterior = por_persona.shift(1)
+    min_periodos = min(3, periodos_base)
+    
+    previo = anterior.groupby(completa['persona_id'])
+    
+    if metodo == 'ewma':
+        ewm = previo.ewm(alpha=alpha, min_periods=min_periodos)
+        linea_base = ewm.mean().reset_index(level=0, drop=True)
+        escala = ewm.std().reset_index(level=0, drop=True)
+    else:
+        linea_base = previo.rolling(periodos_base, min_periods=min_periodos).median().reset_index(level=0, drop=True)
+        desvio = (completa['num_operaciones'] - linea_base).abs()
+        escala = desvio.groupby(completa['persona_id']).shift(1).groupby(completa['persona_id']).rolling(
+            periodos_base, min_periods=min_periodos
+        ).median().reset_index(level=0, drop=True) * 1.4826
+    
+    completa['linea_base'] = linea_base
+    completa['escala'] = escala.fillna(0).clip(lower=1.0)
+    completa['puntaje_z'] = (completa['num_operaciones'] - completa['linea_base']) / completa['escala']
+    completa['periodo'] = fecha_de_periodo(completa['numero'], periodo).dt.date
+    
+    return completa.dropna(subset=['linea_base'])
 
-def detectar_ventanas_cortas(caso_id, ventana_horas=2, min_operaciones=5):
+def detectar_ventanas_cortas(caso_id, ventana_horas=2, min_operaciones=5, desde_fecha=None,
+                             limit=None, offset=0, solo_resumen=False):
     with get_db() as db:
         query = text("""
             WITH transacciones_con_timestamp AS (
@@ -144,6 +191,7 @@ def detectar_ventanas_cortas(caso_id, ventana_horas=2, min_operaciones=5):
                 FROM transacciones t
                 JOIN casos_personas cp ON t.ordenante_id = cp.persona_id
                 WHERE cp.caso_id = :caso_id
+                    AND (CAST(:desde_fecha AS DATE) IS NULL OR t.fecha_operacion >= :desde_fecha)
             ),
             ventanas AS (
                 SELECT 
@@ -172,57 +220,116 @@ def detectar_ventanas_cortas(caso_id, ventana_horas=2, min_operaciones=5):
             FROM ventanas v
             JOIN personas p ON v.ordenante_id = p.persona_id
             ORDER BY v.operaciones_en_ventana DESC, v.monto_total_ventana DESC
+            LIMIT :limit OFFSET :offset
         """)
-        return [dict(row._mapping) for row in db.execute(query, {
+        return paginar_detecciones([dict(row._mapping) for row in db.execute(query, {
             'caso_id': caso_id,
             'ventana': ventana_horas,
-            'min_ops': min_operaciones
-        }).fetchall()]
+            'min_ops': min_operaciones,
+            'desde_fecha': desde_fecha,
+            'limit': limit,
+            'offset': offset
+        }).fetchall()], solo_resumen=solo_resumen)
 
-def detectar_montos_similares(caso_id, tolerancia_porcentual=5, min_repeticiones=3):
+def detectar_montos_similares(caso_id, tolerancia_porcentual=5, min_repeticiones=3, max_ids_evidencia=100,
+                              limit=None, offset=0, solo_resumen=False):
     with get_db() as db:
         query = text("""
-            WITH montos_agrupados AS (
-                SELECT 
-                    t.ordenante_id,
-                    t.beneficiario_id,
-                    ROUND(t.monto::numeric, -2) as monto_redondeado,
-                    COUNT(*) as repeticiones,
-                    AVG(t.monto) as monto_promedio,
-                    STDDEV(t.monto) as desviacion,
-                    ARRAY_AGG(t.transaccion_id ORDER BY t.fecha_operacion) as transacciones_ids,
-                    MIN(t.fecha_operacion) as primera_fecha,
-                    MAX(t.fecha_operacion) as ultima_fecha
-                FROM transacciones t
-                JOIN casos_personas cp ON t.ordenante_id = cp.persona_id
-                WHERE cp.caso_id = :caso_id
-                GROUP BY t.ordenante_id, t.beneficiario_id, ROUND(t.monto::numeric, -2)
-                HAVING COUNT(*) >= :min_rep
-            )
             SELECT 
-                po.persona_id as ordenante_id,
+                t.transaccion_id,
+                t.ordenante_id,
                 po.documento_encriptado as ordenante_doc,
-                pb.persona_id as beneficiario_id,
+                t.beneficiario_id,
                 pb.documento_encriptado as beneficiario_doc,
-                m.monto_promedio,
-                m.repeticiones,
-                m.desviacion,
-                m.primera_fecha,
-                m.ultima_fecha,
-                m.transacciones_ids
-            FROM montos_agrupados m
-            JOIN personas po ON m.ordenante_id = po.persona_id
-            JOIN personas pb ON m.beneficiario_id = pb.persona_id
-            WHERE (m.desviacion / NULLIF(m.monto_promedio, 0) * 100) <= :tolerancia
-            ORDER BY m.repeticiones DESC, m.monto_promedio DESC
+                t.monto,
+                t.fecha_operacion
+            FROM transacciones t
+            JOIN personas po ON t.ordenante_id = po.persona_id
+            JOIN personas pb ON t.beneficiario_id = pb.persona_id
+            WHERE t.ordenante_id IN (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            )
         """)
-        return [dict(row._mapping) for row in db.execute(query, {
-            'caso_id': caso_id,
-            'min_rep': min_repeticiones,
-            'tolerancia': tolerancia_porcentual
-        }).fetchall()]
+        transacciones = [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id}).fetchall()]
+    
+    for trx in transacciones:
+        trx['monto'] = float(trx['monto'])
+    
+    # Mismo monto repetido hacia un mismo beneficiario
+    grupos_par = agrupar_montos_similares(
+        transacciones, ('ordenante_id', 'beneficiario_id'),
+        tolerancia_porcentual, min_repeticiones, max_ids_evidencia
+    )
+    
+    # Mismo monto repartido entre varios beneficiarios
+    grupos_dispersion = [
+        g for g in agrupar_montos_similares(
+            transacciones, ('ordenante_id',),
+            tolerancia_porcentual, min_repeticiones, max_ids_evidencia
+        )
+        if g['beneficiarios_distintos'] > 1
+    ]
+    
+    return paginar_detecciones(sorted(
+        grupos_par + grupos_dispersion,
+        key=lambda g: (g['repeticiones'], g['monto_promedio']),
+        reverse=True
+    ), limit, offset, solo_resumen)
+
+def agrupar_montos_similares(transacciones, claves, tolerancia_porcentual, min_repeticiones, max_ids_evidencia=100):
+    # Barrido sobre montos ordenados: un grupo se extiende mientras el monto
+    # no supere al menor del grupo en más de tolerancia_porcentual
+    ordenadas = sorted(transacciones, key=lambda t: tuple(t[c] for c in claves) + (t['monto'],))
+    grupos = []
+    
+    def cerrar_grupo(grupo):
+        if len(grupo) < min_repeticiones:
+            return
+        
+        montos = [t['monto'] for t in grupo]
+        por_fecha = sorted(grupo, key=lambda t: t['fecha_operacion'])
+        beneficiarios = {t['beneficiario_id'] for t in grupo}
+        un_beneficiario = len(beneficiarios) == 1
+        
+        grupos.append({
+            'ordenante_id': grupo[0]['ordenante_id'],
+            'ordenante_doc': grupo[0]['ordenante_doc'],
+            'beneficiario_id': grupo[0]['beneficiario_id'] if un_beneficiario else None,
+            'beneficiario_doc': grupo[0]['beneficiario_doc'] if un_beneficiario else None,
+            'beneficiarios_distintos': len(beneficiarios),
+            'monto_minimo': montos[0],
+            'monto_maximo': montos[-1],
+            'monto_promedio': statistics.fmean(montos),
+            'monto_total': sum(montos),
+            'repeticiones': len(grupo),
+            # Como STDDEV en SQL: sin desviación muestral para un solo monto
+            'desviacion': statistics.stdev(montos) if len(montos) > 1 else None,
+            'primera_fecha': por_fecha[0]['fecha_operacion'],
+            'ultima_fecha': por_fecha[-1]['fecha_operacion'],
+            'transacciones_ids': [t['transaccion_id'] for t in por_fecha[:max_ids_evidencia]],
+            'transacciones_truncadas': len(grupo) > max_ids_evidencia
+        })
+    
+    grupo = []
+    clave_grupo = None
+    for trx in ordenadas:
+        clave = tuple(trx[c] for c in claves)
+        if grupo and (
+            clave != clave_grupo or
+            trx['monto'] - grupo[0]['monto'] > grupo[0]['monto'] * tolerancia_porcentual / 100
+        ):
+            cerrar_grupo(grupo)
+            grupo = []
+        grupo.append(trx)
+        clave_grupo = clave
+    
+    if grupo:
+        cerrar_grupo(grupo)
+    
+    return grupos
 
-def detectar_pitufeo(caso_id, umbral_monto=10000, ventana_dias=30, min_operaciones=5):
+def detectar_pitufeo(caso_id, umbral_monto=10000, ventana_dias=30, min_operaciones=5, desde_fecha=None,
+                     limit=None, offset=0, solo_resumen=False):
     with get_db() as db:
         query = text("""
             WITH operaciones_bajo_umbral AS (
@@ -237,6 +344,7 @@ def detectar_pitufeo(caso_id, umbral_monto=10000, ventana_dias=30, min_operacion
                 FROM transacciones t
                 JOIN casos_personas cp ON t.ordenante_id = cp.persona_id
                 WHERE cp.caso_id = :caso_id
+                    AND (CAST(:desde_fecha AS DATE) IS NULL OR t.fecha_operacion >= :desde_fecha)
                     AND t.monto < :umbral
                 GROUP BY t.ordenante_id, t.beneficiario_id, DATE_TRUNC('day', t.fecha_operacion)
             ),
@@ -272,15 +380,34 @@ def detectar_pitufeo(caso_id, umbral_monto=10000, ventana_dias=30, min_operacion
             JOIN personas po ON v.ordenante_id = po.persona_id
             JOIN personas pb ON v.beneficiario_id = pb.persona_id
             ORDER BY v.monto_acumulado DESC, v.total_operaciones DESC
+            LIMIT :limit OFFSET :offset
         """)
-        return [dict(row._mapping) for row in db.execute(query, {
+        return paginar_detecciones([dict(row._mapping) for row in db.execute(query, {
             'caso_id': caso_id,
             'umbral': umbral_monto,
             'ventana': ventana_dias,
-            'min_ops': min_operaciones
-        }).fetchall()]
+            'min_ops': min_operaciones,
+            'desde_fecha': desde_fecha,
+            'limit': limit,
+            'offset': offset
+        }).fetchall()], solo_resumen=solo_resumen)
+
+def agregar_top(top, k, clave, secuencia, item):
+    # Montículo de mínimos con los k mejores por clave; la raíz es el peor
+    # retenido. A igual clave gana el encontrado primero
+    entrada = (clave, -secuencia, item)
+    if len(top) < k:
+        heapq.heappush(top, entrada)
+    elif entrada[:2] > top[0][:2]:
+        heapq.heapreplace(top, entrada)
 
-def detectar_cadenas_transferencia(caso_id, min_eslabones=3, ventana_dias=7):
+def ordenar_top(top):
+    return [item for _, _, item in sorted(top, key=lambda e: e[:2], reverse=True)]
+
+def enumerar_cadenas(caso_id, min_eslabones=3, ventana_dias=7, max_cadenas=1000,
+                     max_explorados=MAX_CAMINOS_EXPLORADOS):
+    # Devuelve las max_cadenas de mayor monto, el total encontrado y si la
+    # búsqueda se cortó por max_explorados (el total es entonces un mínimo)
     transacciones = obtener_transacciones_para_cadenas(caso_id, ventana_dias)
     
     grafo = defaultdict(list)
@@ -292,11 +419,18 @@ def detectar_cadenas_transferencia(caso_id, min_eslabones=3, ventana_dias=7):
             'monto': trx['monto']
         })
     
-    cadenas_detectadas = []
+    top = []
+    conteo = {'cadenas': 0, 'explorados': 0}
     
     def buscar_cadenas(nodo_actual, camino, visitados, profundidad):
+        if conteo['explorados'] >= max_explorados:
+            return
+        conteo['explorados'] += 1
+        
         if profundidad >= min_eslabones:
-            cadenas_detectadas.append(camino.copy())
+            conteo['cadenas'] += 1
+            clave = (sum(float(e['monto']) for e in camino), len(camino))
+            agregar_top(top, max_cadenas, clave, conteo['cadenas'], camino.copy())
         
         if profundidad > 10:
             return
@@ -308,14 +442,23 @@ def detectar_cadenas_transferencia(caso_id, min_eslabones=3, ventana_dias=7):
                 nuevo_camino = camino + [siguiente]
                 buscar_cadenas(siguiente['beneficiario_id'], nuevo_camino, nuevo_visitados, profundidad + 1)
     
-    for nodo_inicial in grafo.keys():
+    for nodo_inicial in list(grafo.keys()):
         buscar_cadenas(nodo_inicial, [], {nodo_inicial}, 0)
     
-    return cadenas_detectadas
+    return ordenar_top(top), conteo['cadenas'], conteo['explorados'] >= max_explorados
+
+def detectar_cadenas_transferencia(caso_id, min_eslabones=3, ventana_dias=7, max_cadenas=1000,
+                                   limit=None, offset=0, solo_resumen=False):
+    cadenas, _, _ = enumerar_cadenas(caso_id, min_eslabones, ventana_dias, max_cadenas)
+    return paginar_detecciones(cadenas, limit, offset, solo_resumen)
 
 def obtener_transacciones_para_cadenas(caso_id, ventana_dias):
+    # Cada transacción una vez aunque ordenante y beneficiario sean del caso
     with get_db() as db:
         query = text("""
+            WITH personas_caso AS (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            )
             SELECT 
                 t.transaccion_id,
                 t.ordenante_id,
@@ -323,61 +466,150 @@ def obtener_transacciones_para_cadenas(caso_id, ventana_dias):
                 t.fecha_operacion,
                 t.monto
             FROM transacciones t
-            JOIN casos_personas cp ON t.ordenante_id = cp.persona_id 
-                OR t.beneficiario_id = cp.persona_id
-            WHERE cp.caso_id = :caso_id
+            WHERE (t.ordenante_id IN (SELECT persona_id FROM personas_caso)
+                    OR t.beneficiario_id IN (SELECT persona_id FROM personas_caso))
                 AND t.fecha_operacion >= CURRENT_DATE - INTERVAL ':ventana days'
             ORDER BY t.fecha_operacion, t.hora_operacion
         """)
         result = db.execute(query, {'caso_id': caso_id, 'ventana': ventana_dias}).fetchall()
         return [dict(row._mapping) for row in result]
 
-def detectar_circularidad(caso_id, max_saltos=5):
+def enumerar_ciclos(caso_id, max_saltos=5, max_ciclos=1000, max_explorados=MAX_CAMINOS_EXPLORADOS):
+    # Igual que enumerar_cadenas: top max_ciclos por monto, total y corte
     transacciones = obtener_transacciones_para_cadenas(caso_id, 90)
     
-    grafo = defaultdict(list)
+    # Un arco por par ordenante->beneficiario con sus totales y rango de fechas
+    aristas = {}
     for trx in transacciones:
-        grafo[trx['ordenante_id']].append({
-            'beneficiario_id': trx['beneficiario_id'],
-            'transaccion_id': trx['transaccion_id'],
-            'monto': trx['monto']
-        })
+        clave = (trx['ordenante_id'], trx['beneficiario_id'])
+        if clave[0] is None or clave[1] is None or clave[0] == clave[1]:
+            continue
+        
+        arista = aristas.get(clave)
+        if arista is None:
+            aristas[clave] = {
+                'monto': float(trx['monto']),
+                'primera_fecha': trx['fecha_operacion'],
+                'ultima_fecha': trx['fecha_operacion'],
+                'transacciones_ids': [trx['transaccion_id']]
+            }
+        else:
+            arista['monto'] += float(trx['monto'])
+            arista['primera_fecha'] = min(arista['primera_fecha'], trx['fecha_operacion'])
+            arista['ultima_fecha'] = max(arista['ultima_fecha'], trx['fecha_operacion'])
+            arista['transacciones_ids'].append(trx['transaccion_id'])
     
-    ciclos_detectados = []
+    G = nx.DiGraph()
+    G.add_edges_from(aristas.keys())
     
-    def buscar_ciclos(nodo_actual, nodo_origen, camino, profundidad):
-        if profundidad > max_saltos:
-            return
+    top = []
+    conteo = {'ciclos': 0, 'explorados': 0}
+    
+    # Solo las componentes fuertemente conexas pueden contener ciclos
+    for componente in nx.strongly_connected_components(G):
+        if len(componente) < 3:
+            continue
         
-        for siguiente in grafo.get(nodo_actual, []):
-            if siguiente['beneficiario_id'] == nodo_origen and profundidad >= 2:
-                ciclos_detectados.append({
-                    'origen': nodo_origen,
-                    'camino': camino + [siguiente],
-                    'longitud': profundidad + 1
-                })
-            elif siguiente['beneficiario_id'] not in [n['beneficiario_id'] for n in camino]:
-                buscar_ciclos(
-                    siguiente['beneficiario_id'],
-                    nodo_origen,
-                    camino + [siguiente],
-                    profundidad + 1
-                )
-    
-    for nodo in grafo.keys():
-        buscar_ciclos(nodo, nodo, [], 0)
-    
-    return ciclos_detectados
+        subgrafo = G.subgraph(componente)
+        for ciclo in nx.simple_cycles(subgrafo, length_bound=max_saltos + 1):
+            if conteo['explorados'] >= max_explorados:
+                return ordenar_top(top), conteo['ciclos'], True
+            conteo['explorados'] += 1
+            if len(ciclo) < 3:
+                continue
+            
+            conteo['ciclos'] += 1
+            detectado = construir_ciclo(ciclo, aristas)
+            agregar_top(top, max_ciclos, clave_ciclo(detectado), conteo['ciclos'], detectado)
+    
+    return ordenar_top(top), conteo['ciclos'], False
+
+def detectar_circularidad(caso_id, max_saltos=5, max_ciclos=1000, limit=None, offset=0, solo_resumen=False):
+    ciclos, _, _ = enumerar_ciclos(caso_id, max_saltos, max_ciclos)
+    return paginar_detecciones(ciclos, limit, offset, solo_resumen)
+
+
+def construir_ciclo(ciclo, aristas):
+    # Forma canónica: rotación que empieza en el menor persona_id
+    inicio = ciclo.index(min(ciclo))
+    nodos = ciclo[inicio:] + ciclo[:inicio]
+    
+    tramos = []
+    for i, ordenante in enumerate(nodos):
+        beneficiario = nodos[(i + 1) % len(nodos)]
+        arista = aristas[(ordenante, beneficiario)]
+        tramos.append({
+            'ordenante_id': ordenante,
+            'beneficiario_id': beneficiario,
+            'monto': arista['monto'],
+            'num_transacciones': len(arista['transacciones_ids']),
+            'primera_fecha': arista['primera_fecha'],
+            'ultima_fecha': arista['ultima_fecha']
+        })
+    
+    fecha_inicio = min(t['primera_fecha'] for t in tramos)
+    fecha_fin = max(t['ultima_fecha'] for t in tramos)
+    
+    return {
+        'persona_id': nodos[0],
+        'origen': nodos[0],
+        'camino': nodos,
+        'tramos': tramos,
+        'longitud': len(nodos),
+        'monto_total': sum(t['monto'] for t in tramos),
+        'monto_minimo_tramo': min(t['monto'] for t in tramos),
+        'total_operaciones': sum(t['num_transacciones'] for t in tramos),
+        'fecha_inicio': fecha_inicio,
+        'fecha_fin': fecha_fin,
+        'dias_ciclo': (fecha_fin - fecha_inicio).days,
+        'transacciones_ids': [
+            trx_id
+            for ordenante, beneficiario in zip(nodos, nodos[1:] + nodos[:1])
+            for trx_id in aristas[(ordenante, beneficiario)]['transacciones_ids']
+        ]
+    }
+
+def clave_ciclo(ciclo):
+    return (ciclo['monto_total'], -ciclo['longitud'])
+
+def paginar_detecciones(detecciones, limit=None, offset=0, solo_resumen=False):
+    pagina = detecciones[offset:None if limit is None else offset + limit]
+    if solo_resumen:
+        return [resumir_deteccion(d) for d in pagina]
+    return pagina
+
+def resumir_deteccion(deteccion):
+    # Conteos y totales sin los arreglos de ids ni el detalle de tramos
+    if isinstance(deteccion, list):
+        return {
+            'num_eslabones': len(deteccion),
+            'monto_total': sum(float(e.get('monto', 0)) for e in deteccion)
+        }
+    
+    resumen = {}
+    for clave, valor in deteccion.items():
+        if isinstance(valor, (list, tuple)):
+            resumen[f'num_{clave}'] = sum(len(v) if isinstance(v, (list, tuple)) else 1 for v in valor)
+        else:
+            resumen[clave] = valor
+    return resumen
 
-def generar_resumen_analisis(caso_id):
+def generar_resumen_analisis(caso_id, limit=LIMITE_RESUMEN):
+    fijar_version_caso(caso_id)
+    cadenas, total_cadenas, cadenas_truncadas = enumerar_cadenas(caso_id)
+    ciclos, total_ciclos, ciclos_truncados = enumerar_ciclos(caso_id)
     return {
         'principales_ordenantes': analisis_principales_ordenantes(caso_id, 10),
         'principales_beneficiarios': analisis_principales_beneficiarios(caso_id, 10),
-        'concentracion_montos': detectar_concentracion_montos(caso_id),
-        'frecuencia_inusual': detectar_frecuencia_inusual(caso_id),
-        'ventanas_cortas': detectar_ventanas_cortas(caso_id),
-        'montos_similares': detectar_montos_similares(caso_id),
-        'pitufeo': detectar_pitufeo(caso_id),
-        'cadenas': detectar_cadenas_transferencia(caso_id),
-        'circularidad': detectar_circularidad(caso_id)
+        'concentracion_montos': detectar_concentracion_montos(caso_id, limit=limit),
+        'frecuencia_inusual': detectar_frecuencia_inusual(caso_id, limit=limit),
+        'ventanas_cortas': detectar_ventanas_cortas(caso_id, limit=limit),
+        'montos_similares': detectar_montos_similares(caso_id, limit=limit),
+        'pitufeo': detectar_pitufeo(caso_id, limit=limit),
+        'cadenas': paginar_detecciones(cadenas, limit, solo_resumen=True),
+        'total_cadenas': total_cadenas,
+        'cadenas_truncadas': cadenas_truncadas,
+        'circularidad': paginar_detecciones(ciclos, limit),
+        'total_ciclos': total_ciclos,
+        'ciclos_truncados': ciclos_truncados
     }
\ No newline at end of file
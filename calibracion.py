@@ -0,0 +1,206 @@
+from database import get_db
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from datetime import date
+from sqlalchemy import text
+from casos import obtener_version_datos_caso
+from tipologias import REGISTRO_TIPOLOGIAS, validar_parametros
+
+# Barrido de parámetros para calibrar tipologías: una instantánea de las
+# transacciones en memoria y, por cada combinación estructural (umbral,
+# ventana), una sola pasada vectorizada que resuelve todos los mínimos.
+
+MAX_INSTANTANEAS_EN_MEMORIA = 4
+
+_instantaneas = OrderedDict()
+_bloqueo = threading.Lock()
+
+def version_instantanea(caso_id):
+    if caso_id is not None:
+        return obtener_version_datos_caso(caso_id)
+    with get_db() as db:
+        return str(db.execute(text("SELECT COALESCE(MAX(transaccion_id), 0) FROM transacciones")).scalar())
+
+def cargar_instantanea(caso_id=None, desde_fecha=None):
+    # caso_id None: toda la población (cada persona cuenta como "del caso")
+    with get_db() as db:
+        query = text("""
+            WITH personas_caso AS (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            )
+            SELECT
+                t.transaccion_id,
+                t.ordenante_id,
+                t.beneficiario_id,
+                t.fecha_operacion,
+                t.hora_operacion,
+                t.monto,
+                (CAST(:caso_id AS INTEGER) IS NULL OR t.ordenante_id IN (SELECT persona_id FROM personas_caso)) as ordenante_en_caso,
+                (CAST(:caso_id AS INTEGER) IS NULL OR t.beneficiario_id IN (SELECT persona_id FROM personas_caso)) as beneficiario_en_caso
+            FROM transacciones t
+            WHERE (CAST(:desde_fecha AS DATE) IS NULL OR t.fecha_operacion >= :desde_fecha)
+                AND (
+                    CAST(:caso_id AS INTEGER) IS NULL
+                    OR t.ordenante_id IN (SELECT persona_id FROM personas_caso)
+                    OR t.beneficiario_id IN (SELECT persona_id FROM personas_caso)
+                )
+        """)
+        df = pd.DataFrame(
+            [dict(row._mapping) for row in db.execute(query, {
+                'caso_id': caso_id,
+                'desde_fecha': desde_fecha
+            }).fetchall()],
+            columns=['transaccion_id', 'ordenante_id', 'beneficiario_id', 'fecha_operacion',
+                     'hora_operacion', 'monto', 'ordenante_en_caso', 'beneficiario_en_caso']
+        )
+
+    df['monto'] = df['monto'].astype(float)
+    df['fecha_operacion'] = pd.to_datetime(df['fecha_operacion'])
+    df['dia'] = (df['fecha_operacion'] - pd.Timestamp('1970-01-01')).dt.days
+    horas = pd.to_timedelta(df['hora_operacion'].fillna('00:00:00').astype(str), errors='coerce')
+    df['segundos'] = df['dia'] * 86400 + horas.fillna(pd.Timedelta(0)).dt.total_seconds().astype('int64')
+    return df
+
+def obtener_instantanea(caso_id=None, desde_fecha=None):
+    clave = (caso_id, desde_fecha)
+    version = version_instantanea(caso_id)
+    with _bloqueo:
+        instantanea = _instantaneas.get(clave)
+        if instantanea is None or instantanea['version'] != version:
+            instantanea = {'version': version, 'transacciones': cargar_instantanea(caso_id, desde_fecha)}
+            _instantaneas[clave] = instantanea
+        _instantaneas.move_to_end(clave)
+        while len(_instantaneas) > MAX_INSTANTANEAS_EN_MEMORIA:
+            _instantaneas.popitem(last=False)
+    return instantanea['transacciones']
+
+def contar_en_ventana(grupos, tiempos, ancho):
+    # Para cada evento, cuántos eventos del mismo grupo caen en [t, t + ancho].
+    # Los grupos pasan a códigos densos 0..g-1 y los tiempos a desplazamientos
+    # desde el mínimo, así (grupo, tiempo) cabe en un int64 sin colisiones
+    codigos, unicos = pd.factorize(np.asarray(grupos))
+    tiempos = np.asarray(tiempos, dtype='int64')
+    if not len(tiempos):
+        return np.empty(0, dtype='int64')
+    desplazamientos = tiempos - tiempos.min()
+    espacio = int(desplazamientos.max()) + int(ancho) + 1
+    if len(unicos) * espacio >= 1 << 63:
+        raise ValueError("Rango de tiempos demasiado amplio para contar ventanas")
+    
+    claves = codigos.astype('int64') * espacio + desplazamientos
+    orden = np.argsort(claves, kind='stable')
+    ordenadas = claves[orden]
+    conteo = np.empty(len(claves), dtype='int64')
+    conteo[orden] = (
+        np.searchsorted(ordenadas, ordenadas + ancho, side='right') -
+        np.searchsorted(ordenadas, ordenadas, side='left')
+    )
+    return conteo
+
+def evaluar_minimos(puntajes, personas, minimos):
+    # Un punto de la grilla por mínimo: alerta si puntaje >= mínimo
+    puntajes = np.asarray(puntajes)
+    personas = np.asarray(personas)
+    ordenados = np.sort(puntajes)
+    maximo_por_persona = pd.Series(puntajes).groupby(personas).max().sort_values(ascending=False)
+
+    resultados = []
+    for minimo in minimos:
+        afectadas = maximo_por_persona.index[maximo_por_persona.to_numpy() >= minimo]
+        resultados.append({
+            'num_alertas': int(len(ordenados) - np.searchsorted(ordenados, minimo, side='left')),
+            'num_personas': int(len(afectadas)),
+            'personas': sorted(int(p) for p in afectadas)
+        })
+    return resultados
+
+def barrer_pitufeo(trx, grilla):
+    # Mismo criterio que detectar_pitufeo: por (ordenante, beneficiario, día)
+    # las operaciones del día multiplicadas por los días activos en la ventana
+    trx = trx[trx['ordenante_en_caso'] & trx['beneficiario_id'].notna()]
+    for umbral in grilla['umbral_monto']:
+        dias = (
+            trx[trx['monto'] < umbral]
+            .groupby(['ordenante_id', 'beneficiario_id', 'dia'])
+            .size().rename('num_operaciones').reset_index()
+        )
+        par = dias.groupby(['ordenante_id', 'beneficiario_id']).ngroup().to_numpy()
+        for ventana in grilla['ventana_dias']:
+            activos = contar_en_ventana(par, dias['dia'].to_numpy(), ventana)
+            puntajes = dias['num_operaciones'].to_numpy() * activos
+            for minimo, resultado in zip(grilla['min_operaciones'], evaluar_minimos(
+                puntajes, dias['ordenante_id'].to_numpy(), grilla['min_operaciones']
+            )):
+                yield {'umbral_monto': umbral, 'ventana_dias': ventana, 'min_operaciones': minimo, **resultado}
+
+def barrer_concentracion(trx, grilla, persona, contraparte, en_caso, nombre_minimo):
+    trx = trx[trx[en_caso] & trx[persona].notna()]
+    hoy = (pd.Timestamp(date.today()) - pd.Timestamp('1970-01-01')).days
+    for ventana in grilla['ventana_dias']:
+        contrapartes = trx[trx['dia'] >= hoy - ventana].groupby(persona)[contraparte].nunique()
+        for minimo, resultado in zip(grilla[nombre_minimo], evaluar_minimos(
+            contrapartes.to_numpy(), contrapartes.index.to_numpy(), grilla[nombre_minimo]
+        )):
+            yield {'ventana_dias': ventana, nombre_minimo: minimo, **resultado}
+
+def barrer_ventanas_cortas(trx, grilla):
+    # Una alerta por (ordenante, instante de inicio) distinto, como en
+    # detectar_ventanas_cortas
+    trx = trx[trx['ordenante_en_caso'] & trx['ordenante_id'].notna()]
+    eventos = trx[['ordenante_id', 'segundos']].to_numpy(dtype='int64')
+    for ventana in grilla['ventana_horas']:
+        conteo = contar_en_ventana(eventos[:, 0], eventos[:, 1], ventana * 3600)
+        inicios = pd.DataFrame({'ordenante_id': eventos[:, 0], 'segundos': eventos[:, 1], 'conteo': conteo})
+        inicios = inicios.drop_duplicates(['ordenante_id', 'segundos'])
+        for minimo, resultado in zip(grilla['min_operaciones'], evaluar_minimos(
+            inicios['conteo'].to_numpy(), inicios['ordenante_id'].to_numpy(), grilla['min_operaciones']
+        )):
+            yield {'ventana_horas': ventana, 'min_operaciones': minimo, **resultado}
+
+def barrer_montos_redondos(trx, grilla):
+    trx = trx[trx['ordenante_en_caso'] & trx['ordenante_id'].notna()]
+    conteo = trx[np.isclose(trx['monto'] % 1000, 0)].groupby('ordenante_id').size()
+    for minimo, resultado in zip(grilla['min_operaciones'], evaluar_minimos(
+        conteo.to_numpy(), conteo.index.to_numpy(), grilla['min_operaciones']
+    )):
+        yield {'min_operaciones': minimo, **resultado}
+
+BARRIDOS = {
+    'TIP001': barrer_pitufeo,
+    'TIP002': lambda trx, grilla: barrer_concentracion(
+        trx, grilla, 'beneficiario_id', 'ordenante_id', 'beneficiario_en_caso', 'min_ordenantes'
+    ),
+    'TIP003': lambda trx, grilla: barrer_concentracion(
+        trx, grilla, 'ordenante_id', 'beneficiario_id', 'ordenante_en_caso', 'min_beneficiarios'
+    ),
+    'TIP006': barrer_ventanas_cortas,
+    'TIP010': barrer_montos_redondos
+}
+
+ESQUEMAS_BARRIDO = {
+    'TIP001': {'umbral_monto': 10000.0, 'ventana_dias': 30, 'min_operaciones': 5},
+    'TIP002': {'min_ordenantes': 5, 'ventana_dias': 30},
+    'TIP003': {'min_beneficiarios': 10, 'ventana_dias': 30},
+    'TIP006': {'ventana_horas': 2, 'min_operaciones': 5},
+    'TIP010': {'min_operaciones': 5}
+}
+
+def barrer_parametros(codigo, grilla, caso_id=None, desde_fecha=None):
+    # grilla: {parametro: [valores]}; los parámetros ausentes toman el valor
+    # por defecto de la tipología. Devuelve una fila por combinación.
+    if codigo not in BARRIDOS:
+        raise ValueError(f"La tipología {codigo} no admite barrido de parámetros")
+
+    esquema = REGISTRO_TIPOLOGIAS.get(codigo, {}).get('parametros') or ESQUEMAS_BARRIDO[codigo]
+    esquema = {nombre: esquema.get(nombre, defecto) for nombre, defecto in ESQUEMAS_BARRIDO[codigo].items()}
+    valores = {}
+    for nombre, defecto in esquema.items():
+        lista = grilla.get(nombre, [defecto])
+        valores[nombre] = sorted({
+            validar_parametros({nombre: defecto}, {nombre: valor})[nombre] for valor in lista
+        })
+
+    trx = obtener_instantanea(caso_id, desde_fecha)
+    return list(BARRIDOS[codigo](trx, valores))
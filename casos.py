@@ -1,6 +1,7 @@
 from database import get_db
 from datetime import datetime
 from sqlalchemy import text
+from utils import calcular_hash
 
 def crear_caso(nombre, descripcion='', usuario='SYSTEM', prioridad='MEDIA', tipo_caso='INVESTIGACION'):
     with get_db() as db:
@@ -32,6 +33,24 @@ def listar_casos():
         # CORRECCIÓN: Retornar lista de diccionarios
         return [dict(row._mapping) for row in db.execute(query).fetchall()]
 
+def obtener_version_datos_caso(caso_id):
+    # Cambia al agregar o quitar personas del caso o al cargar transacciones que las involucran
+    with get_db() as db:
+        query = text("""
+            WITH personas_caso AS (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            )
+            SELECT
+                (SELECT string_agg(persona_id::text, ',' ORDER BY persona_id) FROM personas_caso) as personas,
+                COALESCE(MAX(t.transaccion_id), 0) as ultima_transaccion_id,
+                COUNT(*) as num_transacciones
+            FROM transacciones t
+            WHERE t.ordenante_id IN (SELECT persona_id FROM personas_caso)
+                OR t.beneficiario_id IN (SELECT persona_id FROM personas_caso)
+        """)
+        result = db.execute(query, {'caso_id': caso_id}).fetchone()
+        return calcular_hash(f"{result.personas}|{result.ultima_transaccion_id}|{result.num_transacciones}")
+
 def obtener_caso(caso_id):
     with get_db() as db:
         query = text("SELECT * FROM casos WHERE caso_id = :caso_id")
@@ -0,0 +1,124 @@
+from database import get_db
+import numpy as np
+from sqlalchemy import text
+
+ROLES = {'ORDENANTE': 'ordenantes', 'BENEFICIARIO': 'beneficiarios'}
+
+def calcular_estadisticas_concentracion(participantes, umbral_pareto=80):
+    # participantes: lista de dicts con persona_id, monto y num_operaciones
+    ordenados = sorted(participantes, key=lambda p: p['monto'], reverse=True)
+    montos = np.array([p['monto'] for p in ordenados], dtype=float)
+    total = montos.sum()
+    n = len(montos)
+
+    if n == 0 or total <= 0:
+        return {
+            'num_participantes': n,
+            'monto_total': float(total),
+            'hhi': 0.0,
+            'hhi_normalizado': 0.0,
+            'gini': 0.0,
+            'participantes_pareto': 0,
+            'ranking': []
+        }
+
+    participacion = montos / total
+    acumulado = np.cumsum(participacion)
+    hhi = float(np.sum(participacion ** 2))
+
+    # Gini sobre montos en orden ascendente
+    ascendentes = montos[::-1]
+    gini = float(2 * np.sum(np.arange(1, n + 1) * ascendentes) / (n * total) - (n + 1) / n)
+
+    ranking = [
+        {
+            **p,
+            'porcentaje_del_total': round(float(participacion[i] * 100), 2),
+            'porcentaje_acumulado': round(float(acumulado[i] * 100), 2)
+        }
+        for i, p in enumerate(ordenados)
+    ]
+
+    return {
+        'num_participantes': n,
+        'monto_total': float(total),
+        'hhi': round(hhi, 4),
+        'hhi_normalizado': round((hhi - 1 / n) / (1 - 1 / n), 4) if n > 1 else 1.0,
+        'gini': round(gini, 4),
+        'participantes_pareto': min(int(np.searchsorted(acumulado, umbral_pareto / 100)) + 1, n),
+        'ranking': ranking
+    }
+
+def agrupar_por_rol(filas, umbral_pareto):
+    participantes = {rol: [] for rol in ROLES}
+    for fila in filas:
+        participantes[fila.rol].append({
+            'persona_id': fila.persona_id,
+            'documento_encriptado': fila.documento_encriptado,
+            'monto': float(fila.monto),
+            'num_operaciones': fila.num_operaciones
+        })
+
+    return {
+        nombre: calcular_estadisticas_concentracion(participantes[rol], umbral_pareto)
+        for rol, nombre in ROLES.items()
+    }
+
+def concentracion_caso(caso_id, umbral_pareto=80):
+    # Una sola lectura de las transacciones del caso; GROUPING SETS agrega
+    # ambos lados en el mismo recorrido
+    with get_db() as db:
+        query = text("""
+            WITH personas_caso AS (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            ),
+            trx AS (
+                SELECT t.ordenante_id, t.beneficiario_id, t.monto
+                FROM transacciones t
+                WHERE t.ordenante_id IN (SELECT persona_id FROM personas_caso)
+                    OR t.beneficiario_id IN (SELECT persona_id FROM personas_caso)
+            ),
+            agregados AS (
+                SELECT
+                    CASE WHEN GROUPING(ordenante_id) = 0 THEN 'ORDENANTE' ELSE 'BENEFICIARIO' END as rol,
+                    CASE WHEN GROUPING(ordenante_id) = 0 THEN ordenante_id ELSE beneficiario_id END as persona_id,
+                    SUM(monto) as monto,
+                    COUNT(*) as num_operaciones
+                FROM trx
+                GROUP BY GROUPING SETS ((ordenante_id), (beneficiario_id))
+            )
+            SELECT a.rol, a.persona_id, p.documento_encriptado, a.monto, a.num_operaciones
+            FROM agregados a
+            LEFT JOIN personas p ON a.persona_id = p.persona_id
+            WHERE a.persona_id IS NOT NULL
+        """)
+        filas = db.execute(query, {'caso_id': caso_id}).fetchall()
+
+    return agrupar_por_rol(filas, umbral_pareto)
+
+def concentracion_persona(persona_id, umbral_pareto=80):
+    # Cartera de contrapartes: a quién envía como ordenante y de quién
+    # recibe como beneficiario
+    with get_db() as db:
+        query = text("""
+            WITH agregados AS (
+                SELECT 'BENEFICIARIO' as rol, t.beneficiario_id as persona_id,
+                       SUM(t.monto) as monto, COUNT(*) as num_operaciones
+                FROM transacciones t
+                WHERE t.ordenante_id = :persona_id
+                GROUP BY t.beneficiario_id
+                UNION ALL
+                SELECT 'ORDENANTE' as rol, t.ordenante_id as persona_id,
+                       SUM(t.monto) as monto, COUNT(*) as num_operaciones
+                FROM transacciones t
+                WHERE t.beneficiario_id = :persona_id
+                GROUP BY t.ordenante_id
+            )
+            SELECT a.rol, a.persona_id, p.documento_encriptado, a.monto, a.num_operaciones
+            FROM agregados a
+            LEFT JOIN personas p ON a.persona_id = p.persona_id
+            WHERE a.persona_id IS NOT NULL
+        """)
+        filas = db.execute(query, {'persona_id': persona_id}).fetchall()
+
+    return agrupar_por_rol(filas, umbral_pareto)
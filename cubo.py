@@ -0,0 +1,137 @@
+from database import get_db
+import threading
+import time
+import pandas as pd
+from collections import OrderedDict
+from datetime import date, timedelta
+from itertools import chain
+from sqlalchemy import text
+from casos import obtener_version_datos_caso
+
+# Cubos retenidos en memoria por proceso (los casos menos usados salen primero)
+MAX_CUBOS_EN_MEMORIA = 8
+
+# Segundos durante los que se reutiliza la versión de datos de un caso sin
+# volver a calcularla; las corridas la fijan al empezar con fijar_version_caso
+INTERVALO_VERSION = 30
+
+# caso_id -> cubo; el cubo se reconstruye cuando cambia la versión de datos del caso
+_cubos = OrderedDict()
+# caso_id -> (versión, momento en que se calculó)
+_versiones = {}
+_bloqueo = threading.Lock()
+
+def construir_cubo(caso_id):
+    # Una sola lectura de las transacciones del caso: cada fila se abre en
+    # sus dos roles y se agrega por persona x rol x contraparte x día
+    with get_db() as db:
+        query = text("""
+            WITH personas_caso AS (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            )
+            SELECT
+                r.rol,
+                r.persona_id,
+                r.contraparte_id,
+                t.fecha_operacion as fecha,
+                COUNT(*) as num_operaciones,
+                SUM(t.monto) as monto_total,
+                ARRAY_AGG(t.transaccion_id) as transacciones_ids
+            FROM transacciones t
+            CROSS JOIN LATERAL (VALUES
+                ('ORDENANTE', t.ordenante_id, t.beneficiario_id),
+                ('BENEFICIARIO', t.beneficiario_id, t.ordenante_id)
+            ) AS r(rol, persona_id, contraparte_id)
+            WHERE r.persona_id IN (SELECT persona_id FROM personas_caso)
+            GROUP BY r.rol, r.persona_id, r.contraparte_id, t.fecha_operacion
+        """)
+        celdas = pd.DataFrame(
+            [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id}).fetchall()],
+            columns=['rol', 'persona_id', 'contraparte_id', 'fecha', 'num_operaciones',
+                     'monto_total', 'transacciones_ids']
+        )
+
+        query = text("""
+            SELECT p.persona_id, p.documento_encriptado, p.descripcion_ocupacion
+            FROM personas p
+            JOIN casos_personas cp ON p.persona_id = cp.persona_id
+            WHERE cp.caso_id = :caso_id
+        """)
+        personas = pd.DataFrame(
+            [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id}).fetchall()],
+            columns=['persona_id', 'documento_encriptado', 'descripcion_ocupacion']
+        )
+
+    celdas['monto_total'] = celdas['monto_total'].astype(float)
+    celdas['fecha'] = pd.to_datetime(celdas['fecha'])
+    return {'celdas': celdas, 'personas': personas.set_index('persona_id')}
+
+def fijar_version_caso(caso_id, version=None):
+    # Versión de datos para la corrida en curso: los cubos del caso la usan
+    # sin volver a recorrer sus transacciones en cada lectura
+    version = version or obtener_version_datos_caso(caso_id)
+    with _bloqueo:
+        _versiones[caso_id] = (version, time.monotonic())
+    return version
+
+def version_caso(caso_id):
+    with _bloqueo:
+        vigente = _versiones.get(caso_id)
+    if vigente and time.monotonic() - vigente[1] < INTERVALO_VERSION:
+        return vigente[0]
+    return fijar_version_caso(caso_id)
+
+def obtener_cubo(caso_id):
+    version = version_caso(caso_id)
+    with _bloqueo:
+        cubo = _cubos.get(caso_id)
+        if cubo is None or cubo['version'] != version:
+            cubo = {**construir_cubo(caso_id), 'version': version}
+            _cubos[caso_id] = cubo
+        _cubos.move_to_end(caso_id)
+        while len(_cubos) > MAX_CUBOS_EN_MEMORIA:
+            descartado, _ = _cubos.popitem(last=False)
+            _versiones.pop(descartado, None)
+    return cubo
+
+def agregar_por_persona(cubo, rol, ventana_dias=None, incluir_transacciones=False):
+    celdas = cubo['celdas']
+    celdas = celdas[celdas['rol'] == rol]
+    if ventana_dias is not None:
+        celdas = celdas[celdas['fecha'] >= pd.Timestamp(date.today() - timedelta(days=ventana_dias))]
+
+    grupos = celdas.groupby('persona_id')
+    agregados = grupos.agg(
+        total_operaciones=('num_operaciones', 'sum'),
+        monto_total=('monto_total', 'sum'),
+        primera_operacion=('fecha', 'min'),
+        ultima_operacion=('fecha', 'max'),
+        contrapartes_unicas=('contraparte_id', 'nunique')
+    )
+    agregados['monto_promedio'] = agregados['monto_total'] / agregados['total_operaciones']
+    agregados['primera_operacion'] = agregados['primera_operacion'].dt.date
+    agregados['ultima_operacion'] = agregados['ultima_operacion'].dt.date
+    if incluir_transacciones:
+        agregados['transacciones_ids'] = grupos['transacciones_ids'].agg(
+            lambda listas: sorted(chain.from_iterable(listas))
+        )
+
+    return agregados.join(cubo['personas'], how='inner').reset_index()
+
+def principales_por_rol(caso_id, rol, columna_contrapartes, top_n=10):
+    agregados = agregar_por_persona(obtener_cubo(caso_id), rol)
+    agregados = agregados.rename(columns={'contrapartes_unicas': columna_contrapartes})
+    return agregados.nlargest(top_n, 'monto_total')[[
+        'persona_id', 'documento_encriptado', 'descripcion_ocupacion', 'total_operaciones',
+        'monto_total', 'monto_promedio', 'primera_operacion', 'ultima_operacion', columna_contrapartes
+    ]].to_dict('records')
+
+def concentracion_por_rol(caso_id, rol, columna_contrapartes, min_contrapartes, ventana_dias):
+    # Personas del caso con muchas contrapartes distintas dentro de la ventana
+    agregados = agregar_por_persona(obtener_cubo(caso_id), rol, ventana_dias, incluir_transacciones=True)
+    agregados = agregados[agregados['contrapartes_unicas'] >= min_contrapartes]
+    agregados = agregados.rename(columns={'contrapartes_unicas': columna_contrapartes})
+    return agregados.sort_values('monto_total', ascending=False)[[
+        'persona_id', 'documento_encriptado', columna_contrapartes, 'total_operaciones',
+        'monto_total', 'transacciones_ids'
+    ]].to_dict('records')
@@ -1,7 +1,8 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from contextlib import contextmanager
+from contextvars import ContextVar
 
 DATABASE_URL = os.getenv(
     'DATABASE_URL',
@@ -11,10 +12,28 @@ DATABASE_URL = os.getenv(
 engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=10, max_overflow=20)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# statement_timeout (ms) aplicado a las sesiones abiertas en el contexto actual
+timeout_sentencias = ContextVar('timeout_sentencias', default=None)
+
+def reiniciar_pool():
+    # En procesos hijos: descartar las conexiones heredadas del padre
+    engine.dispose(close=False)
+
+@contextmanager
+def limitar_tiempo_sentencias(milisegundos):
+    token = timeout_sentencias.set(milisegundos)
+    try:
+        yield
+    finally:
+        timeout_sentencias.reset(token)
+
 @contextmanager
 def get_db():
     db = SessionLocal()
     try:
+        timeout = timeout_sentencias.get()
+        if timeout:
+            db.execute(text("SELECT set_config('statement_timeout', :timeout, true)"), {'timeout': str(int(timeout))})
         yield db
         db.commit()
     except Exception:
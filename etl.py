@@ -4,6 +4,7 @@ from datetime import datetime
 from database import get_db
 import hashlib
 from sqlalchemy import text
+from tiempo_real import crear_evaluador, evaluar_lote, momento_operacion
 
 COLUMNAS_REQUERIDAS = [
     'busqueda', 'flgtipoclibusqueda', 'destipclasifpartyrelacionado',
@@ -22,6 +23,10 @@ COLUMNAS_REQUERIDAS = [
 
 MONTO_MINIMO = 100
 
+# Filas por transacción con evaluación en línea: cada lote se evalúa y
+# confirma junto con sus alertas
+TAMANO_LOTE_CARGA = 5000
+
 def normalizar_columnas(df):
     columnas_normalizadas = {}
     for col_req in COLUMNAS_REQUERIDAS:
@@ -168,7 +173,69 @@ def insertar_o_actualizar_persona(db, persona_data, fecha_op, monto, rol):
     
     return persona_id
 
-def cargar_transacciones(df, ro_id):
+def cargar_transacciones(df, ro_id, evaluador=None, tamano_lote=TAMANO_LOTE_CARGA):
+    # Sin evaluación en línea el archivo entra en una sola transacción: una
+    # falla a mitad de carga no deja un RO parcial
+    if evaluador is None:
+        return cargar_lote_transacciones(df, ro_id)
+    alertas = []
+    for inicio in range(0, len(df), tamano_lote):
+        alertas.extend(cargar_lote_transacciones(df.iloc[inicio:inicio + tamano_lote], ro_id, evaluador))
+    return alertas
+
+def actualizar_aristas_globales(db, transacciones_ids):
+    # Suma las transacciones recién insertadas a la tabla de aristas global,
+    # en la misma transacción que la carga del lote
+    if not transacciones_ids:
+        return
+    db.execute(text("""
+        INSERT INTO aristas_globales AS a
+            (ordenante_id, beneficiario_id, num_transacciones, monto_total, fecha_primera, fecha_ultima)
+        SELECT
+            ordenante_id,
+            beneficiario_id,
+            COUNT(*),
+            SUM(monto),
+            MIN(fecha_operacion),
+            MAX(fecha_operacion)
+        FROM transacciones
+        WHERE transaccion_id = ANY(:ids)
+            AND ordenante_id IS NOT NULL
+            AND beneficiario_id IS NOT NULL
+        GROUP BY ordenante_id, beneficiario_id
+        ON CONFLICT (ordenante_id, beneficiario_id) DO UPDATE SET
+            num_transacciones = a.num_transacciones + EXCLUDED.num_transacciones,
+            monto_total = a.monto_total + EXCLUDED.monto_total,
+            fecha_primera = LEAST(a.fecha_primera, EXCLUDED.fecha_primera),
+            fecha_ultima = GREATEST(a.fecha_ultima, EXCLUDED.fecha_ultima),
+            fecha_actualizacion = CURRENT_TIMESTAMP,
+            xid_actualizacion = EXCLUDED.xid_actualizacion
+    """), {'ids': transacciones_ids})
+
+def reconstruir_aristas_globales():
+    # Carga inicial o reparación: recalcula la tabla desde transacciones. La
+    # nueva generación obliga a los grafos en memoria a recargar completo
+    with get_db() as db:
+        db.execute(text("DELETE FROM aristas_globales"))
+        db.execute(text("UPDATE aristas_globales_generacion SET generacion = generacion + 1"))
+        db.execute(text("""
+            INSERT INTO aristas_globales
+                (ordenante_id, beneficiario_id, num_transacciones, monto_total, fecha_primera, fecha_ultima)
+            SELECT
+                ordenante_id,
+                beneficiario_id,
+                COUNT(*),
+                SUM(monto),
+                MIN(fecha_operacion),
+                MAX(fecha_operacion)
+            FROM transacciones
+            WHERE ordenante_id IS NOT NULL AND beneficiario_id IS NOT NULL
+            GROUP BY ordenante_id, beneficiario_id
+        """))
+
+def cargar_lote_transacciones(df, ro_id, evaluador=None):
+    eventos = []
+    transacciones_ids = []
     with get_db() as db:
         query_trx = text("""
             INSERT INTO transacciones (
@@ -188,6 +255,7 @@ def cargar_transacciones(df, ro_id):
                 :ben_id, :ben_tipo, :ben_doc_tipo, :ben_doc, :ben_ciiu, :ben_ocup, :ben_dep, :ben_prov, :ben_dist, :ben_cta,
                 :tipo_op, :desc_op, :origen, :cod_mon, :nom_mon, :monto
             )
+            RETURNING transaccion_id
         """)
         
         for _, row in df.iterrows():
@@ -201,7 +269,7 @@ def cargar_transacciones(df, ro_id):
             beneficiario_id = insertar_o_actualizar_persona(db, beneficiario_data, row['fec_operacion'], row['mtotrx'], 'beneficiario')
             
             # Usar safe_get para asegurar que pasamos None en lugar de NaN a la BD
-            db.execute(query_trx, {
+            transaccion_id = db.execute(query_trx, {
                 'ro_id': ro_id,
                 'busqueda': safe_get(row, 'busqueda'),
                 'flag_tipo': safe_get(row, 'flgtipoclibusqueda'),
@@ -241,9 +309,26 @@ def cargar_transacciones(df, ro_id):
                 'cod_mon': safe_get(row, 'codmonedadestino'),
                 'nom_mon': safe_get(row, 'nbrmonedadestino'),
                 'monto': row['mtotrx']
-            })
+            }).scalar()
+            transacciones_ids.append(transaccion_id)
+            
+            if evaluador is not None:
+                eventos.append({
+                    'transaccion_id': transaccion_id,
+                    'ordenante_id': ordenante_id,
+                    'beneficiario_id': beneficiario_id,
+                    'fecha': row['fec_operacion'],
+                    'momento': momento_operacion(row['fec_operacion'], safe_get(row, 'hora_operacion')),
+                    'monto': float(row['mtotrx'])
+                })
+        
+        actualizar_aristas_globales(db, transacciones_ids)
+        
+        if evaluador is not None:
+            return evaluar_lote(db, evaluador, eventos, ro_id)
+    return []
 
-def procesar_archivo_ro(archivo_path, nombre_archivo, usuario='SYSTEM'):
+def procesar_archivo_ro(archivo_path, nombre_archivo, usuario='SYSTEM', evaluar_en_linea=False):
     df = pd.read_excel(archivo_path)
     total_inicial = len(df)
     
@@ -256,11 +341,18 @@ def procesar_archivo_ro(archivo_path, nombre_archivo, usuario='SYSTEM'):
     
     ro_id = registrar_ro(nombre_archivo, total_inicial, total_valido, total_descartado, usuario)
     
-    cargar_transacciones(df_limpio, ro_id)
+    evaluador = None
+    if evaluar_en_linea:
+        # En orden cronológico las ventanas de cada persona avanzan sin retrocesos
+        df_limpio = df_limpio.sort_values(['fec_operacion', 'hora_operacion'], kind='stable')
+        evaluador = crear_evaluador()
+    
+    alertas = cargar_transacciones(df_limpio, ro_id, evaluador)
     
     return {
         'ro_id': ro_id,
         'total': total_inicial,
         'validos': total_valido,
-        'descartados': total_descartado
+        'descartados': total_descartado,
+        'alertas': len(alertas)
     }
\ No newline at end of file
@@ -0,0 +1,220 @@
+from database import get_db
+import threading
+import time
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy import text
+
+# Grafo de toda la base armado desde aristas_globales (una fila por par
+# ordenante -> beneficiario, mantenida por la ETL). Se carga una vez por
+# proceso y después solo se leen las aristas escritas por transacciones
+# posteriores a la última lectura.
+
+# Segundos entre consultas de cambios; dentro del intervalo las consultas
+# se responden desde memoria sin tocar la base
+INTERVALO_REFRESCO = 60
+
+MAX_NODOS_EGO = 5000
+
+COLUMNAS_ARISTAS = [
+    'ordenante_id', 'beneficiario_id', 'num_transacciones', 'monto_total',
+    'fecha_primera', 'fecha_ultima'
+]
+
+_grafo = None
+_bloqueo = threading.Lock()
+
+def leer_aristas_globales(desde_xid=None):
+    # Devuelve también la generación y el xmin de la instantánea tomado antes
+    # de leer: toda transacción con id menor ya terminó y quedó incluida; las
+    # que seguían abiertas tienen id >= xmin y entran en la próxima lectura
+    with get_db() as db:
+        marca = db.execute(text("""
+            SELECT
+                (SELECT generacion FROM aristas_globales_generacion) as generacion,
+                pg_snapshot_xmin(pg_current_snapshot())::text::bigint as xmin
+        """)).fetchone()
+        query = text("""
+            SELECT ordenante_id, beneficiario_id, num_transacciones, monto_total,
+                   fecha_primera, fecha_ultima
+            FROM aristas_globales
+            WHERE CAST(:desde_xid AS BIGINT) IS NULL OR xid_actualizacion >= :desde_xid
+        """)
+        aristas = pd.DataFrame(
+            [dict(row._mapping) for row in db.execute(query, {'desde_xid': desde_xid}).fetchall()],
+            columns=COLUMNAS_ARISTAS
+        )
+    aristas['monto_total'] = aristas['monto_total'].astype(float)
+    return aristas, {'generacion': marca.generacion, 'xmin': marca.xmin}
+
+def indexar_grafo(aristas, marca):
+    # Nodos 0..n-1; 'salida' guarda en cada celda el número de fila + 1 de
+    # la arista, así un subgrafo se traduce directo a filas de 'aristas'
+    aristas = aristas.reset_index(drop=True)
+    nodos = pd.Index(pd.unique(np.concatenate([
+        aristas['ordenante_id'].to_numpy(), aristas['beneficiario_id'].to_numpy()
+    ])))
+    n = len(nodos)
+    filas = nodos.get_indexer(aristas['ordenante_id'])
+    columnas = nodos.get_indexer(aristas['beneficiario_id'])
+    salida = sparse.csr_matrix((np.arange(1, len(aristas) + 1), (filas, columnas)), shape=(n, n))
+    montos = sparse.csr_matrix((aristas['monto_total'].to_numpy(), (filas, columnas)), shape=(n, n))
+    estructura = (salida > 0).astype(np.int32)
+    return {
+        'aristas': aristas,
+        'nodos': nodos,
+        'salida': salida,
+        'entrada': salida.T.tocsr(),
+        # Vista no dirigida para contar vecinos y montos en ambos sentidos
+        'vecinos': ((estructura + estructura.T) > 0).astype(np.int32).tocsr(),
+        'montos': (montos + montos.T).tocsr(),
+        'marca': marca,
+        'revisado': time.monotonic()
+    }
+
+def cargar_grafo_global():
+    return indexar_grafo(*leer_aristas_globales())
+
+def combinar_aristas(aristas, cambios):
+    aristas = pd.concat([aristas, cambios], ignore_index=True)
+    return aristas.drop_duplicates(['ordenante_id', 'beneficiario_id'], keep='last')
+
+def refrescar_grafo(grafo):
+    cambios, marca = leer_aristas_globales(grafo['marca']['xmin'])
+    # Una reconstrucción borra pares: solo una recarga completa los quita
+    if marca['generacion'] != grafo['marca']['generacion']:
+        return cargar_grafo_global()
+    if cambios.empty:
+        grafo['marca'] = marca
+        grafo['revisado'] = time.monotonic()
+        return grafo
+    return indexar_grafo(combinar_aristas(grafo['aristas'], cambios), marca)
+
+def obtener_grafo_global(forzar_refresco=False):
+    global _grafo
+    with _bloqueo:
+        if _grafo is None:
+            _grafo = cargar_grafo_global()
+        elif forzar_refresco or time.monotonic() - _grafo['revisado'] >= INTERVALO_REFRESCO:
+            _grafo = refrescar_grafo(_grafo)
+        return _grafo
+
+def invalidar_grafo_global():
+    global _grafo
+    with _bloqueo:
+        _grafo = None
+
+def indices_personas(grafo, personas):
+    indices = grafo['nodos'].get_indexer(pd.Index(list(personas)))
+    return np.unique(indices[indices >= 0])
+
+def expandir(grafo, semillas, radio, sentido, max_nodos):
+    # BFS por niveles sobre las matrices CSR; devuelve índice de nodo y
+    # distancia a la semilla más cercana
+    distancias = np.full(len(grafo['nodos']), -1, dtype=np.int32)
+    distancias[semillas] = 0
+    frontera = semillas
+    visitados = len(semillas)
+    truncado = False
+
+    for paso in range(1, radio + 1):
+        if not len(frontera):
+            break
+        vecinos = []
+        if sentido in ('salida', 'ambos'):
+            vecinos.append(grafo['salida'][frontera].indices)
+        if sentido in ('entrada', 'ambos'):
+            vecinos.append(grafo['entrada'][frontera].indices)
+        nuevos = np.unique(np.concatenate(vecinos))
+        nuevos = nuevos[distancias[nuevos] < 0]
+        if max_nodos and visitados + len(nuevos) > max_nodos:
+            nuevos = nuevos[:max(max_nodos - visitados, 0)]
+            truncado = True
+        distancias[nuevos] = paso
+        visitados += len(nuevos)
+        frontera = nuevos
+        if truncado:
+            break
+
+    indices = np.flatnonzero(distancias >= 0)
+    return indices, distancias[indices], truncado
+
+def documentos_personas(personas):
+    if not personas:
+        return {}
+    with get_db() as db:
+        query = text("SELECT persona_id, documento_encriptado FROM personas WHERE persona_id = ANY(:ids)")
+        return {row.persona_id: row.documento_encriptado for row in db.execute(query, {'ids': personas}).fetchall()}
+
+def red_ego(personas, radio=1, sentido='ambos', max_nodos=MAX_NODOS_EGO, incluir_documentos=True):
+    # personas: un persona_id o una lista (p.ej. los miembros de un caso)
+    if sentido not in ('salida', 'entrada', 'ambos'):
+        raise ValueError(f"Sentido no válido: {sentido!r}")
+    semillas_ids = [personas] if np.isscalar(personas) else list(personas)
+
+    grafo = obtener_grafo_global()
+    semillas = indices_personas(grafo, semillas_ids)
+    indices, distancias, truncado = expandir(grafo, semillas, radio, sentido, max_nodos)
+
+    filas = grafo['salida'][indices][:, indices].data - 1
+    aristas = grafo['aristas'].iloc[np.sort(filas)]
+
+    personas_ids = grafo['nodos'][indices].tolist()
+    documentos = documentos_personas(personas_ids) if incluir_documentos else {}
+    return {
+        'semillas': semillas_ids,
+        'radio': radio,
+        'sentido': sentido,
+        'truncado': truncado,
+        'nodos': [
+            {'persona_id': persona_id, 'distancia': int(distancia), 'documento': documentos.get(persona_id)}
+            for persona_id, distancia in zip(personas_ids, distancias)
+        ],
+        'aristas': aristas.to_dict('records')
+    }
+
+def grafo_ego(personas, radio=1, sentido='ambos', max_nodos=MAX_NODOS_EGO):
+    # Mismos atributos que redes.construir_grafo_caso, para reutilizar sus
+    # análisis sobre la vecindad global
+    ego = red_ego(personas, radio, sentido, max_nodos)
+    G = nx.DiGraph()
+    G.add_nodes_from(
+        (nodo['persona_id'], {'tipo': 'persona', 'documento': nodo['documento'], 'distancia': nodo['distancia']})
+        for nodo in ego['nodos']
+    )
+    G.add_edges_from(
+        (a['ordenante_id'], a['beneficiario_id'], {'peso': a['monto_total'], 'num_transacciones': a['num_transacciones']})
+        for a in ego['aristas']
+    )
+    return G
+
+def intermediarios_caso(caso_id, min_contactos=2, limit=100):
+    # Personas fuera del caso conectadas directamente con varios miembros
+    with get_db() as db:
+        query = text("SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id")
+        miembros = [row.persona_id for row in db.execute(query, {'caso_id': caso_id}).fetchall()]
+
+    grafo = obtener_grafo_global()
+    indices = indices_personas(grafo, miembros)
+    if not len(indices):
+        return []
+
+    contactos = np.asarray(grafo['vecinos'][:, indices].sum(axis=1)).ravel()
+    montos = np.asarray(grafo['montos'][:, indices].sum(axis=1)).ravel()
+    contactos[indices] = 0
+    candidatos = np.flatnonzero(contactos >= min_contactos)
+    candidatos = candidatos[np.lexsort((-montos[candidatos], -contactos[candidatos]))][:limit]
+
+    personas_ids = grafo['nodos'][candidatos].tolist()
+    documentos = documentos_personas(personas_ids)
+    return [
+        {
+            'persona_id': persona_id,
+            'documento_encriptado': documentos.get(persona_id),
+            'miembros_conectados': int(contactos[i]),
+            'monto_con_caso': float(montos[i])
+        }
+        for persona_id, i in zip(personas_ids, candidatos)
+    ]
@@ -0,0 +1,249 @@
+from database import get_db
+import json
+import pandas as pd
+from datetime import date, timedelta
+from sqlalchemy import text
+from analisis import detectar_pitufeo, detectar_ventanas_cortas, calcular_puntajes_anomalia, periodo_por_ventana
+from tipologias import obtener_tipologias_activas, procesar_detecciones, leer_parametros
+
+def obtener_estado_detector(db, caso_id, detector):
+    query = text("""
+        SELECT ultima_transaccion_id, estado
+        FROM estado_analisis_caso
+        WHERE caso_id = :caso_id AND detector = :detector
+    """)
+    result = db.execute(query, {'caso_id': caso_id, 'detector': detector}).fetchone()
+    if not result:
+        return 0, {}
+
+    estado = result.estado
+    if isinstance(estado, str):
+        estado = json.loads(estado)
+    return result.ultima_transaccion_id or 0, estado or {}
+
+def guardar_estado_detector(db, caso_id, detector, ultima_transaccion_id, estado):
+    query = text("""
+        INSERT INTO estado_analisis_caso (caso_id, detector, ultima_transaccion_id, estado)
+        VALUES (:caso_id, :detector, :ultima, :estado)
+        ON CONFLICT (caso_id, detector) DO UPDATE SET
+            ultima_transaccion_id = EXCLUDED.ultima_transaccion_id,
+            estado = EXCLUDED.estado,
+            fecha_actualizacion = CURRENT_TIMESTAMP
+    """)
+    db.execute(query, {
+        'caso_id': caso_id,
+        'detector': detector,
+        'ultima': ultima_transaccion_id,
+        'estado': json.dumps(estado, default=str)
+    })
+
+def obtener_delta_caso(db, caso_id, ultima_transaccion_id):
+    # Solo el lado ordenante, igual que los detectores de ventana: una
+    # transacción donde el miembro solo recibe no cambia sus detecciones
+    query = text("""
+        SELECT
+            MAX(t.transaccion_id) as ultima_transaccion_id,
+            MIN(t.fecha_operacion) as primera_fecha,
+            COUNT(*) as num_transacciones
+        FROM transacciones t
+        WHERE t.transaccion_id > :ultima
+            AND t.ordenante_id IN (SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id)
+    """)
+    return dict(db.execute(query, {'caso_id': caso_id, 'ultima': ultima_transaccion_id}).fetchone()._mapping)
+
+def obtener_personas_estado(db, caso_id):
+    query = text("SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id ORDER BY persona_id")
+    return [row.persona_id for row in db.execute(query, {'caso_id': caso_id}).fetchall()]
+
+def contiene_transacciones_nuevas(deteccion, ultima_transaccion_id):
+    ids = deteccion.get('transacciones_ids') or deteccion.get('todas_transacciones') or []
+    for item in ids:
+        if isinstance(item, list):
+            if any(trx_id > ultima_transaccion_id for trx_id in item):
+                return True
+        elif item > ultima_transaccion_id:
+            return True
+    return False
+
+def ejecutar_detector_ventana(caso_id, detector, funcion, params, ventana, personas, tipologia):
+    # Detectores con ventana temporal: solo se relee el delta más el solape
+    # de la ventana abierta anterior a la primera transacción nueva
+    with get_db() as db:
+        ultima_id, estado = obtener_estado_detector(db, caso_id, detector)
+        if estado.get('personas') != personas or estado.get('params') != params:
+            ultima_id = 0
+        delta = obtener_delta_caso(db, caso_id, ultima_id)
+
+    if not delta['num_transacciones']:
+        return []
+
+    desde_fecha = None
+    if ultima_id:
+        desde_fecha = delta['primera_fecha'] - ventana
+
+    detecciones = funcion(caso_id, desde_fecha=desde_fecha, **params)
+    if ultima_id:
+        detecciones = [d for d in detecciones if contiene_transacciones_nuevas(d, ultima_id)]
+
+    # Guardar antes de avanzar el estado: si falla, el delta se relee entero
+    # en la próxima pasada. Sin marcar obsoletas, el delta no ve todo el caso
+    procesar_detecciones(caso_id, tipologia, detecciones, marcar_obsoletas=False)
+
+    with get_db() as db:
+        guardar_estado_detector(db, caso_id, detector, delta['ultima_transaccion_id'], {
+            'personas': personas,
+            'params': params,
+            'ventana_abierta_desde': delta['primera_fecha'] - ventana
+        })
+
+    return detecciones
+
+def ejecutar_frecuencia_incremental(caso_id, tipologia, params, personas=None):
+    # Línea base acumulada por ordenante: conteo y monto por periodo, el
+    # mismo que usa detectar_frecuencia_inusual con estos parámetros. Otro
+    # periodo o parámetros invalidan las series guardadas
+    periodo = params.get('periodo') or periodo_por_ventana(params['ventana_dias'])
+    with get_db() as db:
+        ultima_id, estado = obtener_estado_detector(db, caso_id, 'frecuencia_inusual')
+        if (estado.get('personas') != personas or estado.get('params') != params
+                or estado.get('periodo') != periodo):
+            ultima_id, estado = 0, {}
+
+        query = text("""
+            SELECT
+                t.ordenante_id,
+                DATE_TRUNC(:periodo, t.fecha_operacion)::date as periodo,
+                COUNT(*) as num_operaciones,
+                SUM(t.monto) as monto_total,
+                MAX(t.transaccion_id) as ultima_transaccion_id
+            FROM transacciones t
+            JOIN casos_personas cp ON t.ordenante_id = cp.persona_id
+            WHERE cp.caso_id = :caso_id
+                AND t.transaccion_id > :ultima
+            GROUP BY t.ordenante_id, DATE_TRUNC(:periodo, t.fecha_operacion)
+        """)
+        delta = db.execute(query, {'caso_id': caso_id, 'ultima': ultima_id, 'periodo': periodo}).fetchall()
+
+    if not delta:
+        return []
+
+    series = estado.get('series', {})
+    periodos_nuevos = set()
+    nueva_ultima_id = ultima_id
+
+    for row in delta:
+        serie = series.setdefault(str(row.ordenante_id), {})
+        clave = row.periodo.isoformat()
+        num, monto = serie.get(clave, [0, 0.0])
+        serie[clave] = [num + row.num_operaciones, monto + float(row.monto_total)]
+        periodos_nuevos.add((str(row.ordenante_id), clave))
+        nueva_ultima_id = max(nueva_ultima_id, row.ultima_transaccion_id)
+
+    filas = [
+        (int(ordenante), date.fromisoformat(clave), num, monto)
+        for ordenante in {o for o, _ in periodos_nuevos}
+        for clave, (num, monto) in series[ordenante].items()
+    ]
+    puntajes = calcular_puntajes_anomalia(
+        pd.DataFrame(filas, columns=['persona_id', 'periodo', 'num_operaciones', 'monto_total']),
+        periodo, params['metodo'], params['periodos_base']
+    )
+    nuevos = pd.Series([(o, c) for o, c in zip(puntajes['persona_id'].astype(str), puntajes['periodo'].astype(str))])
+    picos = puntajes[
+        nuevos.isin(periodos_nuevos).to_numpy() &
+        (puntajes['puntaje_z'] >= params['umbral_z']).to_numpy() &
+        (puntajes['num_operaciones'] > puntajes['linea_base'] * params['factor_incremento']).to_numpy()
+    ]
+
+    detecciones = [
+        {
+            'periodo': fila.periodo,
+            'persona_id': int(fila.persona_id),
+            'num_operaciones': int(fila.num_operaciones),
+            'monto_total': float(fila.monto_total),
+            'linea_base': round(float(fila.linea_base), 2),
+            'puntaje_z': round(float(fila.puntaje_z), 2),
+            'factor_incremento': round(float(fila.num_operaciones / max(fila.linea_base, 1)), 2)
+        }
+        for fila in picos.itertuples()
+    ]
+    procesar_detecciones(caso_id, tipologia, detecciones, marcar_obsoletas=False)
+
+    with get_db() as db:
+        guardar_estado_detector(db, caso_id, 'frecuencia_inusual', nueva_ultima_id, {
+            'personas': personas,
+            'params': params,
+            'periodo': periodo,
+            'series': series
+        })
+
+    return sorted(detecciones, key=lambda d: d['puntaje_z'], reverse=True)
+
+# Detector incremental -> tipología del catálogo bajo la que se guardan sus
+# detecciones; los parámetros del catálogo son los valores por defecto
+TIPOLOGIAS_INCREMENTALES = {
+    'pitufeo': 'TIP001',
+    'ventanas_cortas': 'TIP006',
+    'frecuencia_inusual': 'TIP009'
+}
+
+def ejecutar_analisis_incremental(caso_id, params=None, tipologias=None):
+    params = params or {}
+    activas = {t['codigo']: t for t in (tipologias or obtener_tipologias_activas())}
+
+    with get_db() as db:
+        personas = obtener_personas_estado(db, caso_id)
+
+    resultados = {}
+    tipologia = activas.get(TIPOLOGIAS_INCREMENTALES['pitufeo'])
+    if tipologia:
+        catalogo = leer_parametros(tipologia)
+        params_pitufeo = {
+            nombre: params.get(nombre, catalogo.get(nombre, defecto))
+            for nombre, defecto in (('umbral_monto', 10000), ('ventana_dias', 30), ('min_operaciones', 5))
+        }
+        resultados['pitufeo'] = ejecutar_detector_ventana(
+            caso_id, 'pitufeo', detectar_pitufeo, params_pitufeo,
+            timedelta(days=params_pitufeo['ventana_dias']), personas, tipologia
+        )
+
+    tipologia = activas.get(TIPOLOGIAS_INCREMENTALES['ventanas_cortas'])
+    if tipologia:
+        catalogo = leer_parametros(tipologia)
+        params_ventanas = {
+            nombre: params.get(nombre, catalogo.get(nombre, defecto))
+            for nombre, defecto in (('ventana_horas', 2), ('min_operaciones', 5))
+        }
+        resultados['ventanas_cortas'] = ejecutar_detector_ventana(
+            caso_id, 'ventanas_cortas', detectar_ventanas_cortas, params_ventanas,
+            timedelta(days=params_ventanas['ventana_horas'] // 24 + 1), personas, tipologia
+        )
+
+    tipologia = activas.get(TIPOLOGIAS_INCREMENTALES['frecuencia_inusual'])
+    if tipologia:
+        catalogo = leer_parametros(tipologia)
+        params_frecuencia = {
+            nombre: params.get(nombre, catalogo.get(nombre, defecto))
+            for nombre, defecto in (
+                ('ventana_dias', 7), ('factor_incremento', 3), ('metodo', 'mediana'), ('periodos_base', 8),
+                ('umbral_z', 3.5), ('periodo', None)
+            )
+        }
+        resultados['frecuencia_inusual'] = ejecutar_frecuencia_incremental(
+            caso_id, tipologia, params_frecuencia, personas
+        )
+
+    return resultados
+
+def refrescar_casos_activos(params=None):
+    with get_db() as db:
+        query = text("SELECT caso_id FROM casos WHERE estado = 'ACTIVO' ORDER BY caso_id")
+        casos = [row.caso_id for row in db.execute(query).fetchall()]
+
+    tipologias = obtener_tipologias_activas()
+    return {caso_id: ejecutar_analisis_incremental(caso_id, params, tipologias) for caso_id in casos}
+
+if __name__ == '__main__':
+    resultados = refrescar_casos_activos()
+    for caso_id, por_detector in resultados.items():
+        print(caso_id, {detector: len(detecciones) for detector, detecciones in por_detector.items()})
@@ -0,0 +1,169 @@
+from database import get_db, reiniciar_pool
+import json
+import time
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import text
+from cubo import fijar_version_caso
+from tipologias import ejecutar_deteccion_tipologias, obtener_tipologias_activas
+from utils import calcular_hash
+
+# Casos en paralelo y tipologías en paralelo dentro de cada caso; el total
+# de conexiones abiertas ronda el producto de ambos
+CASOS_PARALELOS = 2
+TIPOLOGIAS_PARALELAS = 2
+
+def listar_casos_activos():
+    with get_db() as db:
+        query = text("SELECT caso_id FROM casos WHERE estado = 'ACTIVO' ORDER BY caso_id")
+        return [row.caso_id for row in db.execute(query).fetchall()]
+
+def obtener_version_catalogo():
+    # Un cambio de umbrales en el catálogo también obliga a reprocesar
+    tipologias = obtener_tipologias_activas()
+    return calcular_hash(json.dumps(
+        sorted((t['codigo'], t['parametros']) for t in tipologias), default=str
+    ))
+
+def obtener_ultima_version_procesada(db, caso_id):
+    query = text("""
+        SELECT version_datos
+        FROM corridas_lote_casos
+        WHERE caso_id = :caso_id AND estado = 'COMPLETADO'
+        ORDER BY fecha_fin DESC
+        LIMIT 1
+    """)
+    return db.execute(query, {'caso_id': caso_id}).scalar()
+
+def ultima_ejecucion_tipologia(db):
+    return db.execute(text("SELECT COALESCE(MAX(ejecucion_tipologia_id), 0) FROM ejecuciones_tipologias")).scalar()
+
+def tipologias_fallidas(db, caso_id, desde_ejecucion):
+    # ejecutar_tipologia no propaga TIMEOUT/ERROR: solo los deja registrados
+    query = text("""
+        SELECT codigo, estado
+        FROM ejecuciones_tipologias
+        WHERE caso_id = :caso_id
+            AND ejecucion_tipologia_id > :desde
+            AND estado IN ('TIMEOUT', 'ERROR')
+        ORDER BY codigo
+    """)
+    return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id, 'desde': desde_ejecucion}).fetchall()]
+
+def procesar_caso(corrida_id, caso_id, version_catalogo, tipologias_paralelas, forzar=False):
+    inicio = time.time()
+    version_datos = fijar_version_caso(caso_id)
+    version = calcular_hash(f"{version_datos}|{version_catalogo}")
+
+    if not forzar:
+        with get_db() as db:
+            if obtener_ultima_version_procesada(db, caso_id) == version:
+                return {'caso_id': caso_id, 'estado': 'OMITIDO', 'detecciones': {}}
+
+    with get_db() as db:
+        desde_ejecucion = ultima_ejecucion_tipologia(db)
+
+    estado = 'COMPLETADO'
+    error = None
+    detecciones = Counter()
+    try:
+        for deteccion in ejecutar_deteccion_tipologias(caso_id, tipologias_paralelas, version_datos):
+            detecciones[deteccion['tipologia']] += 1
+        with get_db() as db:
+            fallidas = tipologias_fallidas(db, caso_id, desde_ejecucion)
+        if fallidas:
+            estado = 'PARCIAL'
+            error = ', '.join(f"{f['codigo']}: {f['estado']}" for f in fallidas)
+    except Exception as e:
+        estado = 'ERROR'
+        error = str(e)
+
+    # Solo una corrida completa marca la versión como procesada; con
+    # tipologías fallidas el caso se reintenta en la próxima corrida
+    if estado != 'COMPLETADO':
+        version = None
+
+    with get_db() as db:
+        query = text("""
+            INSERT INTO corridas_lote_casos
+            (corrida_id, caso_id, version_datos, estado, duracion_ms, num_detecciones,
+             detecciones_por_tipologia, error, fecha_fin)
+            VALUES (:corrida_id, :caso_id, :version, :estado, :duracion_ms, :num_detecciones,
+                    :detecciones, :error, CURRENT_TIMESTAMP)
+        """)
+        db.execute(query, {
+            'corrida_id': corrida_id,
+            'caso_id': caso_id,
+            'version': version,
+            'estado': estado,
+            'duracion_ms': int((time.time() - inicio) * 1000),
+            'num_detecciones': sum(detecciones.values()),
+            'detecciones': json.dumps(detecciones),
+            'error': error
+        })
+
+    return {'caso_id': caso_id, 'estado': estado, 'detecciones': dict(detecciones)}
+
+def ejecutar_lote_tipologias(casos_paralelos=CASOS_PARALELOS, tipologias_paralelas=TIPOLOGIAS_PARALELAS,
+                             forzar=False):
+    inicio = time.time()
+    casos = listar_casos_activos()
+    version_catalogo = obtener_version_catalogo()
+
+    with get_db() as db:
+        corrida_id = db.execute(text("""
+            INSERT INTO corridas_lote (casos_activos) VALUES (:casos_activos) RETURNING corrida_id
+        """), {'casos_activos': len(casos)}).fetchone()[0]
+
+    estados = Counter()
+    detecciones = Counter()
+
+    with ProcessPoolExecutor(max_workers=casos_paralelos, initializer=reiniciar_pool) as pool:
+        futuros = [
+            pool.submit(procesar_caso, corrida_id, caso_id, version_catalogo, tipologias_paralelas, forzar)
+            for caso_id in casos
+        ]
+        for futuro in as_completed(futuros):
+            try:
+                resultado = futuro.result()
+            except Exception:
+                estados['ERROR'] += 1
+                continue
+            estados[resultado['estado']] += 1
+            detecciones.update(resultado['detecciones'])
+
+    resumen = {
+        'corrida_id': corrida_id,
+        'casos_activos': len(casos),
+        'casos_procesados': estados['COMPLETADO'],
+        'casos_omitidos': estados['OMITIDO'],
+        'casos_con_error': estados['ERROR'],
+        'casos_parciales': estados['PARCIAL'],
+        'duracion_segundos': round(time.time() - inicio, 2),
+        'detecciones_por_tipologia': dict(detecciones)
+    }
+
+    with get_db() as db:
+        db.execute(text("""
+            UPDATE corridas_lote SET
+                fecha_fin = CURRENT_TIMESTAMP,
+                casos_procesados = :casos_procesados,
+                casos_omitidos = :casos_omitidos,
+                casos_con_error = :casos_con_error,
+                casos_parciales = :casos_parciales,
+                duracion_segundos = :duracion_segundos,
+                detecciones_por_tipologia = :detecciones
+            WHERE corrida_id = :corrida_id
+        """), {**resumen, 'detecciones': json.dumps(resumen['detecciones_por_tipologia'])})
+
+    return resumen
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detección de tipologías sobre todos los casos activos')
+    parser.add_argument('--casos-paralelos', type=int, default=CASOS_PARALELOS)
+    parser.add_argument('--tipologias-paralelas', type=int, default=TIPOLOGIAS_PARALELAS)
+    parser.add_argument('--forzar', action='store_true', help='Reprocesar aunque los datos no hayan cambiado')
+    args = parser.parse_args()
+
+    print(ejecutar_lote_tipologias(args.casos_paralelos, args.tipologias_paralelas, args.forzar))
@@ -13,7 +13,8 @@ from casos import (
     obtener_personas_por_busqueda, agregar_busqueda_a_caso
 )
 from analisis import generar_resumen_analisis
-from tipologias import ejecutar_deteccion_tipologias, obtener_tipologias_por_caso
+from incremental import refrescar_casos_activos
+from tipologias import ejecutar_deteccion_tipologias, obtener_tipologias_por_caso, obtener_detalle_deteccion
 from redes import generar_reporte_red, exportar_para_visualizacion
 from reportes import (
     generar_reporte_ejecutivo, exportar_transacciones_excel,
@@ -110,6 +111,8 @@ def pagina_carga_datos():
     
     if archivo:
         st.info(f"Archivo: {archivo.name}")
+        evaluar_en_linea = st.checkbox("Evaluar tipologías durante la carga", value=False)
+        refrescar_casos = st.checkbox("Actualizar detecciones de casos activos", value=False)
         
         if st.button("Procesar Archivo", type="primary"):
             with st.spinner("Procesando..."):
@@ -118,7 +121,7 @@ def pagina_carga_datos():
                     with open(temp_path, "wb") as f:
                         f.write(archivo.getbuffer())
                     
-                    resultado = procesar_archivo_ro(temp_path, archivo.name)
+                    resultado = procesar_archivo_ro(temp_path, archivo.name, evaluar_en_linea=evaluar_en_linea)
                     
                     os.remove(temp_path)
                     
@@ -128,6 +131,14 @@ def pagina_carga_datos():
                     col1.metric("Total Registros", resultado['total'])
                     col2.metric("Registros Válidos", resultado['validos'])
                     col3.metric("Registros Descartados", resultado['descartados'])
+                    if evaluar_en_linea:
+                        st.metric("Alertas en línea", resultado['alertas'])
+                    if refrescar_casos:
+                        actualizados = refrescar_casos_activos()
+                        st.metric("Detecciones nuevas en casos activos", sum(
+                            len(detecciones) for por_detector in actualizados.values()
+                            for detecciones in por_detector.values()
+                        ))
                     
                 except Exception as e:
                     st.error(f"❌ Error al procesar archivo: {str(e)}")
@@ -327,10 +338,12 @@ def pagina_analisis_transaccional():
                         st.dataframe(pd.DataFrame(analisis['pitufeo']), use_container_width=True)
                 
                 with tabs[7]:
-                    st.write(f"Cadenas detectadas: {len(analisis['cadenas'])}")
+                    prefijo = "≥ " if analisis['cadenas_truncadas'] else ""
+                    st.write(f"Cadenas detectadas: {prefijo}{analisis['total_cadenas']}")
                 
                 with tabs[8]:
-                    st.write(f"Ciclos detectados: {len(analisis['circularidad'])}")
+                    prefijo = "≥ " if analisis['ciclos_truncados'] else ""
+                    st.write(f"Ciclos detectados: {prefijo}{analisis['total_ciclos']}")
                 
             except Exception as e:
                 st.error(f"❌ Error en análisis: {str(e)}")
@@ -386,9 +399,13 @@ def pagina_tipologias():
             st.write(f"**Código:** {tip_detalle['codigo']}")
             st.write(f"**Categoría:** {tip_detalle['categoria']}")
             
-            if tip_detalle['evidencias']:
-                with st.expander("Ver Evidencias"):
-                    st.json(tip_detalle['evidencias'])
+            with st.expander("Ver Evidencias"):
+                evidencias = obtener_detalle_deteccion(detalle)
+                if evidencias:
+                    st.json(evidencias['evidencias'] or {})
+                    if evidencias['evidencias_detalle']:
+                        st.json(evidencias['evidencias_detalle'], expanded=False)
+                    st.write(f"**Transacciones relacionadas:** {len(evidencias['transacciones_relacionadas'] or [])}")
     else:
         st.info("No se han detectado tipologías para este caso")
 
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+# Grafo como matriz de adyacencia CSR con ids enteros 0..n-1; 'nodos'
+# traduce de vuelta al id original (persona_id o 'CTA_...').
+
+def matriz_desde_aristas(origen, destino, peso, nodos=None):
+    # origen/destino: arreglos de ids de nodo; aristas repetidas se suman
+    origen = np.asarray(origen)
+    destino = np.asarray(destino)
+    if nodos is None:
+        nodos = pd.unique(np.concatenate([origen, destino]))
+    indice = pd.Index(nodos, dtype=object if origen.dtype == object else None)
+    n = len(indice)
+    filas = indice.get_indexer(origen)
+    columnas = indice.get_indexer(destino)
+    pesos = sparse.csr_matrix((np.asarray(peso, dtype=float), (filas, columnas)), shape=(n, n))
+    conteos = sparse.csr_matrix((np.ones(len(filas)), (filas, columnas)), shape=(n, n))
+    return {'nodos': list(indice), 'pesos': pesos, 'estructura': (conteos > 0).astype(float).tocsr()}
+
+def matriz_desde_grafo(G, weight='peso'):
+    aristas = list(G.edges(data=weight, default=1))
+    # Ids mixtos (persona_id enteros y 'CTA_...'): arreglos object para no
+    # convertirlos todos a texto
+    origen = np.array([u for u, _, _ in aristas], dtype=object)
+    destino = np.array([v for _, v, _ in aristas], dtype=object)
+    peso = [p if p is not None else 1 for _, _, p in aristas]
+    return matriz_desde_aristas(origen, destino, peso, nodos=list(G.nodes()))
+
+def a_diccionario(matriz, valores):
+    return {nodo: float(valor) for nodo, valor in zip(matriz['nodos'], valores)}
+
+def fuerza_salida(matriz):
+    return np.asarray(matriz['pesos'].sum(axis=1)).ravel()
+
+def fuerza_entrada(matriz):
+    return np.asarray(matriz['pesos'].sum(axis=0)).ravel()
+
+def grado_salida(matriz):
+    return np.diff(matriz['estructura'].indptr)
+
+def grado_entrada(matriz):
+    return np.bincount(matriz['estructura'].indices, minlength=len(matriz['nodos']))
+
+def centralidad_grado(matriz, sentido='total'):
+    # Misma normalización que networkx: grado / (n - 1)
+    n = len(matriz['nodos'])
+    grados = {
+        'entrada': grado_entrada(matriz),
+        'salida': grado_salida(matriz),
+        'total': grado_entrada(matriz) + grado_salida(matriz)
+    }[sentido]
+    return grados / (n - 1) if n > 1 else np.ones(n)
+
+def pagerank(matriz, alpha=0.85, max_iter=100, tol=1.0e-6):
+    # Iteración de potencia sobre la matriz de transición por filas; los
+    # nodos sin salida reparten uniformemente, igual que nx.pagerank
+    n = len(matriz['nodos'])
+    if n == 0:
+        return np.array([])
+    salida = fuerza_salida(matriz)
+    sin_salida = salida == 0
+    inversa = np.divide(1.0, salida, out=np.zeros(n), where=~sin_salida)
+    transicion_t = (sparse.diags(inversa) @ matriz['pesos']).T.tocsr()
+
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        anterior = x
+        x = alpha * (transicion_t @ anterior + anterior[sin_salida].sum() / n) + (1 - alpha) / n
+        if np.abs(x - anterior).sum() < n * tol:
+            return x
+    raise RuntimeError(f"pagerank no convergió en {max_iter} iteraciones")
+
+def etiquetar_componentes(matriz, conexion='weak'):
+    num, etiquetas = connected_components(matriz['estructura'], directed=True, connection=conexion)
+    return num, etiquetas
+
+def componentes(matriz, conexion='weak'):
+    num, etiquetas = etiquetar_componentes(matriz, conexion)
+    nodos = np.asarray(matriz['nodos'], dtype=object)
+    orden = np.argsort(etiquetas, kind='stable')
+    cortes = np.cumsum(np.bincount(etiquetas, minlength=num))[:-1]
+    return [list(grupo) for grupo in np.split(nodos[orden], cortes)]
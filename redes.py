@@ -1,103 +1,330 @@
 import networkx as nx
 from database import get_db
+import os
+import math
+import pickle
+import stat
+import random
+import tempfile
+import time
+import heapq
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import json
 from sqlalchemy import text
+from casos import obtener_version_datos_caso
+import red_dispersa
+
+# Grafo y métricas por caso guardados en disco; se reconstruyen solo cuando
+# cambia la versión de datos del caso o la configuración del cálculo. El
+# directorio debe ser privado del usuario de la aplicación (se cargan pickles)
+DIRECTORIO_CACHE_REDES = os.getenv(
+    'DIRECTORIO_CACHE_REDES', os.path.join(os.path.expanduser('~'), '.cache', 'uif', 'redes')
+)
+
+MODOS_CALCULO = ('auto', 'exacto', 'aproximado')
+BACKENDS = ('auto', 'networkx', 'disperso')
+
+# Hasta este tamaño betweenness y closeness se calculan exactos; por encima
+# se muestrean K_MUESTRAS_CENTRALIDAD pivotes (o los que pida error_objetivo)
+MAX_NODOS_EXACTO = 5000
+K_MUESTRAS_CENTRALIDAD = 500
+SEMILLA_MUESTREO = 42
+
+# Desde este número de aristas grado, fuerza, PageRank y componentes se
+# calculan sobre la matriz CSR de red_dispersa en lugar de networkx
+MIN_ARISTAS_DISPERSO = 50000
+
+# Betweenness y closeness se reparten por componente débil entre procesos
+# cuando el grafo tiene al menos MIN_NODOS_PARALELO nodos; PageRank y grado
+# se siguen calculando sobre el grafo completo
+MAX_PROCESOS_METRICAS = os.cpu_count() or 1
+MIN_NODOS_PARALELO = 2000
 
 def construir_grafo_caso(caso_id, incluir_cuentas=True):
-    transacciones = obtener_transacciones_caso(caso_id)
+    aristas = obtener_aristas_caso(caso_id)
     
     G = nx.DiGraph()
     
-    for trx in transacciones:
-        ordenante = trx['ordenante_id']
-        beneficiario = trx['beneficiario_id']
-        monto = float(trx['monto'])
-        
-        if not G.has_node(ordenante):
-            G.add_node(ordenante, tipo='persona', documento=trx['doc_ordenante'])
-        if not G.has_node(beneficiario):
-            G.add_node(beneficiario, tipo='persona', documento=trx['doc_beneficiario'])
-        
-        if incluir_cuentas and trx['cuenta_ordenante']:
-            cuenta_ord = f"CTA_{trx['cuenta_ordenante']}"
-            G.add_node(cuenta_ord, tipo='cuenta', numero=trx['cuenta_ordenante'])
-            G.add_edge(ordenante, cuenta_ord, tipo='titular')
-        
-        if incluir_cuentas and trx['cuenta_beneficiario']:
-            cuenta_ben = f"CTA_{trx['cuenta_beneficiario']}"
-            G.add_node(cuenta_ben, tipo='cuenta', numero=trx['cuenta_beneficiario'])
-            G.add_edge(cuenta_ben, beneficiario, tipo='titular')
-        
-        if G.has_edge(ordenante, beneficiario):
-            G[ordenante][beneficiario]['peso'] += monto
-            G[ordenante][beneficiario]['num_transacciones'] += 1
-        else:
-            G.add_edge(ordenante, beneficiario, peso=monto, num_transacciones=1)
+    # Nodos persona con su documento, una sola vez por persona
+    documentos = pd.concat([
+        aristas[['ordenante_id', 'doc_ordenante']].set_axis(['persona_id', 'documento'], axis=1),
+        aristas[['beneficiario_id', 'doc_beneficiario']].set_axis(['persona_id', 'documento'], axis=1)
+    ]).drop_duplicates('persona_id')
+    G.add_nodes_from(
+        (persona_id, {'tipo': 'persona', 'documento': documento})
+        for persona_id, documento in documentos.itertuples(index=False)
+    )
+    
+    if incluir_cuentas:
+        for columna_persona, columna_cuenta, saliente in (
+            ('ordenante_id', 'cuenta_ordenante', True),
+            ('beneficiario_id', 'cuenta_beneficiario', False)
+        ):
+            titulares = aristas[[columna_persona, columna_cuenta]].dropna().drop_duplicates()
+            titulares = titulares[titulares[columna_cuenta] != '']
+            G.add_nodes_from(
+                (f"CTA_{cuenta}", {'tipo': 'cuenta', 'numero': cuenta})
+                for cuenta in titulares[columna_cuenta].unique()
+            )
+            G.add_edges_from(
+                (persona_id, f"CTA_{cuenta}", {'tipo': 'titular'}) if saliente
+                else (f"CTA_{cuenta}", persona_id, {'tipo': 'titular'})
+                for persona_id, cuenta in titulares.itertuples(index=False)
+            )
+    
+    # Aristas de flujo ya agregadas por par ordenante -> beneficiario
+    flujos = aristas.groupby(['ordenante_id', 'beneficiario_id'], sort=False).agg(
+        peso=('peso', 'sum'), num_transacciones=('num_transacciones', 'sum')
+    ).reset_index()
+    G.add_edges_from(
+        (ordenante, beneficiario, {'peso': float(peso), 'num_transacciones': int(num)})
+        for ordenante, beneficiario, peso, num in flujos.itertuples(index=False)
+    )
     
     return G
 
-def obtener_transacciones_caso(caso_id):
+def obtener_aristas_caso(caso_id):
+    # Una fila por (ordenante, beneficiario, cuentas) con monto y conteo;
+    # cada transacción cuenta una vez aunque ambas partes sean del caso
     with get_db() as db:
         query = text("""
+            WITH personas_caso AS (
+                SELECT persona_id FROM casos_personas WHERE caso_id = :caso_id
+            )
             SELECT 
-                t.transaccion_id,
                 t.ordenante_id,
                 t.beneficiario_id,
-                t.monto,
-                t.fecha_operacion,
                 po.documento_encriptado as doc_ordenante,
                 pb.documento_encriptado as doc_beneficiario,
                 t.cuenta_ordenante,
-                t.cuenta_beneficiario
+                t.cuenta_beneficiario,
+                SUM(t.monto) as peso,
+                COUNT(*) as num_transacciones
             FROM transacciones t
             JOIN personas po ON t.ordenante_id = po.persona_id
             JOIN personas pb ON t.beneficiario_id = pb.persona_id
-            JOIN casos_personas cp ON (
-                t.ordenante_id = cp.persona_id OR 
-                t.beneficiario_id = cp.persona_id
-            )
-            WHERE cp.caso_id = :caso_id
+            WHERE t.ordenante_id IN (SELECT persona_id FROM personas_caso)
+                OR t.beneficiario_id IN (SELECT persona_id FROM personas_caso)
+            GROUP BY t.ordenante_id, t.beneficiario_id, po.documento_encriptado, pb.documento_encriptado,
+                     t.cuenta_ordenante, t.cuenta_beneficiario
         """)
-        return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id}).fetchall()]
+        aristas = pd.DataFrame(
+            [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id}).fetchall()],
+            columns=['ordenante_id', 'beneficiario_id', 'doc_ordenante', 'doc_beneficiario',
+                     'cuenta_ordenante', 'cuenta_beneficiario', 'peso', 'num_transacciones']
+        )
+    aristas['peso'] = aristas['peso'].astype(float)
+    return aristas
 
-def calcular_metricas_centralidad(G):
-    metricas = {}
+def resolver_modo_calculo(G, modo='auto', k_muestras=None, error_objetivo=None):
+    n = G.number_of_nodes()
+    if modo == 'auto':
+        modo = 'exacto' if n <= MAX_NODOS_EXACTO else 'aproximado'
+    if modo == 'exacto':
+        return {'modo': 'exacto', 'num_nodos': n, 'k_muestras': None, 'closeness': 'armonica'}
     
-    try:
-        metricas['degree_centrality'] = nx.degree_centrality(G)
-    except:
-        metricas['degree_centrality'] = {}
+    # Con error_objetivo e: k ~ ln(n) / e^2 pivotes (cota tipo Hoeffding)
+    if k_muestras is None and error_objetivo:
+        k_muestras = math.ceil(math.log(max(n, 2)) / error_objetivo ** 2)
+    k_muestras = min(k_muestras or K_MUESTRAS_CENTRALIDAD, n)
+    return {
+        'modo': 'aproximado', 'num_nodos': n, 'k_muestras': k_muestras,
+        'error_objetivo': error_objetivo, 'closeness': 'armonica'
+    }
+
+def fuentes_muestreo(sub, k_muestras):
+    return random.Random(SEMILLA_MUESTREO).sample(sorted(sub.nodes(), key=str), k_muestras)
+
+def cercania_armonica(sub, k_muestras, total_nodos):
+    # Harmonic closeness normalizada por n - 1 del grafo completo, desde k
+    # fuentes al azar del componente (k = n es el valor exacto): cada fuente
+    # se elige con probabilidad k / n, de ahí la escala n / k
+    cercania = dict.fromkeys(sub.nodes(), 0.0)
+    for fuente in fuentes_muestreo(sub, k_muestras):
+        for nodo, distancia in nx.single_source_shortest_path_length(sub, fuente).items():
+            if distancia > 0:
+                cercania[nodo] += 1 / distancia
+    escala = sub.number_of_nodes() / k_muestras / (total_nodos - 1)
+    return {nodo: valor * escala for nodo, valor in cercania.items()}
+
+def metricas_componente(sub, total_nodos, modo_calculo):
+    # Betweenness y closeness de un componente débil, normalizadas respecto
+    # del grafo completo: entre componentes no hay caminos, así que el
+    # resultado coincide con calcularlas sobre todo el grafo
+    n = sub.number_of_nodes()
+    k = modo_calculo.get('k_muestras')
+    muestreo = modo_calculo['modo'] == 'aproximado' and k is not None and n > k
     
-    try:
-        metricas['in_degree_centrality'] = nx.in_degree_centrality(G)
-    except:
-        metricas['in_degree_centrality'] = {}
+    if n < 3 or total_nodos < 3:
+        betweenness = dict.fromkeys(sub.nodes(), 0.0)
+    else:
+        # Fuentes elegidas acá y sumas crudas por fuente: la corrección n / k
+        # de networkx al muestrear cambió entre versiones (3.5+ ya la aplica
+        # sin normalizar); betweenness_centrality_subset sin normalizar no
+        # reescala grafos dirigidos, así que toda la escala se aplica abajo
+        fuentes = fuentes_muestreo(sub, k) if muestreo else list(sub.nodes())
+        crudo = nx.betweenness_centrality_subset(
+            sub, fuentes, list(sub.nodes()), normalized=False, weight='peso'
+        )
+        escala = (n / k if muestreo else 1) / ((total_nodos - 1) * (total_nodos - 2))
+        betweenness = {nodo: valor * escala for nodo, valor in crudo.items()}
     
-    try:
-        metricas['out_degree_centrality'] = nx.out_degree_centrality(G)
-    except:
-        metricas['out_degree_centrality'] = {}
+    # Closeness armónica en los dos modos, para que los valores se puedan
+    # comparar entre casos chicos y grandes; en modo exacto todas las
+    # fuentes, al muestrear k
+    if n < 2:
+        closeness = dict.fromkeys(sub.nodes(), 0.0)
+    else:
+        closeness = cercania_armonica(sub, k if muestreo else n, total_nodos)
     
-    try:
-        metricas['betweenness_centrality'] = nx.betweenness_centrality(G, weight='peso')
-    except:
-        metricas['betweenness_centrality'] = {}
+    return betweenness, closeness
+
+def metricas_componentes(subgrafos, total_nodos, modo_calculo):
+    # Tarea del pool: un lote de componentes
+    betweenness = {}
+    closeness = {}
+    for sub in subgrafos:
+        b, c = metricas_componente(sub, total_nodos, modo_calculo)
+        betweenness.update(b)
+        closeness.update(c)
+    return betweenness, closeness
+
+def repartir_componentes(componentes, num_lotes):
+    # Componentes de mayor a menor al lote con menos nodos acumulados
+    lotes = [(0, i, []) for i in range(num_lotes)]
+    heapq.heapify(lotes)
+    for componente in sorted(componentes, key=len, reverse=True):
+        carga, i, lote = heapq.heappop(lotes)
+        lote.append(componente)
+        heapq.heappush(lotes, (carga + len(componente), i, lote))
+    return [lote for _, _, lote in lotes if lote]
+
+def calcular_metricas_por_componente(G, modo_calculo, procesos=None):
+    componentes = list(nx.weakly_connected_components(G))
+    total_nodos = G.number_of_nodes()
+    procesos = procesos or MAX_PROCESOS_METRICAS
     
-    try:
-        metricas['closeness_centrality'] = nx.closeness_centrality(G)
-    except:
-        metricas['closeness_centrality'] = {}
+    if procesos <= 1 or len(componentes) <= 1 or total_nodos < MIN_NODOS_PARALELO:
+        betweenness, closeness = metricas_componentes(
+            [G.subgraph(c) for c in componentes], total_nodos, modo_calculo
+        )
+        return betweenness, closeness, 1
     
-    try:
-        metricas['pagerank'] = nx.pagerank(G, weight='peso')
-    except:
-        metricas['pagerank'] = {}
+    lotes = repartir_componentes(componentes, min(procesos * 2, len(componentes)))
+    betweenness = {}
+    closeness = {}
+    with ProcessPoolExecutor(max_workers=min(procesos, len(lotes))) as pool:
+        futuros = [
+            pool.submit(metricas_componentes, [G.subgraph(c).copy() for c in lote], total_nodos, modo_calculo)
+            for lote in lotes
+        ]
+        for futuro in futuros:
+            b, c = futuro.result()
+            betweenness.update(b)
+            closeness.update(c)
+    return betweenness, closeness, min(procesos, len(lotes))
+
+class MetricasRed:
+    # Cada métrica se calcula una sola vez por grafo y modo, a pedido; las
+    # funciones de este módulo comparten la instancia vía MetricasRed.de(G)
+    CALCULOS = {
+        'degree_centrality': lambda m: nx.degree_centrality(m.G),
+        'in_degree_centrality': lambda m: nx.in_degree_centrality(m.G),
+        'out_degree_centrality': lambda m: nx.out_degree_centrality(m.G),
+        'betweenness_centrality': lambda m: m.por_componente()[0],
+        'closeness_centrality': lambda m: m.por_componente()[1],
+        'pagerank': lambda m: nx.pagerank(m.G, weight='peso'),
+        'fuerza_entrada': lambda m: dict(m.G.in_degree(weight='peso')),
+        'fuerza_salida': lambda m: dict(m.G.out_degree(weight='peso')),
+        'grado_ponderado': lambda m: dict(m.G.degree(weight='peso'))
+    }
+    
+    CALCULOS_DISPERSOS = {
+        'degree_centrality': lambda m: red_dispersa.centralidad_grado(m.matriz, 'total'),
+        'in_degree_centrality': lambda m: red_dispersa.centralidad_grado(m.matriz, 'entrada'),
+        'out_degree_centrality': lambda m: red_dispersa.centralidad_grado(m.matriz, 'salida'),
+        'pagerank': lambda m: red_dispersa.pagerank(m.matriz),
+        'fuerza_entrada': lambda m: red_dispersa.fuerza_entrada(m.matriz),
+        'fuerza_salida': lambda m: red_dispersa.fuerza_salida(m.matriz),
+        'grado_ponderado': lambda m: red_dispersa.fuerza_entrada(m.matriz) + red_dispersa.fuerza_salida(m.matriz)
+    }
     
+    # Las que devuelve calcular_metricas_centralidad
+    CENTRALIDADES = (
+        'degree_centrality', 'in_degree_centrality', 'out_degree_centrality',
+        'betweenness_centrality', 'closeness_centrality', 'pagerank'
+    )
+    
+    _instancias = weakref.WeakKeyDictionary()
+    
+    def __init__(self, G, modo='auto', k_muestras=None, error_objetivo=None, backend='auto'):
+        self.G = G
+        if backend == 'auto':
+            backend = 'disperso' if G.number_of_edges() >= MIN_ARISTAS_DISPERSO else 'networkx'
+        self.backend = backend
+        self.modo_calculo = {**resolver_modo_calculo(G, modo, k_muestras, error_objetivo), 'backend': backend}
+        self.firma = (G.number_of_nodes(), G.number_of_edges())
+        self.valores = {}
+        self.tiempos = {}
+        self._matriz = None
+        self._por_componente = None
+    
+    @classmethod
+    def de(cls, G, modo='auto', k_muestras=None, error_objetivo=None, backend='auto'):
+        # Reutiliza la instancia del grafo si sigue vigente (mismo modo y
+        # mismo tamaño); si no, arranca una nueva
+        instancias = cls._instancias.setdefault(G, {})
+        clave = (modo, k_muestras, error_objetivo, backend)
+        metricas = instancias.get(clave)
+        if metricas is None or metricas.firma != (G.number_of_nodes(), G.number_of_edges()):
+            metricas = instancias[clave] = cls(G, modo, k_muestras, error_objetivo, backend)
+        return metricas
+    
+    @property
+    def matriz(self):
+        if self._matriz is None:
+            inicio = time.perf_counter()
+            self._matriz = red_dispersa.matriz_desde_grafo(self.G)
+            self.tiempos['matriz'] = round(time.perf_counter() - inicio, 4)
+        return self._matriz
+    
+    def por_componente(self):
+        # Betweenness y closeness salen juntas de la misma pasada por componentes
+        if self._por_componente is None:
+            inicio = time.perf_counter()
+            betweenness, closeness, procesos = calcular_metricas_por_componente(self.G, self.modo_calculo)
+            self._por_componente = (betweenness, closeness)
+            self.modo_calculo['procesos'] = procesos
+            self.tiempos['por_componente'] = round(time.perf_counter() - inicio, 4)
+        return self._por_componente
+    
+    def __getitem__(self, nombre):
+        if nombre not in self.valores:
+            inicio = time.perf_counter()
+            try:
+                if self.backend == 'disperso' and nombre in self.CALCULOS_DISPERSOS:
+                    valores = red_dispersa.a_diccionario(self.matriz, self.CALCULOS_DISPERSOS[nombre](self))
+                else:
+                    valores = self.CALCULOS[nombre](self)
+            except Exception:
+                valores = {}
+            self.valores[nombre] = valores
+            self.tiempos[nombre] = round(time.perf_counter() - inicio, 4)
+        return self.valores[nombre]
+    
+    def todas(self):
+        return {nombre: self[nombre] for nombre in self.CENTRALIDADES}
+
+def calcular_metricas_centralidad(G, modo='auto', k_muestras=None, error_objetivo=None, backend='auto'):
+    metricas_red = MetricasRed.de(G, modo, k_muestras, error_objetivo, backend)
+    metricas = metricas_red.todas()
+    metricas['modo_calculo'] = metricas_red.modo_calculo
     return metricas
 
-def identificar_intermediarios(G, top_n=10):
-    betweenness = nx.betweenness_centrality(G, weight='peso')
+def identificar_intermediarios(G, top_n=10, modo='auto', backend='auto'):
+    betweenness = MetricasRed.de(G, modo, backend=backend)['betweenness_centrality']
     
     intermediarios = sorted(
         betweenness.items(),
@@ -152,8 +379,13 @@ def encontrar_caminos_criticos(G, origen, destino, max_caminos=5):
         return []
 
 def analizar_componentes_conexas(G):
-    componentes_debiles = list(nx.weakly_connected_components(G))
-    componentes_fuertes = list(nx.strongly_connected_components(G))
+    if G.number_of_edges() >= MIN_ARISTAS_DISPERSO:
+        matriz = MetricasRed.de(G).matriz
+        componentes_debiles = red_dispersa.componentes(matriz, 'weak')
+        componentes_fuertes = red_dispersa.componentes(matriz, 'strong')
+    else:
+        componentes_debiles = list(nx.weakly_connected_components(G))
+        componentes_fuertes = list(nx.strongly_connected_components(G))
     
     return {
         'num_componentes_debiles': len(componentes_debiles),
@@ -195,11 +427,97 @@ def exportar_para_visualizacion(G):
         'links': aristas
     }
 
-def generar_reporte_red(caso_id):
-    G = construir_grafo_caso(caso_id)
-    
-    metricas = calcular_metricas_centralidad(G)
-    intermediarios = identificar_intermediarios(G)
+def directorio_cache_privado():
+    # Crea el directorio con 0700 y solo lo usa si es del usuario actual y
+    # nadie más puede escribir en él; si no, se trabaja sin caché
+    try:
+        os.makedirs(DIRECTORIO_CACHE_REDES, mode=0o700, exist_ok=True)
+        estado = os.stat(DIRECTORIO_CACHE_REDES, follow_symlinks=False)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(estado.st_mode) or estado.st_uid != os.getuid():
+        return None
+    if estado.st_mode & 0o077:
+        os.chmod(DIRECTORIO_CACHE_REDES, 0o700)
+    return DIRECTORIO_CACHE_REDES
+
+def configuracion_calculo(modo, backend):
+    if modo not in MODOS_CALCULO:
+        raise ValueError(f"Modo de cálculo no válido: {modo!r}")
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend no válido: {backend!r}")
+    # Los umbrales entran en la clave: con otros valores 'auto' resuelve distinto
+    return {
+        'modo': modo,
+        'backend': backend,
+        'max_nodos_exacto': MAX_NODOS_EXACTO,
+        'k_muestras': K_MUESTRAS_CENTRALIDAD,
+        'min_aristas_disperso': MIN_ARISTAS_DISPERSO
+    }
+
+def ruta_cache_red(directorio, caso_id, modo, backend):
+    return os.path.join(directorio, f"red_caso_{int(caso_id)}_{modo}_{backend}.pkl")
+
+def leer_cache_red(caso_id, version, configuracion):
+    directorio = directorio_cache_privado()
+    if directorio is None:
+        return None
+    ruta = ruta_cache_red(directorio, caso_id, configuracion['modo'], configuracion['backend'])
+    try:
+        with open(ruta, 'rb') as f:
+            if os.fstat(f.fileno()).st_uid != os.getuid():
+                return None
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cache.get('version') != version or cache.get('configuracion') != configuracion:
+        return None
+    return cache
+
+def guardar_cache_red(caso_id, cache):
+    directorio = directorio_cache_privado()
+    if directorio is None:
+        return
+    # Escritura atómica: la UI y los reportes pueden leer mientras tanto
+    configuracion = cache['configuracion']
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporal, ruta_cache_red(directorio, caso_id, configuracion['modo'], configuracion['backend']))
+
+def invalidar_cache_red(caso_id):
+    directorio = directorio_cache_privado()
+    if directorio is None:
+        return
+    for modo in MODOS_CALCULO:
+        for backend in BACKENDS:
+            try:
+                os.remove(ruta_cache_red(directorio, caso_id, modo, backend))
+            except FileNotFoundError:
+                pass
+
+def obtener_red_caso(caso_id, modo='auto', backend='auto'):
+    configuracion = configuracion_calculo(modo, backend)
+    version = obtener_version_datos_caso(caso_id)
+    cache = leer_cache_red(caso_id, version, configuracion)
+    if cache is None:
+        G = construir_grafo_caso(caso_id)
+        cache = {
+            'version': version,
+            'configuracion': configuracion,
+            'grafo': G,
+            'reporte': calcular_reporte_red(G, modo, backend)
+        }
+        guardar_cache_red(caso_id, cache)
+    return cache
+
+def obtener_grafo_caso(caso_id):
+    return obtener_red_caso(caso_id)['grafo']
+
+def calcular_reporte_red(G, modo='auto', backend='auto'):
+    metricas = calcular_metricas_centralidad(G, modo, backend=backend)
+    intermediarios = identificar_intermediarios(G, modo=modo, backend=backend)
+    nodos_criticos = buscar_nodos_criticos(G, modo=modo, backend=backend)
     comunidades = detectar_comunidades(G)
     componentes = analizar_componentes_conexas(G)
     densidad = calcular_densidad_red(G)
@@ -207,18 +525,28 @@ def generar_reporte_red(caso_id):
     return {
         'metricas_centralidad': metricas,
         'intermediarios': intermediarios,
+        'nodos_criticos': nodos_criticos,
+        'tiempos_metricas': dict(MetricasRed.de(G, modo, backend=backend).tiempos),
         'comunidades': comunidades,
         'componentes': componentes,
         'densidad': densidad,
         'grafo_json': exportar_para_visualizacion(G)
     }
 
-def buscar_nodos_criticos(G, percentil=90):
-    metricas = calcular_metricas_centralidad(G)
+def generar_reporte_red(caso_id, usar_cache=True, modo='auto', backend='auto'):
+    if not usar_cache:
+        invalidar_cache_red(caso_id)
+    return obtener_red_caso(caso_id, modo, backend)['reporte']
+
+def buscar_nodos_criticos(G, percentil=90, modo='auto', backend='auto'):
+    metricas = calcular_metricas_centralidad(G, modo, backend=backend)
     
     nodos_criticos = set()
     
-    for metrica_nombre, valores in metricas.items():
+    nombres_metricas = [nombre for nombre in metricas if nombre != 'modo_calculo']
+    
+    for metrica_nombre in nombres_metricas:
+        valores = metricas[metrica_nombre]
         if not valores:
             continue
         
@@ -236,7 +564,7 @@ def buscar_nodos_criticos(G, percentil=90):
                 'documento': G.nodes[nodo].get('documento'),
                 'metricas': {
                     nombre: metricas[nombre].get(nodo, 0)
-                    for nombre in metricas.keys()
+                    for nombre in nombres_metricas
                 }
             })
     
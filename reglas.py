@@ -0,0 +1,188 @@
+from database import get_db
+import json
+from functools import lru_cache
+from sqlalchemy import text
+from analisis import paginar_detecciones
+
+# Reglas declarativas guardadas en catalogos_tipologias.parametros['regla'].
+# Ejemplo (estructuración bajo umbral por semana):
+# {
+#     "persona": "ordenante",
+#     "filtros": [{"campo": "monto", "op": "<", "valor": 10000}],
+#     "ventana_dias": 90,
+#     "periodo": "week",
+#     "agrupar_por": ["canal"],
+#     "condiciones": [
+#         {"agregado": "count", "op": ">=", "valor": 5},
+#         {"agregado": "sum", "campo": "monto", "op": ">=", "valor": 30000}
+#     ],
+#     "orden": "monto_total"
+# }
+# Solo se aceptan columnas, operadores y agregados de las listas blancas;
+# todos los valores viajan como parámetros enlazados.
+
+PERSONAS = {
+    'ordenante': 't.ordenante_id',
+    'beneficiario': 't.beneficiario_id',
+    'ejecutante': 't.ejecutante_id'
+}
+
+CAMPOS = {
+    'monto': 't.monto',
+    'fecha_operacion': 't.fecha_operacion',
+    'canal': 't.canal',
+    'codigo_moneda': 't.codigo_moneda',
+    'tipo_operacion_sbs': 't.tipo_operacion_sbs',
+    'codigo_ubigeo': 't.codigo_ubigeo',
+    'origen_dinero': 't.origen_dinero',
+    'ordenante_id': 't.ordenante_id',
+    'beneficiario_id': 't.beneficiario_id',
+    'ejecutante_id': 't.ejecutante_id',
+    'dep_ordenante': 't.dep_ordenante',
+    'dep_beneficiario': 't.dep_beneficiario',
+    'es_sospechosa': 't.es_sospechosa'
+}
+
+OPERADORES = {'=': '=', '!=': '<>', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+AGREGADOS = {
+    'count': 'COUNT({})',
+    'count_distinct': 'COUNT(DISTINCT {})',
+    'sum': 'SUM({})',
+    'avg': 'AVG({})',
+    'min': 'MIN({})',
+    'max': 'MAX({})'
+}
+
+PERIODOS = {'day', 'week', 'month'}
+
+ORDENES = {'monto_total', 'num_operaciones', 'fecha_fin'}
+
+def validar_campo(campo):
+    if campo not in CAMPOS:
+        raise ValueError(f"Campo no permitido en regla: {campo!r}")
+    return CAMPOS[campo]
+
+def validar_operador(op):
+    if op not in OPERADORES and op not in ('in', 'not in'):
+        raise ValueError(f"Operador no permitido en regla: {op!r}")
+
+def compilar_filtro(filtro, nombre, valores):
+    columna = validar_campo(filtro['campo'])
+    op = filtro['op']
+    validar_operador(op)
+    valores[nombre] = filtro['valor']
+
+    if op in ('in', 'not in'):
+        if not isinstance(filtro['valor'], list):
+            raise ValueError(f"El operador {op!r} requiere una lista de valores")
+        negacion = 'NOT ' if op == 'not in' else ''
+        return f"{negacion}({columna} = ANY(:{nombre}))"
+    return f"{columna} {OPERADORES[op]} :{nombre}"
+
+def compilar_condicion(condicion, nombre, valores):
+    agregado = condicion.get('agregado', 'count')
+    if agregado not in AGREGADOS:
+        raise ValueError(f"Agregado no permitido en regla: {agregado!r}")
+    campo = condicion.get('campo')
+    if campo is None and agregado != 'count':
+        raise ValueError(f"El agregado {agregado!r} requiere un campo")
+    op = condicion['op']
+    if op not in OPERADORES:
+        raise ValueError(f"Operador no permitido en condición: {op!r}")
+
+    expresion = AGREGADOS[agregado].format(validar_campo(campo) if campo else '*')
+    alias = f"{agregado}_{campo}" if campo else agregado
+    valores[nombre] = condicion['valor']
+    return expresion, alias, f"{expresion} {OPERADORES[op]} :{nombre}"
+
+@lru_cache(maxsize=256)
+def compilar_regla(regla_json):
+    # La clave de caché es el JSON canónico de la regla: la misma regla
+    # en distintos casos y corridas reutiliza la sentencia ya compilada
+    regla = json.loads(regla_json)
+
+    persona = regla.get('persona', 'ordenante')
+    if persona not in PERSONAS:
+        raise ValueError(f"Persona no permitida en regla: {persona!r}")
+    columna_persona = PERSONAS[persona]
+
+    condiciones = regla.get('condiciones') or []
+    if not condiciones:
+        raise ValueError("La regla debe tener al menos una condición de agregado")
+
+    valores = {}
+    filtros = [
+        compilar_filtro(filtro, f"f{i}", valores)
+        for i, filtro in enumerate(regla.get('filtros') or [])
+    ]
+    if regla.get('ventana_dias') is not None:
+        valores['ventana_dias'] = int(regla['ventana_dias'])
+        filtros.append("t.fecha_operacion >= CURRENT_DATE - make_interval(days => :ventana_dias)")
+
+    claves = [f"{columna_persona}", "p.documento_encriptado"]
+    columnas = [f"{columna_persona} as persona_id", "p.documento_encriptado"]
+
+    periodo = regla.get('periodo')
+    if periodo is not None:
+        if periodo not in PERIODOS:
+            raise ValueError(f"Periodo no permitido en regla: {periodo!r}")
+        claves.append(f"DATE_TRUNC('{periodo}', t.fecha_operacion)")
+        columnas.append(f"DATE_TRUNC('{periodo}', t.fecha_operacion)::date as periodo")
+
+    for campo in regla.get('agrupar_por') or []:
+        claves.append(validar_campo(campo))
+        columnas.append(f"{validar_campo(campo)} as {campo}")
+
+    having = []
+    alias_usados = {'count', 'sum_monto'}
+    for i, condicion in enumerate(condiciones):
+        expresion, alias, comparacion = compilar_condicion(condicion, f"c{i}", valores)
+        having.append(comparacion)
+        if alias not in alias_usados:
+            alias_usados.add(alias)
+            columnas.append(f"{expresion} as {alias}")
+
+    orden = regla.get('orden', 'monto_total')
+    if orden not in ORDENES:
+        raise ValueError(f"Orden no permitido en regla: {orden!r}")
+
+    where = ''.join(f"\n                AND {filtro}" for filtro in filtros)
+    sql = f"""
+            SELECT
+                {', '.join(columnas)},
+                COUNT(*) as num_operaciones,
+                SUM(t.monto) as monto_total,
+                MIN(t.fecha_operacion) as fecha_inicio,
+                MAX(t.fecha_operacion) as fecha_fin,
+                ARRAY_AGG(t.transaccion_id ORDER BY t.transaccion_id) as transacciones_ids
+            FROM transacciones t
+            JOIN casos_personas cp ON {columna_persona} = cp.persona_id
+            JOIN personas p ON {columna_persona} = p.persona_id
+            WHERE cp.caso_id = :caso_id{where}
+            GROUP BY {', '.join(claves)}
+            HAVING {' AND '.join(having)}
+            ORDER BY {orden} DESC
+            LIMIT :limit OFFSET :offset
+        """
+    return text(sql), valores
+
+def normalizar_regla(regla):
+    if isinstance(regla, str):
+        regla = json.loads(regla)
+    return json.dumps(regla, sort_keys=True)
+
+def ejecutar_regla(caso_id, regla, limit=None, offset=0, solo_resumen=False):
+    query, valores = compilar_regla(normalizar_regla(regla))
+    with get_db() as db:
+        return paginar_detecciones([dict(row._mapping) for row in db.execute(query, {
+            **valores,
+            'caso_id': caso_id,
+            'limit': limit,
+            'offset': offset
+        }).fetchall()], solo_resumen=solo_resumen)
+
+def validar_regla(regla):
+    # Para validar al guardar en el catálogo: lanza ValueError si no compila
+    compilar_regla(normalizar_regla(regla))
+    return True
@@ -244,7 +244,7 @@ def exportar_transacciones_excel(caso_id):
     return output
 
 def exportar_tipologias_excel(caso_id):
-    tipologias = obtener_tipologias_por_caso(caso_id)
+    tipologias = obtener_tipologias_por_caso(caso_id, incluir_resumen=True)
     # Convertir a dict si son Rows
     data = [convertir_a_dict(t) for t in tipologias]
     
@@ -1,3 +1,15 @@
+DROP TABLE IF EXISTS aristas_globales_generacion CASCADE;
+DROP TABLE IF EXISTS aristas_globales CASCADE;
+DROP TABLE IF EXISTS alertas_tiempo_real CASCADE;
+DROP TABLE IF EXISTS estado_tiempo_real CASCADE;
+DROP TABLE IF EXISTS corridas_lote_casos CASCADE;
+DROP TABLE IF EXISTS corridas_lote CASCADE;
+DROP TABLE IF EXISTS ejecuciones_tipologias CASCADE;
+DROP TABLE IF EXISTS tamizaje_candidatos CASCADE;
+DROP TABLE IF EXISTS tamizaje_lotes CASCADE;
+DROP TABLE IF EXISTS tamizaje_particiones CASCADE;
+DROP TABLE IF EXISTS tamizaje_ejecuciones CASCADE;
+DROP TABLE IF EXISTS estado_analisis_caso CASCADE;
 DROP TABLE IF EXISTS tipologias_detectadas CASCADE;
 DROP TABLE IF EXISTS casos_personas CASCADE;
 DROP TABLE IF EXISTS transacciones CASCADE;
@@ -131,9 +143,140 @@ CREATE TABLE tipologias_detectadas (
     fecha_deteccion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     nivel_confianza NUMERIC(5,2),
     evidencias JSONB,
+    evidencias_detalle BYTEA,
     transacciones_relacionadas INTEGER[],
+    num_transacciones INTEGER DEFAULT 0,
     observaciones TEXT,
-    estado VARCHAR(50) DEFAULT 'PENDIENTE'
+    estado VARCHAR(50) DEFAULT 'PENDIENTE',
+    huella VARCHAR(64) NOT NULL,
+    vigente BOOLEAN DEFAULT TRUE,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE ejecuciones_tipologias (
+    ejecucion_tipologia_id SERIAL PRIMARY KEY,
+    caso_id INTEGER REFERENCES casos(caso_id) ON DELETE CASCADE,
+    tipologia_id INTEGER REFERENCES catalogos_tipologias(tipologia_id),
+    codigo VARCHAR(50),
+    fecha_ejecucion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    duracion_ms INTEGER,
+    num_detecciones INTEGER DEFAULT 0,
+    estado VARCHAR(50),
+    error TEXT
+);
+
+CREATE TABLE estado_analisis_caso (
+    caso_id INTEGER REFERENCES casos(caso_id) ON DELETE CASCADE,
+    detector VARCHAR(50) NOT NULL,
+    ultima_transaccion_id INTEGER DEFAULT 0,
+    estado JSONB,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (caso_id, detector)
+);
+
+CREATE TABLE tamizaje_ejecuciones (
+    ejecucion_id SERIAL PRIMARY KEY,
+    fecha_inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    num_particiones INTEGER NOT NULL,
+    parametros JSONB,
+    estado VARCHAR(50) DEFAULT 'EN_PROCESO'
+);
+
+CREATE TABLE tamizaje_lotes (
+    ejecucion_id INTEGER REFERENCES tamizaje_ejecuciones(ejecucion_id) ON DELETE CASCADE,
+    particion INTEGER NOT NULL,
+    codigo_tipologia VARCHAR(50) NOT NULL,
+    estado VARCHAR(50) DEFAULT 'PENDIENTE',
+    num_candidatos INTEGER DEFAULT 0,
+    duracion_segundos NUMERIC(10,2),
+    fecha_fin TIMESTAMP,
+    PRIMARY KEY (ejecucion_id, particion, codigo_tipologia)
+);
+
+CREATE TABLE tamizaje_particiones (
+    ejecucion_id INTEGER REFERENCES tamizaje_ejecuciones(ejecucion_id) ON DELETE CASCADE,
+    particion INTEGER NOT NULL,
+    persona_id INTEGER NOT NULL,
+    PRIMARY KEY (ejecucion_id, particion, persona_id)
+);
+
+CREATE TABLE tamizaje_candidatos (
+    candidato_id SERIAL PRIMARY KEY,
+    ejecucion_id INTEGER REFERENCES tamizaje_ejecuciones(ejecucion_id) ON DELETE CASCADE,
+    tipologia_id INTEGER REFERENCES catalogos_tipologias(tipologia_id),
+    persona_id INTEGER REFERENCES personas(persona_id),
+    periodo_inicio DATE,
+    periodo_fin DATE,
+    num_operaciones INTEGER,
+    monto_total NUMERIC(20,2),
+    evidencias JSONB,
+    estado VARCHAR(50) DEFAULT 'PENDIENTE',
+    caso_id INTEGER REFERENCES casos(caso_id),
+    fecha_deteccion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE corridas_lote (
+    corrida_id SERIAL PRIMARY KEY,
+    fecha_inicio TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    fecha_fin TIMESTAMP,
+    casos_activos INTEGER DEFAULT 0,
+    casos_procesados INTEGER DEFAULT 0,
+    casos_omitidos INTEGER DEFAULT 0,
+    casos_con_error INTEGER DEFAULT 0,
+    casos_parciales INTEGER DEFAULT 0,
+    duracion_segundos NUMERIC(10,2),
+    detecciones_por_tipologia JSONB
+);
+
+CREATE TABLE corridas_lote_casos (
+    corrida_id INTEGER REFERENCES corridas_lote(corrida_id) ON DELETE CASCADE,
+    caso_id INTEGER REFERENCES casos(caso_id) ON DELETE CASCADE,
+    version_datos VARCHAR(64),
+    estado VARCHAR(50),
+    duracion_ms INTEGER,
+    num_detecciones INTEGER DEFAULT 0,
+    detecciones_por_tipologia JSONB,
+    error TEXT,
+    fecha_fin TIMESTAMP,
+    PRIMARY KEY (corrida_id, caso_id)
+);
+
+CREATE TABLE estado_tiempo_real (
+    persona_id INTEGER PRIMARY KEY REFERENCES personas(persona_id) ON DELETE CASCADE,
+    estado JSONB NOT NULL,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE alertas_tiempo_real (
+    alerta_id SERIAL PRIMARY KEY,
+    ro_id INTEGER REFERENCES registros_operaciones(ro_id),
+    persona_id INTEGER REFERENCES personas(persona_id),
+    codigo_tipologia VARCHAR(50) NOT NULL,
+    transaccion_id INTEGER REFERENCES transacciones(transaccion_id),
+    fecha_operacion DATE,
+    detalle JSONB,
+    estado VARCHAR(50) DEFAULT 'PENDIENTE',
+    fecha_alerta TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE aristas_globales (
+    ordenante_id INTEGER NOT NULL REFERENCES personas(persona_id),
+    beneficiario_id INTEGER NOT NULL REFERENCES personas(persona_id),
+    num_transacciones INTEGER NOT NULL,
+    monto_total DECIMAL(18,2) NOT NULL,
+    fecha_primera DATE NOT NULL,
+    fecha_ultima DATE NOT NULL,
+    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Id de la transacción de base que escribió la fila; grafo_global lo
+    -- compara con el xmin de su última lectura para releer solo lo nuevo
+    xid_actualizacion BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint,
+    PRIMARY KEY (ordenante_id, beneficiario_id)
+);
+
+-- Se incrementa en cada reconstrucción completa de aristas_globales
+CREATE TABLE aristas_globales_generacion (
+    generacion INTEGER NOT NULL
 );
 
 CREATE INDEX idx_transacciones_fecha ON transacciones(fecha_operacion);
@@ -147,6 +290,17 @@ CREATE INDEX idx_casos_personas_caso ON casos_personas(caso_id);
 CREATE INDEX idx_casos_personas_persona ON casos_personas(persona_id);
 CREATE INDEX idx_tipologias_caso ON tipologias_detectadas(caso_id);
 CREATE INDEX idx_tipologias_persona ON tipologias_detectadas(persona_id);
+CREATE UNIQUE INDEX idx_tipologias_huella ON tipologias_detectadas(caso_id, tipologia_id, huella);
+CREATE INDEX idx_ejecuciones_tipologias_caso ON ejecuciones_tipologias(caso_id, fecha_ejecucion);
+CREATE INDEX idx_corridas_lote_casos_caso ON corridas_lote_casos(caso_id, fecha_fin);
+CREATE INDEX idx_alertas_tiempo_real_estado ON alertas_tiempo_real(estado, fecha_alerta);
+CREATE INDEX idx_alertas_tiempo_real_persona ON alertas_tiempo_real(persona_id);
+CREATE INDEX idx_aristas_globales_beneficiario ON aristas_globales(beneficiario_id);
+CREATE INDEX idx_aristas_globales_xid ON aristas_globales(xid_actualizacion);
+CREATE INDEX idx_tamizaje_candidatos_ejecucion ON tamizaje_candidatos(ejecucion_id, estado);
+CREATE INDEX idx_tamizaje_candidatos_persona ON tamizaje_candidatos(persona_id);
+
+INSERT INTO aristas_globales_generacion (generacion) VALUES (0);
 
 INSERT INTO catalogos_tipologias (codigo, nombre, descripcion, categoria, nivel_riesgo, parametros) VALUES
 ('TIP001', 'Pitufeo', 'Múltiples transacciones bajo umbral de reporte', 'ESTRUCTURACION', 8, '{"umbral_monto": 10000, "min_operaciones": 5, "ventana_dias": 30}'),
@@ -158,4 +312,5 @@ INSERT INTO catalogos_tipologias (codigo, nombre, descripcion, categoria, nivel_
 ('TIP007', 'Cadenas de transferencia', 'Transacciones encadenadas A→B→C→D', 'LAYERING', 9, '{"min_eslabones": 3}'),
 ('TIP008', 'Transferencias inmediatas', 'Fondos transferidos al instante de recibidos', 'PASS_THROUGH', 8, '{"ventana_minutos": 30}'),
 ('TIP009', 'Frecuencia inusual', 'Incremento súbito en volumen operativo', 'ANOMALIA', 6, '{"factor_incremento": 3}'),
-('TIP010', 'Montos redondos', 'Transacciones en cifras exactas', 'PATRON', 5, '{"min_operaciones": 5}');
+('TIP010', 'Montos redondos', 'Transacciones en cifras exactas', 'PATRON', 5, '{"min_operaciones": 5}'),
+('TIP011', 'Fraccionamiento semanal', 'Depósitos bajo umbral repartidos en varios beneficiarios en la misma semana', 'ESTRUCTURACION', 7, '{"regla": {"persona": "ordenante", "filtros": [{"campo": "monto", "op": "<", "valor": 10000}], "ventana_dias": 90, "periodo": "week", "condiciones": [{"agregado": "count", "op": ">=", "valor": 5}, {"agregado": "count_distinct", "campo": "beneficiario_id", "op": ">=", "valor": 3}]}}');
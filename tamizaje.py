@@ -0,0 +1,391 @@
+from database import get_db, reiniciar_pool
+import json
+import time
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from sqlalchemy import text
+from tipologias import obtener_tipologias_activas, leer_parametros
+from analisis import calcular_puntajes_anomalia, fecha_de_periodo, periodo_por_ventana
+from casos import crear_caso, agregar_persona_a_caso
+
+NUM_PARTICIONES = 64
+PROCESOS = 8
+
+# Reparto estable de personas entre particiones, calculado una vez por
+# ejecución sobre personas y guardado en tamizaje_particiones
+REPARTO_PARTICIONES = "MOD(hashint4(persona_id)::bigint + 2147483648, :num_particiones)"
+
+# Cada lote filtra por la lista de personas de su partición, así la consulta
+# entra por los índices de ordenante/beneficiario en vez de recorrer todas
+# las transacciones en cada (partición, tipología)
+FILTRO_PARTICION = """{columna} IN (
+            SELECT persona_id FROM tamizaje_particiones
+            WHERE ejecucion_id = :ejecucion_id AND particion = :particion
+        )"""
+
+# Consultas poblacionales por tipología con las mismas ventanas que el detector
+# de cada una (ventana deslizante en TIP001, ventana hasta CURRENT_DATE en
+# TIP002/TIP003), reescritas para toda la base en una pasada. Son un
+# pre-filtro: un candidato promovido a caso vuelve a pasar por el detector.
+# Cada una devuelve persona_id, periodo_inicio, periodo_fin, num_operaciones,
+# monto_total y evidencias, y se restringe a la partición mediante {filtro}.
+CONSULTAS_TAMIZAJE = {
+    'TIP001': ("t.ordenante_id", {'umbral_monto': 10000, 'min_operaciones': 5, 'ventana_dias': 30}, """
+        WITH dias AS (
+            SELECT
+                t.ordenante_id,
+                t.beneficiario_id,
+                t.fecha_operacion as fecha,
+                COUNT(*) as num_operaciones,
+                SUM(t.monto) as monto_total
+            FROM transacciones t
+            WHERE {filtro}
+                AND t.monto < :umbral_monto
+            GROUP BY t.ordenante_id, t.beneficiario_id, t.fecha_operacion
+        ),
+        ventanas AS (
+            SELECT
+                ordenante_id,
+                beneficiario_id,
+                fecha as periodo_inicio,
+                MAX(fecha) OVER w as periodo_fin,
+                SUM(num_operaciones) OVER w as num_operaciones,
+                SUM(monto_total) OVER w as monto_total
+            FROM dias
+            WINDOW w AS (
+                PARTITION BY ordenante_id, beneficiario_id ORDER BY fecha
+                RANGE BETWEEN CURRENT ROW AND make_interval(days => :ventana_dias) FOLLOWING
+            )
+        )
+        SELECT DISTINCT ON (ordenante_id, beneficiario_id)
+            ordenante_id as persona_id,
+            periodo_inicio,
+            periodo_fin,
+            num_operaciones,
+            monto_total,
+            jsonb_build_object(
+                'beneficiario_id', beneficiario_id,
+                'monto_promedio', ROUND((monto_total / num_operaciones)::numeric, 2)
+            ) as evidencias
+        FROM ventanas
+        WHERE num_operaciones >= :min_operaciones
+        ORDER BY ordenante_id, beneficiario_id, num_operaciones DESC, monto_total DESC
+    """),
+    'TIP002': ("t.beneficiario_id", {'min_ordenantes': 5, 'ventana_dias': 30}, """
+        SELECT
+            t.beneficiario_id as persona_id,
+            MIN(t.fecha_operacion) as periodo_inicio,
+            MAX(t.fecha_operacion) as periodo_fin,
+            COUNT(*) as num_operaciones,
+            SUM(t.monto) as monto_total,
+            jsonb_build_object('num_ordenantes', COUNT(DISTINCT t.ordenante_id)) as evidencias
+        FROM transacciones t
+        WHERE {filtro}
+            AND t.fecha_operacion >= CURRENT_DATE - :ventana_dias
+        GROUP BY t.beneficiario_id
+        HAVING COUNT(DISTINCT t.ordenante_id) >= :min_ordenantes
+    """),
+    'TIP003': ("t.ordenante_id", {'min_beneficiarios': 10, 'ventana_dias': 30}, """
+        SELECT
+            t.ordenante_id as persona_id,
+            MIN(t.fecha_operacion) as periodo_inicio,
+            MAX(t.fecha_operacion) as periodo_fin,
+            COUNT(*) as num_operaciones,
+            SUM(t.monto) as monto_total,
+            jsonb_build_object('num_beneficiarios', COUNT(DISTINCT t.beneficiario_id)) as evidencias
+        FROM transacciones t
+        WHERE {filtro}
+            AND t.fecha_operacion >= CURRENT_DATE - :ventana_dias
+        GROUP BY t.ordenante_id
+        HAVING COUNT(DISTINCT t.beneficiario_id) >= :min_beneficiarios
+    """),
+    # Series por persona y periodo; los picos se puntúan en Python con
+    # calcular_puntajes_anomalia, igual que detectar_frecuencia_inusual
+    'TIP009': ("t.ordenante_id", {
+        'ventana_dias': 7, 'factor_incremento': 3.0, 'metodo': 'mediana', 'periodos_base': 8,
+        'umbral_z': 3.5, 'periodo': None
+    }, """
+        SELECT
+            t.ordenante_id as persona_id,
+            DATE_TRUNC(:periodo, t.fecha_operacion)::date as periodo,
+            COUNT(*) as num_operaciones,
+            SUM(t.monto) as monto_total
+        FROM transacciones t
+        WHERE {filtro}
+        GROUP BY t.ordenante_id, DATE_TRUNC(:periodo, t.fecha_operacion)
+    """),
+    'TIP010': ("t.ordenante_id", {'min_operaciones': 5}, """
+        SELECT
+            t.ordenante_id as persona_id,
+            MIN(t.fecha_operacion) as periodo_inicio,
+            MAX(t.fecha_operacion) as periodo_fin,
+            COUNT(*) as num_operaciones,
+            SUM(t.monto) as monto_total,
+            '{{}}'::jsonb as evidencias
+        FROM transacciones t
+        WHERE {filtro}
+            AND t.monto = ROUND(t.monto, -3)
+        GROUP BY t.ordenante_id
+        HAVING COUNT(*) >= :min_operaciones
+    """)
+}
+
+def crear_ejecucion_tamizaje(num_particiones=NUM_PARTICIONES, codigos=None):
+    tipologias = [
+        t for t in obtener_tipologias_activas()
+        if t['codigo'] in CONSULTAS_TAMIZAJE and (not codigos or t['codigo'] in codigos)
+    ]
+
+    parametros = {
+        t['codigo']: {
+            'tipologia_id': t['tipologia_id'],
+            'params': {**CONSULTAS_TAMIZAJE[t['codigo']][1], **leer_parametros(t)}
+        }
+        for t in tipologias
+    }
+
+    with get_db() as db:
+        ejecucion_id = db.execute(text("""
+            INSERT INTO tamizaje_ejecuciones (num_particiones, parametros)
+            VALUES (:num_particiones, :parametros)
+            RETURNING ejecucion_id
+        """), {
+            'num_particiones': num_particiones,
+            'parametros': json.dumps(parametros)
+        }).fetchone()[0]
+
+        db.execute(text(f"""
+            INSERT INTO tamizaje_particiones (ejecucion_id, particion, persona_id)
+            SELECT :ejecucion_id, {REPARTO_PARTICIONES}, persona_id
+            FROM personas
+        """), {'ejecucion_id': ejecucion_id, 'num_particiones': num_particiones})
+        # Estadísticas al día para que el planificador estime bien cada partición
+        db.execute(text("ANALYZE tamizaje_particiones"))
+
+        db.execute(text("""
+            INSERT INTO tamizaje_lotes (ejecucion_id, particion, codigo_tipologia)
+            SELECT :ejecucion_id, p, c
+            FROM generate_series(0, :num_particiones - 1) p, UNNEST(CAST(:codigos AS VARCHAR[])) c
+        """), {
+            'ejecucion_id': ejecucion_id,
+            'num_particiones': num_particiones,
+            'codigos': list(parametros.keys())
+        })
+
+    return ejecucion_id
+
+def candidatos_frecuencia(db, consulta, params):
+    periodo = params.get('periodo') or periodo_por_ventana(params['ventana_dias'])
+    series = pd.DataFrame(
+        db.execute(text(consulta), {**params, 'periodo': periodo}).fetchall(),
+        columns=['persona_id', 'periodo', 'num_operaciones', 'monto_total']
+    )
+    if series.empty:
+        return []
+
+    puntajes = calcular_puntajes_anomalia(series, periodo, params['metodo'], params['periodos_base'])
+    picos = puntajes[
+        (puntajes['puntaje_z'] >= params['umbral_z']) &
+        (puntajes['num_operaciones'] > puntajes['linea_base'] * params['factor_incremento'])
+    ]
+    fines = (fecha_de_periodo(picos['numero'] + 1, periodo) - pd.Timedelta(days=1)).dt.date
+    return [
+        {
+            'persona_id': int(fila.persona_id),
+            'periodo_inicio': fila.periodo,
+            'periodo_fin': fin,
+            'num_operaciones': int(fila.num_operaciones),
+            'monto_total': float(fila.monto_total),
+            'evidencias': json.dumps({
+                'linea_base': round(float(fila.linea_base), 2),
+                'puntaje_z': round(float(fila.puntaje_z), 2),
+                'factor_incremento': round(float(fila.num_operaciones / max(fila.linea_base, 1)), 2)
+            })
+        }
+        for fila, fin in zip(picos.itertuples(), fines)
+    ]
+
+# Tipologías cuyos candidatos salen de puntuar en Python las filas de su
+# consulta en vez de insertarlas directamente
+PUNTUACION_TAMIZAJE = {'TIP009': candidatos_frecuencia}
+
+def procesar_lote(ejecucion_id, particion, codigo, tipologia_id, params):
+    columna, _, consulta = CONSULTAS_TAMIZAJE[codigo]
+    consulta = consulta.format(filtro=FILTRO_PARTICION.format(columna=columna))
+    inicio = time.time()
+
+    # Candidatos y marca del lote en la misma transacción: si el proceso
+    # se interrumpe el lote queda pendiente y se repite completo al reanudar
+    with get_db() as db:
+        estado = db.execute(text("""
+            SELECT estado FROM tamizaje_lotes
+            WHERE ejecucion_id = :ejecucion_id AND particion = :particion AND codigo_tipologia = :codigo
+            FOR UPDATE
+        """), {'ejecucion_id': ejecucion_id, 'particion': particion, 'codigo': codigo}).scalar()
+        if estado == 'COMPLETADO':
+            return 0
+
+        valores = {**params, 'ejecucion_id': ejecucion_id, 'tipologia_id': tipologia_id, 'particion': particion}
+        if codigo in PUNTUACION_TAMIZAJE:
+            candidatos = PUNTUACION_TAMIZAJE[codigo](db, consulta, valores)
+            if candidatos:
+                db.execute(text("""
+                    INSERT INTO tamizaje_candidatos (
+                        ejecucion_id, tipologia_id, persona_id, periodo_inicio, periodo_fin,
+                        num_operaciones, monto_total, evidencias
+                    )
+                    VALUES (:ejecucion_id, :tipologia_id, :persona_id, :periodo_inicio, :periodo_fin,
+                            :num_operaciones, :monto_total, CAST(:evidencias AS JSONB))
+                """), [{'ejecucion_id': ejecucion_id, 'tipologia_id': tipologia_id, **c} for c in candidatos])
+            num_candidatos = len(candidatos)
+        else:
+            num_candidatos = db.execute(text(f"""
+                INSERT INTO tamizaje_candidatos (
+                    ejecucion_id, tipologia_id, persona_id, periodo_inicio, periodo_fin,
+                    num_operaciones, monto_total, evidencias
+                )
+                SELECT :ejecucion_id, :tipologia_id, c.persona_id, c.periodo_inicio, c.periodo_fin,
+                       c.num_operaciones, c.monto_total, c.evidencias
+                FROM ({consulta}) c
+                WHERE c.persona_id IS NOT NULL
+            """), valores).rowcount
+
+        db.execute(text("""
+            UPDATE tamizaje_lotes SET
+                estado = 'COMPLETADO',
+                num_candidatos = :num_candidatos,
+                duracion_segundos = :duracion,
+                fecha_fin = CURRENT_TIMESTAMP
+            WHERE ejecucion_id = :ejecucion_id AND particion = :particion AND codigo_tipologia = :codigo
+        """), {
+            'num_candidatos': num_candidatos,
+            'duracion': time.time() - inicio,
+            'ejecucion_id': ejecucion_id,
+            'particion': particion,
+            'codigo': codigo
+        })
+
+    return num_candidatos
+
+def ejecutar_tamizaje(ejecucion_id=None, num_particiones=NUM_PARTICIONES, procesos=PROCESOS, codigos=None):
+    if ejecucion_id is None:
+        ejecucion_id = crear_ejecucion_tamizaje(num_particiones, codigos)
+
+    with get_db() as db:
+        ejecucion = db.execute(text("""
+            SELECT num_particiones, parametros FROM tamizaje_ejecuciones WHERE ejecucion_id = :ejecucion_id
+        """), {'ejecucion_id': ejecucion_id}).fetchone()
+        pendientes = db.execute(text("""
+            SELECT particion, codigo_tipologia FROM tamizaje_lotes
+            WHERE ejecucion_id = :ejecucion_id AND estado <> 'COMPLETADO'
+            ORDER BY particion, codigo_tipologia
+        """), {'ejecucion_id': ejecucion_id}).fetchall()
+
+    parametros = ejecucion.parametros
+    if isinstance(parametros, str):
+        parametros = json.loads(parametros)
+
+    total_candidatos = 0
+    errores = []
+
+    with ProcessPoolExecutor(max_workers=procesos, initializer=reiniciar_pool) as pool:
+        futuros = {
+            pool.submit(
+                procesar_lote, ejecucion_id, lote.particion,
+                lote.codigo_tipologia, parametros[lote.codigo_tipologia]['tipologia_id'],
+                parametros[lote.codigo_tipologia]['params']
+            ): lote
+            for lote in pendientes
+        }
+        for futuro in as_completed(futuros):
+            lote = futuros[futuro]
+            try:
+                total_candidatos += futuro.result()
+            except Exception as e:
+                errores.append({'particion': lote.particion, 'codigo': lote.codigo_tipologia, 'error': str(e)})
+
+    with get_db() as db:
+        db.execute(text("""
+            UPDATE tamizaje_ejecuciones SET
+                estado = :estado,
+                fecha_fin = CASE WHEN :estado = 'COMPLETADO' THEN CURRENT_TIMESTAMP END
+            WHERE ejecucion_id = :ejecucion_id
+        """), {'estado': 'INCOMPLETO' if errores else 'COMPLETADO', 'ejecucion_id': ejecucion_id})
+
+    return {
+        'ejecucion_id': ejecucion_id,
+        'lotes_procesados': len(pendientes) - len(errores),
+        'candidatos': total_candidatos,
+        'errores': errores
+    }
+
+def listar_candidatos_tamizaje(ejecucion_id=None, estado='PENDIENTE', limit=100):
+    with get_db() as db:
+        query = text("""
+            SELECT
+                tc.candidato_id,
+                tc.ejecucion_id,
+                ct.codigo,
+                ct.nombre,
+                ct.nivel_riesgo,
+                tc.persona_id,
+                p.documento_encriptado,
+                tc.periodo_inicio,
+                tc.periodo_fin,
+                tc.num_operaciones,
+                tc.monto_total,
+                tc.evidencias,
+                tc.estado
+            FROM tamizaje_candidatos tc
+            JOIN catalogos_tipologias ct ON tc.tipologia_id = ct.tipologia_id
+            JOIN personas p ON tc.persona_id = p.persona_id
+            WHERE (CAST(:ejecucion_id AS INTEGER) IS NULL OR tc.ejecucion_id = :ejecucion_id)
+                AND tc.estado = :estado
+            ORDER BY ct.nivel_riesgo DESC, tc.monto_total DESC
+            LIMIT :limit
+        """)
+        return [dict(row._mapping) for row in db.execute(query, {
+            'ejecucion_id': ejecucion_id,
+            'estado': estado,
+            'limit': limit
+        }).fetchall()]
+
+def promover_candidato_a_caso(candidato_id, caso_id=None, usuario='SYSTEM'):
+    with get_db() as db:
+        candidato = db.execute(text("""
+            SELECT tc.persona_id, ct.codigo, ct.nombre
+            FROM tamizaje_candidatos tc
+            JOIN catalogos_tipologias ct ON tc.tipologia_id = ct.tipologia_id
+            WHERE tc.candidato_id = :candidato_id
+        """), {'candidato_id': candidato_id}).fetchone()
+
+    if not candidato:
+        raise ValueError(f"Candidato {candidato_id} no existe")
+
+    if caso_id is None:
+        caso_id = crear_caso(
+            f"Tamizaje {candidato.codigo} - persona {candidato.persona_id}",
+            f"Caso generado desde tamizaje poblacional ({candidato.nombre})",
+            usuario
+        )
+
+    agregar_persona_a_caso(caso_id, candidato.persona_id, 'INVESTIGADO', f"Tamizaje: {candidato.codigo}")
+
+    with get_db() as db:
+        db.execute(text("""
+            UPDATE tamizaje_candidatos SET estado = 'PROMOVIDO', caso_id = :caso_id
+            WHERE candidato_id = :candidato_id
+        """), {'caso_id': caso_id, 'candidato_id': candidato_id})
+
+    return caso_id
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tamizaje poblacional de tipologías')
+    parser.add_argument('--reanudar', type=int, help='ejecucion_id a reanudar')
+    parser.add_argument('--particiones', type=int, default=NUM_PARTICIONES)
+    parser.add_argument('--procesos', type=int, default=PROCESOS)
+    parser.add_argument('--tipologias', nargs='*', help='Códigos a ejecutar (por defecto todos)')
+    args = parser.parse_args()
+
+    print(ejecutar_tamizaje(args.reanudar, args.particiones, args.procesos, args.tipologias))
@@ -0,0 +1,56 @@
+import pandas as pd
+from analisis import agregar_top, agrupar_montos_similares, calcular_puntajes_anomalia, ordenar_top
+
+def test_agregar_top_retiene_los_k_mejores_en_orden():
+    top = []
+    for secuencia, monto in enumerate([5, 1, 9, 3, 9, 7], start=1):
+        agregar_top(top, 3, (monto,), secuencia, f"d{secuencia}")
+    # A igual clave queda primero el encontrado antes
+    assert ordenar_top(top) == ['d3', 'd5', 'd6']
+
+def test_agregar_top_con_menos_elementos_que_k():
+    top = []
+    agregar_top(top, 10, (1.0, 2), 1, 'a')
+    agregar_top(top, 10, (1.0, 3), 2, 'b')
+    assert ordenar_top(top) == ['b', 'a']
+
+def serie_semanal(persona_id, conteos, inicio='2024-01-01'):
+    fechas = pd.date_range(inicio, periods=len(conteos), freq='7D')
+    return pd.DataFrame({
+        'persona_id': persona_id,
+        'periodo': fechas,
+        'num_operaciones': conteos,
+        'monto_total': [100.0 * c for c in conteos]
+    })
+
+def test_puntajes_anomalia_destacan_el_pico_sin_contaminar_la_base():
+    series = serie_semanal(1, [4, 5, 4, 6, 5, 4, 5, 40])
+    puntajes = calcular_puntajes_anomalia(series, 'week')
+    pico = puntajes.iloc[-1]
+    assert pico['num_operaciones'] == 40
+    assert pico['linea_base'] == 5
+    assert pico['puntaje_z'] > 10
+    assert (puntajes.iloc[:-1]['puntaje_z'].abs() < 3).all()
+
+def test_puntajes_anomalia_completan_huecos_con_cero():
+    # Solo las semanas 1, 2, 3 y 6: las 4 y 5 entran a la base como cero
+    series = serie_semanal(7, [3, 3, 3, 0, 0, 3])
+    series = series[series['num_operaciones'] > 0]
+    puntajes = calcular_puntajes_anomalia(series, 'week', periodos_base=4)
+    assert puntajes['periodo'].tolist() == [pd.Timestamp('2024-01-22').date() + pd.Timedelta(days=7 * i) for i in range(3)]
+    assert puntajes['num_operaciones'].tolist() == [0.0, 0.0, 3.0]
+    assert puntajes['linea_base'].tolist() == [3.0, 3.0, 1.5]
+
+def test_puntajes_anomalia_separan_personas():
+    series = pd.concat([serie_semanal(1, [2, 2, 2, 2]), serie_semanal(2, [50, 50, 50, 50])])
+    puntajes = calcular_puntajes_anomalia(series, 'week', metodo='ewma')
+    assert puntajes.groupby('persona_id')['linea_base'].first().to_dict() == {1: 2.0, 2: 50.0}
+    assert (puntajes['puntaje_z'] == 0).all()
+
+def test_agrupar_montos_similares_acepta_grupos_de_un_monto():
+    transaccion = {
+        'transaccion_id': 1, 'ordenante_id': 10, 'ordenante_doc': 'a', 'beneficiario_id': 20,
+        'beneficiario_doc': 'b', 'monto': 500.0, 'fecha_operacion': pd.Timestamp('2024-01-01')
+    }
+    grupos = agrupar_montos_similares([transaccion], ['ordenante_id'], 5, 1)
+    assert len(grupos) == 1 and grupos[0]['desviacion'] is None and grupos[0]['repeticiones'] == 1
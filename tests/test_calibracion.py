@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+from calibracion import contar_en_ventana, evaluar_minimos
+
+def conteo_directo(grupos, tiempos, ancho):
+    return np.array([
+        ((grupos == g) & (tiempos >= t) & (tiempos <= t + ancho)).sum()
+        for g, t in zip(grupos, tiempos)
+    ])
+
+def test_contar_en_ventana_ids_grandes_no_colisionan():
+    grupos = np.array([1, 1 + 2 ** 24, 1, 1 + 2 ** 24, 1])
+    tiempos = np.array([0, 0, 1, 1, 2])
+    assert contar_en_ventana(grupos, tiempos, 1).tolist() == [2, 2, 2, 1, 1]
+
+def test_contar_en_ventana_coincide_con_conteo_directo():
+    rng = np.random.default_rng(0)
+    grupos = rng.integers(0, 20, 500) * 10 ** 12
+    tiempos = rng.integers(0, 1000, 500) + 1_700_000_000
+    assert (contar_en_ventana(grupos, tiempos, 50) == conteo_directo(grupos, tiempos, 50)).all()
+
+def test_contar_en_ventana_empates_cuentan_completos():
+    assert contar_en_ventana(np.array([7, 7, 7]), np.array([5, 5, 9]), 3).tolist() == [2, 2, 1]
+
+def test_contar_en_ventana_vacio():
+    assert len(contar_en_ventana(np.array([]), np.array([]), 10)) == 0
+
+def test_evaluar_minimos():
+    resultados = evaluar_minimos([1, 4, 6, 2], [10, 10, 20, 30], [2, 5])
+    assert [r['num_alertas'] for r in resultados] == [3, 1]
+    assert [r['personas'] for r in resultados] == [[10, 20, 30], [20]]
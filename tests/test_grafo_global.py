@@ -0,0 +1,57 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import pytest
+import grafo_global
+
+def aristas(pares, montos=None):
+    return pd.DataFrame({
+        'ordenante_id': [o for o, _ in pares],
+        'beneficiario_id': [b for _, b in pares],
+        'num_transacciones': 1,
+        'monto_total': montos if montos is not None else [10.0] * len(pares),
+        'fecha_primera': pd.Timestamp('2024-01-01'),
+        'fecha_ultima': pd.Timestamp('2024-01-31')
+    })
+
+@pytest.fixture
+def aleatorio():
+    rng = np.random.default_rng(3)
+    pares = {(int(o), int(b)) for o, b in rng.integers(1, 400, size=(1200, 2)) if o != b}
+    G = nx.DiGraph(list(pares))
+    return G, grafo_global.indexar_grafo(aristas(sorted(pares)), {'generacion': 0, 'xmin': 0})
+
+@pytest.mark.parametrize('sentido, vista', [
+    ('salida', lambda G: G),
+    ('entrada', lambda G: G.reverse()),
+    ('ambos', lambda G: G.to_undirected())
+])
+def test_expandir_coincide_con_bfs_de_networkx(aleatorio, sentido, vista):
+    G, grafo = aleatorio
+    semilla = next(iter(G))
+    indices, distancias, truncado = grafo_global.expandir(
+        grafo, grafo_global.indices_personas(grafo, [semilla]), 2, sentido, 0
+    )
+    obtenido = dict(zip(grafo['nodos'][indices].tolist(), distancias.tolist()))
+    assert obtenido == nx.single_source_shortest_path_length(vista(G), semilla, cutoff=2)
+    assert not truncado
+
+def test_expandir_respeta_max_nodos(aleatorio):
+    _, grafo = aleatorio
+    indices, _, truncado = grafo_global.expandir(grafo, np.array([0]), 4, 'ambos', 25)
+    assert len(indices) == 25 and truncado
+
+def test_aristas_del_ego_son_las_del_subgrafo(aleatorio):
+    G, grafo = aleatorio
+    indices, _, _ = grafo_global.expandir(grafo, np.array([0]), 1, 'ambos', 0)
+    filas = grafo['salida'][indices][:, indices].data - 1
+    pares = set(zip(grafo['aristas'].iloc[filas]['ordenante_id'], grafo['aristas'].iloc[filas]['beneficiario_id']))
+    assert pares == set(G.subgraph(grafo['nodos'][indices].tolist()).edges())
+
+def test_combinar_aristas_reemplaza_pares_existentes():
+    combinadas = grafo_global.combinar_aristas(
+        aristas([(1, 2), (2, 3)], [10.0, 20.0]), aristas([(2, 3), (3, 1)], [25.0, 5.0])
+    )
+    assert sorted(zip(combinadas['ordenante_id'], combinadas['beneficiario_id'], combinadas['monto_total'])) == [
+        (1, 2, 10.0), (2, 3, 25.0), (3, 1, 5.0)
+    ]
@@ -0,0 +1,47 @@
+import networkx as nx
+import numpy as np
+import pytest
+import red_dispersa
+
+@pytest.fixture
+def grafo():
+    # Ids mixtos como en redes.construir_grafo_caso, con sumideros y dos componentes
+    rng = np.random.default_rng(5)
+    G = nx.DiGraph()
+    nodos = list(range(1, 41)) + [f'CTA_{i}' for i in range(10)]
+    G.add_nodes_from(nodos)
+    for o, b in rng.integers(0, 30, size=(120, 2)):
+        if o != b:
+            G.add_edge(nodos[o], nodos[b], peso=float(rng.uniform(1, 1000)))
+    G.add_edge('CTA_5', 'CTA_6', peso=50.0)
+    G.add_edge(37, 'CTA_7', peso=10.0)
+    return G
+
+def test_pagerank_coincide_con_networkx(grafo):
+    matriz = red_dispersa.matriz_desde_grafo(grafo)
+    obtenido = red_dispersa.a_diccionario(matriz, red_dispersa.pagerank(matriz))
+    esperado = nx.pagerank(grafo, weight='peso')
+    assert obtenido.keys() == esperado.keys()
+    assert all(abs(obtenido[n] - esperado[n]) < 1e-6 for n in esperado)
+
+@pytest.mark.parametrize('sentido, funcion', [
+    ('total', nx.degree_centrality),
+    ('entrada', nx.in_degree_centrality),
+    ('salida', nx.out_degree_centrality)
+])
+def test_centralidad_grado_coincide_con_networkx(grafo, sentido, funcion):
+    matriz = red_dispersa.matriz_desde_grafo(grafo)
+    assert red_dispersa.a_diccionario(matriz, red_dispersa.centralidad_grado(matriz, sentido)) == pytest.approx(funcion(grafo))
+
+def test_componentes_coinciden_con_networkx(grafo):
+    matriz = red_dispersa.matriz_desde_grafo(grafo)
+    debiles = {frozenset(c) for c in red_dispersa.componentes(matriz)}
+    fuertes = {frozenset(c) for c in red_dispersa.componentes(matriz, 'strong')}
+    assert debiles == {frozenset(c) for c in nx.weakly_connected_components(grafo)}
+    assert fuertes == {frozenset(c) for c in nx.strongly_connected_components(grafo)}
+    assert 37 in next(c for c in debiles if 'CTA_7' in c)
+
+def test_aristas_repetidas_se_suman():
+    matriz = red_dispersa.matriz_desde_aristas([1, 1, 2], [2, 2, 1], [10.0, 5.0, 1.0])
+    assert red_dispersa.fuerza_salida(matriz).tolist() == [15.0, 1.0]
+    assert red_dispersa.grado_salida(matriz).tolist() == [1, 1]
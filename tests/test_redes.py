@@ -0,0 +1,49 @@
+import networkx as nx
+import numpy as np
+import pytest
+import redes
+
+def grafo_por_componentes(tamanos, semilla=0):
+    G = nx.DiGraph()
+    for i, (nodos, aristas) in enumerate(tamanos):
+        H = nx.gnm_random_graph(nodos, aristas, directed=True, seed=semilla + i)
+        G.add_nodes_from((i, v) for v in H)
+        G.add_edges_from(((i, u), (i, v), {'peso': float(1 + (u * 7 + v) % 5)}) for u, v in H.edges())
+    return G
+
+@pytest.fixture
+def grafo():
+    return grafo_por_componentes([(60, 200), (30, 80), (5, 6), (2, 1), (1, 0)])
+
+def test_betweenness_por_componente_coincide_con_grafo_completo(grafo):
+    betweenness, _, _ = redes.calcular_metricas_por_componente(
+        grafo, redes.resolver_modo_calculo(grafo, 'exacto'), procesos=1
+    )
+    esperado = nx.betweenness_centrality(grafo, weight='peso')
+    assert max(abs(esperado[v] - betweenness[v]) for v in grafo) < 1e-12
+
+def test_closeness_exacta_es_armonica_normalizada(grafo):
+    _, closeness, _ = redes.calcular_metricas_por_componente(
+        grafo, redes.resolver_modo_calculo(grafo, 'exacto'), procesos=1
+    )
+    armonica = nx.harmonic_centrality(grafo)
+    n = grafo.number_of_nodes()
+    assert max(abs(armonica[v] / (n - 1) - closeness[v]) for v in grafo) < 1e-12
+
+def test_betweenness_muestreada_sin_doble_escala():
+    # Con k pivotes la suma debe quedar en la escala de la exacta (no n / k veces)
+    G = grafo_por_componentes([(300, 1200)])
+    exacta = nx.betweenness_centrality(G, weight='peso')
+    muestreada, _, _ = redes.calcular_metricas_por_componente(
+        G, redes.resolver_modo_calculo(G, 'aproximado', k_muestras=100), procesos=1
+    )
+    x = np.array([exacta[v] for v in G])
+    y = np.array([muestreada[v] for v in G])
+    assert 0.8 < y.sum() / x.sum() < 1.25
+    assert np.corrcoef(x, y)[0, 1] > 0.9
+
+def test_repartir_componentes_equilibra_por_tamano():
+    componentes = [set(range(n)) for n in (50, 40, 30, 20, 10)]
+    lotes = redes.repartir_componentes(componentes, 2)
+    cargas = sorted(sum(len(c) for c in lote) for lote in lotes)
+    assert cargas == [70, 80]
@@ -0,0 +1,28 @@
+from tiempo_real import estado_vacio, evaluar_envio, evaluar_recepcion, acumular_por_dia
+
+PARAMS = {
+    'TIP008': {'ventana_minutos': 30, 'tolerancia_monto': 0.1, 'min_operaciones': 2, 'ventana_dias': 2},
+    'TIP010': {'min_operaciones': 3, 'ventana_dias': 2}
+}
+
+def evaluar_dias(dias):
+    estado = estado_vacio()
+    alertas = []
+    for i, dia in enumerate(dias):
+        momento = dia * 86400 + i
+        evaluar_recepcion(estado, {'monto': 1000.0, 'momento': momento}, PARAMS)
+        evaluar_envio(estado, {'ordenante_id': 1, 'momento': momento + 10, 'monto': 1000.0,
+                               'transaccion_id': i, 'fecha': dia}, PARAMS, alertas)
+    return [(a['codigo'], a['transaccion_id']) for a in alertas]
+
+def test_acumular_por_dia_descarta_fuera_de_ventana():
+    conteos = []
+    assert [acumular_por_dia(conteos, dia, 2) for dia in (0, 0, 1, 3)] == [1, 2, 3, 1]
+
+def test_contadores_vuelven_a_alertar_en_ventanas_nuevas():
+    assert evaluar_dias([0, 0, 0, 0, 1, 5, 5, 5, 9, 9, 9]) == [
+        ('TIP008', 1), ('TIP010', 2), ('TIP008', 6), ('TIP010', 7), ('TIP008', 9), ('TIP010', 10)
+    ]
+
+def test_sin_alerta_si_las_operaciones_quedan_fuera_de_ventana():
+    assert evaluar_dias([0, 3, 6]) == []
@@ -0,0 +1,17 @@
+import tipologias
+
+def tramo(transaccion_id, beneficiario_id, monto=100.0):
+    return {'beneficiario_id': beneficiario_id, 'transaccion_id': transaccion_id, 'fecha': None, 'monto': monto}
+
+def huella(codigo, deteccion):
+    transacciones_ids = sorted({int(t) for t in tipologias.extraer_transacciones_ids(deteccion)})
+    return tipologias.calcular_huella(codigo, tipologias.extraer_persona_id(deteccion), transacciones_ids, deteccion)
+
+def test_cadenas_distintas_tienen_huellas_distintas():
+    primera = [tramo(11, 2), tramo(12, 3), tramo(13, 4)]
+    segunda = [tramo(21, 5), tramo(22, 6), tramo(23, 7)]
+    assert tipologias.extraer_transacciones_ids(primera) == [11, 12, 13]
+    assert huella('TIP007', primera) != huella('TIP007', segunda)
+
+def test_misma_cadena_conserva_su_huella():
+    assert huella('TIP007', [tramo(11, 2), tramo(12, 3)]) == huella('TIP007', [tramo(11, 2, 90.0), tramo(12, 3, 80.0)])
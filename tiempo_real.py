@@ -0,0 +1,216 @@
+from database import get_db
+import json
+from bisect import bisect_left, insort
+from datetime import datetime, time
+from sqlalchemy import text
+from psycopg2.extras import execute_values
+from tipologias import obtener_tipologias_activas, leer_parametros, validar_parametros
+
+# Evaluación en línea durante la carga de ROs: reglas baratas por persona
+# sobre un estado compacto que se actualiza transacción a transacción.
+# Los valores por defecto se sobrescriben con los del catálogo.
+PARAMETROS_TIEMPO_REAL = {
+    'TIP001': {'umbral_monto': 10000.0, 'ventana_dias': 30, 'min_operaciones': 5},
+    'TIP006': {'ventana_horas': 2, 'min_operaciones': 5},
+    'TIP008': {'ventana_minutos': 30, 'tolerancia_monto': 0.1, 'min_operaciones': 3, 'ventana_dias': 30},
+    'TIP010': {'min_operaciones': 5, 'ventana_dias': 30}
+}
+
+# Estado por persona (listas cortas, recortadas a la ventana de cada regla):
+#   rafaga:      momentos (segundos) de envíos dentro de ventana_horas
+#   bajo_umbral: [dia, operaciones] de envíos bajo umbral dentro de ventana_dias
+#   redondos:    [dia, operaciones] de envíos en cifras exactas dentro de ventana_dias
+#   recibidos:   [monto, momento] de entradas aún emparejables
+#   pases:       [dia, operaciones] de entradas reenviadas dentro de ventana_minutos,
+#                contadas dentro de ventana_dias
+#   alertas:     codigo -> momento de la última alerta emitida
+def estado_vacio():
+    return {'rafaga': [], 'bajo_umbral': [], 'redondos': [], 'recibidos': [], 'pases': [], 'alertas': {}}
+
+def cargar_parametros_tiempo_real():
+    activas = {t['codigo']: t for t in obtener_tipologias_activas()}
+    return {
+        codigo: validar_parametros(esquema, leer_parametros(activas[codigo]))
+        for codigo, esquema in PARAMETROS_TIEMPO_REAL.items()
+        if codigo in activas
+    }
+
+def momento_operacion(fecha, hora):
+    # Segundos desde epoch; una hora ilegible cuenta como medianoche
+    try:
+        hora = time.fromisoformat(str(hora)) if hora else time()
+    except ValueError:
+        hora = time()
+    return int(datetime.combine(fecha.date() if hasattr(fecha, 'date') else fecha, hora).timestamp())
+
+def crear_evaluador(params=None):
+    return {
+        'params': params if params is not None else cargar_parametros_tiempo_real(),
+        'estados': {},
+        'alertas_emitidas': 0
+    }
+
+def cargar_estados(db, evaluador, personas):
+    faltantes = [p for p in personas if p not in evaluador['estados']]
+    if faltantes:
+        query = text("SELECT persona_id, estado FROM estado_tiempo_real WHERE persona_id = ANY(:ids)")
+        for row in db.execute(query, {'ids': faltantes}).fetchall():
+            estado = row.estado if isinstance(row.estado, dict) else json.loads(row.estado)
+            # Estados guardados con contadores acumulados: se reinician por día
+            for clave in ('redondos', 'pases'):
+                if not isinstance(estado.get(clave), list):
+                    estado[clave] = []
+            evaluador['estados'][row.persona_id] = estado
+    for persona_id in faltantes:
+        evaluador['estados'].setdefault(persona_id, estado_vacio())
+
+def guardar_estados(db, evaluador, personas):
+    if not personas:
+        return
+    cursor = db.connection().connection.cursor()
+    execute_values(cursor, """
+        INSERT INTO estado_tiempo_real (persona_id, estado)
+        VALUES %s
+        ON CONFLICT (persona_id) DO UPDATE SET
+            estado = EXCLUDED.estado,
+            fecha_actualizacion = CURRENT_TIMESTAMP
+    """, [(p, json.dumps(evaluador['estados'][p])) for p in personas], template="(%s, %s::jsonb)")
+
+def emitir(estado, codigo, momento, enfriamiento, detalle, alertas, evento, persona_id):
+    # Una alerta por regla y persona mientras dure la ventana de la regla
+    ultima = estado['alertas'].get(codigo)
+    if ultima is not None and momento - ultima < enfriamiento:
+        return
+    estado['alertas'][codigo] = momento
+    alertas.append({
+        'persona_id': persona_id,
+        'codigo': codigo,
+        'transaccion_id': evento['transaccion_id'],
+        'fecha_operacion': evento['fecha'],
+        'detalle': detalle
+    })
+
+def acumular_por_dia(conteos, dia, ventana_dias):
+    # conteos: [dia, operaciones] ordenados; suma el evento y descarta los
+    # días fuera de la ventana. Devuelve el total dentro de la ventana
+    if conteos and conteos[-1][0] == dia:
+        conteos[-1][1] += 1
+    else:
+        insort(conteos, [dia, 1])
+    conteos[:] = [d for d in conteos if d[0] > conteos[-1][0] - ventana_dias]
+    return sum(n for _, n in conteos)
+
+def evaluar_envio(estado, evento, params, alertas):
+    persona_id = evento['ordenante_id']
+    momento = evento['momento']
+    monto = evento['monto']
+
+    if 'TIP006' in params:
+        p = params['TIP006']
+        ventana = p['ventana_horas'] * 3600
+        rafaga = estado['rafaga']
+        insort(rafaga, momento)
+        del rafaga[:bisect_left(rafaga, rafaga[-1] - ventana)]
+        if len(rafaga) >= p['min_operaciones']:
+            emitir(estado, 'TIP006', momento, ventana,
+                   {'operaciones_en_ventana': len(rafaga), 'ventana_horas': p['ventana_horas']},
+                   alertas, evento, persona_id)
+
+    if 'TIP001' in params and monto < params['TIP001']['umbral_monto']:
+        p = params['TIP001']
+        operaciones = acumular_por_dia(estado['bajo_umbral'], momento // 86400, p['ventana_dias'])
+        if operaciones >= p['min_operaciones']:
+            emitir(estado, 'TIP001', momento, p['ventana_dias'] * 86400,
+                   {'operaciones_bajo_umbral': operaciones, 'ventana_dias': p['ventana_dias'],
+                    'umbral_monto': p['umbral_monto']},
+                   alertas, evento, persona_id)
+
+    if 'TIP010' in params and monto > 0 and monto == round(monto, -3):
+        p = params['TIP010']
+        redondos = acumular_por_dia(estado['redondos'], momento // 86400, p['ventana_dias'])
+        if redondos >= p['min_operaciones']:
+            emitir(estado, 'TIP010', momento, p['ventana_dias'] * 86400,
+                   {'operaciones_redondas': redondos, 'ventana_dias': p['ventana_dias']},
+                   alertas, evento, persona_id)
+
+    if 'TIP008' in params:
+        p = params['TIP008']
+        ventana = p['ventana_minutos'] * 60
+        recibidos = [r for r in estado['recibidos'] if r[1] >= momento - ventana]
+        candidatos = [
+            i for i, (monto_recibido, _) in enumerate(recibidos)
+            if abs(monto_recibido - monto) / monto_recibido < p['tolerancia_monto']
+        ]
+        if candidatos:
+            recibidos.pop(min(candidatos, key=lambda i: abs(recibidos[i][0] - monto)))
+            pases = acumular_por_dia(estado['pases'], momento // 86400, p['ventana_dias'])
+            if pases >= p['min_operaciones']:
+                emitir(estado, 'TIP008', momento, p['ventana_dias'] * 86400,
+                       {'pases_inmediatos': pases, 'ventana_minutos': p['ventana_minutos'],
+                        'ventana_dias': p['ventana_dias']},
+                       alertas, evento, persona_id)
+        estado['recibidos'] = recibidos
+
+def evaluar_recepcion(estado, evento, params):
+    if 'TIP008' in params and evento['monto'] > 0:
+        ventana = params['TIP008']['ventana_minutos'] * 60
+        estado['recibidos'] = [
+            r for r in estado['recibidos'] if r[1] >= evento['momento'] - ventana
+        ] + [[evento['monto'], evento['momento']]]
+
+def evaluar_lote(db, evaluador, eventos, ro_id):
+    # eventos: dicts con transaccion_id, ordenante_id, beneficiario_id,
+    # fecha, momento y monto de las transacciones recién insertadas
+    eventos = sorted(eventos, key=lambda e: e['momento'])
+    personas = {
+        persona_id for e in eventos
+        for persona_id in (e['ordenante_id'], e['beneficiario_id']) if persona_id
+    }
+    cargar_estados(db, evaluador, personas)
+
+    params = evaluador['params']
+    alertas = []
+    for evento in eventos:
+        if evento['beneficiario_id']:
+            evaluar_recepcion(evaluador['estados'][evento['beneficiario_id']], evento, params)
+        if evento['ordenante_id']:
+            evaluar_envio(evaluador['estados'][evento['ordenante_id']], evento, params, alertas)
+
+    guardar_estados(db, evaluador, sorted(personas))
+    if alertas:
+        cursor = db.connection().connection.cursor()
+        execute_values(cursor, """
+            INSERT INTO alertas_tiempo_real
+            (ro_id, persona_id, codigo_tipologia, transaccion_id, fecha_operacion, detalle)
+            VALUES %s
+        """, [
+            (ro_id, a['persona_id'], a['codigo'], a['transaccion_id'], a['fecha_operacion'], json.dumps(a['detalle']))
+            for a in alertas
+        ], template="(%s, %s, %s, %s, %s, %s::jsonb)")
+
+    evaluador['alertas_emitidas'] += len(alertas)
+    return alertas
+
+def listar_alertas_tiempo_real(estado='PENDIENTE', limit=100):
+    with get_db() as db:
+        query = text("""
+            SELECT
+                a.alerta_id,
+                a.ro_id,
+                a.persona_id,
+                p.documento_encriptado,
+                a.codigo_tipologia,
+                ct.nombre as tipologia,
+                a.transaccion_id,
+                a.fecha_operacion,
+                a.detalle,
+                a.estado,
+                a.fecha_alerta
+            FROM alertas_tiempo_real a
+            JOIN personas p ON a.persona_id = p.persona_id
+            LEFT JOIN catalogos_tipologias ct ON a.codigo_tipologia = ct.codigo
+            WHERE a.estado = :estado
+            ORDER BY a.fecha_alerta DESC
+            LIMIT :limit
+        """)
+        return [dict(row._mapping) for row in db.execute(query, {'estado': estado, 'limit': limit}).fetchall()]
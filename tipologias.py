@@ -1,81 +1,202 @@
-from database import get_db
+from database import get_db, limitar_tiempo_sentencias
 import json
+import time
+import zlib
+import numpy as np
+import pandas as pd
+import heapq
+from bisect import bisect_left, insort
+from datetime import timedelta
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from psycopg2.extras import execute_values
+from utils import calcular_hash
+from reglas import ejecutar_regla
+from cubo import concentracion_por_rol, fijar_version_caso
 from analisis import (
     detectar_pitufeo, detectar_concentracion_montos,
     detectar_montos_similares, detectar_ventanas_cortas,
     detectar_cadenas_transferencia, detectar_circularidad,
-    detectar_frecuencia_inusual
+    detectar_frecuencia_inusual, paginar_detecciones, resumir_deteccion
 )
 
-def ejecutar_deteccion_tipologias(caso_id):
-    tipologias = obtener_tipologias_activas()
+# Tope de detecciones por tipología y corrida, configurable con
+# 'max_detecciones' en catalogos_tipologias.parametros
+MAX_DETECCIONES = 500
+
+# Concurrencia y statement_timeout (segundos) por clase de costo; el
+# timeout se puede fijar por tipología con 'timeout_segundos'
+MAX_TIPOLOGIAS_PARALELAS = 4
+TIMEOUT_POR_COSTO = {'BAJO': 60, 'MEDIO': 180, 'ALTO': 600}
+
+# Filas por sentencia INSERT al guardar detecciones
+TAMANO_LOTE_INSERCION = 1000
+
+# Puntaje de confianza: nivel_riesgo * 10 más 'puntos' por cada umbral
+# superado. Los umbrales se pueden fijar por tipología con 'confianza' en
+# catalogos_tipologias.parametros.
+UMBRALES_CONFIANZA = {'operaciones': [10, 50], 'monto': [100000, 1000000], 'puntos': 10}
+
+# Campos del resumen de evidencias de los que sale cada característica,
+# en orden de preferencia
+CARACTERISTICAS_CONFIANZA = {
+    'operaciones': ('total_operaciones', 'num_operaciones'),
+    'monto': ('monto_total', 'monto_acumulado')
+}
+CARACTERISTICAS_POR_TIPOLOGIA = {
+    'TIP001': {'operaciones': ('total_operaciones',), 'monto': ('monto_acumulado',)},
+    'TIP005': {'operaciones': ('repeticiones',), 'monto': ('monto_total',)},
+    'TIP006': {'operaciones': ('operaciones_en_ventana',), 'monto': ('monto_total_ventana',)},
+    'TIP007': {'operaciones': ('num_eslabones',), 'monto': ('monto_total',)}
+}
+
+# codigo -> {'detector', 'parametros', 'costo'}. Cada detector recibe
+# (caso_id, params, limit) con params ya completados según su esquema.
+REGISTRO_TIPOLOGIAS = {}
+
+def registrar_tipologia(codigo, parametros=None, costo='MEDIO'):
+    def decorador(detector):
+        REGISTRO_TIPOLOGIAS[codigo] = {
+            'detector': detector,
+            'parametros': parametros or {},
+            'costo': costo
+        }
+        return detector
+    return decorador
+
+def leer_parametros(tipologia):
+    # CORRECCIÓN: Manejar si parametros ya es un dict (postgres jsonb) o string
+    params = tipologia['parametros']
+    if isinstance(params, str):
+        try:
+            params = json.loads(params)
+        except ValueError:
+            params = {}
+    return params or {}
+
+def validar_parametros(esquema, params):
+    # Completa con los valores por defecto y convierte al tipo del esquema
+    validados = dict(params)
+    for nombre, defecto in esquema.items():
+        valor = params.get(nombre, defecto)
+        try:
+            validados[nombre] = type(defecto)(valor) if defecto is not None else valor
+        except (TypeError, ValueError):
+            raise ValueError(f"Parámetro inválido {nombre}={valor!r}")
+    return validados
+
+@registrar_tipologia('TIP001', {'umbral_monto': 10000.0, 'ventana_dias': 30, 'min_operaciones': 5}, 'MEDIO')
+def tipologia_pitufeo(caso_id, params, limit=None):
+    return detectar_pitufeo(
+        caso_id, params['umbral_monto'], params['ventana_dias'], params['min_operaciones'], limit=limit
+    )
+
+@registrar_tipologia('TIP004', {'max_saltos': 5}, 'ALTO')
+def tipologia_circularidad(caso_id, params, limit=None):
+    return detectar_circularidad(caso_id, params['max_saltos'], limit=limit)
+
+@registrar_tipologia('TIP005', {'tolerancia_porcentual': 5.0, 'min_repeticiones': 3}, 'MEDIO')
+def tipologia_montos_similares(caso_id, params, limit=None):
+    return detectar_montos_similares(
+        caso_id, params['tolerancia_porcentual'], params['min_repeticiones'], limit=limit
+    )
+
+@registrar_tipologia('TIP006', {'ventana_horas': 2, 'min_operaciones': 5}, 'ALTO')
+def tipologia_ventanas_cortas(caso_id, params, limit=None):
+    return detectar_ventanas_cortas(caso_id, params['ventana_horas'], params['min_operaciones'], limit=limit)
+
+@registrar_tipologia('TIP007', {'min_eslabones': 3, 'ventana_dias': 7}, 'ALTO')
+def tipologia_cadenas(caso_id, params, limit=None):
+    return detectar_cadenas_transferencia(caso_id, params['min_eslabones'], params['ventana_dias'], limit=limit)
+
+@registrar_tipologia('TIP009', {
+    'ventana_dias': 7, 'factor_incremento': 3.0, 'metodo': 'mediana', 'periodos_base': 8, 'umbral_z': 3.5,
+    'periodo': None
+}, 'BAJO')
+def tipologia_frecuencia_inusual(caso_id, params, limit=None):
+    return detectar_frecuencia_inusual(
+        caso_id, params['ventana_dias'], params['factor_incremento'], params['metodo'],
+        params['periodos_base'], params['umbral_z'], params['periodo'], limit=limit
+    )
+
+def ejecutar_tipologia(caso_id, tipologia):
+    codigo = tipologia['codigo']
+    registro = REGISTRO_TIPOLOGIAS.get(codigo)
+    inicio = time.time()
+    estado = 'COMPLETADO'
+    error = None
     resultados = []
     
-    for tipologia in tipologias:
-        codigo = tipologia['codigo']
-        
-        # CORRECCIÓN: Manejar si parametros ya es un dict (postgres jsonb) o string
-        params = tipologia['parametros']
-        if isinstance(params, str):
-            try:
-                params = json.loads(params)
-            except:
-                params = {}
-        elif params is None:
-            params = {}
-        
-        detecciones = None
-        
-        if codigo == 'TIP001':
-            detecciones = detectar_pitufeo(
-                caso_id,
-                params.get('umbral_monto', 10000),
-                params.get('ventana_dias', 30),
-                params.get('min_operaciones', 5)
-            )
-        elif codigo == 'TIP002':
-            detecciones = detectar_concentracion_beneficiarios(caso_id, params)
-        elif codigo == 'TIP003':
-            detecciones = detectar_concentracion_ordenantes(caso_id, params)
-        elif codigo == 'TIP004':
-            detecciones = detectar_circularidad(
-                caso_id,
-                params.get('max_saltos', 5)
-            )
-        elif codigo == 'TIP005':
-            detecciones = detectar_montos_similares(
-                caso_id,
-                params.get('tolerancia_porcentual', 5),
-                params.get('min_repeticiones', 3)
-            )
-        elif codigo == 'TIP006':
-            detecciones = detectar_ventanas_cortas(
-                caso_id,
-                params.get('ventana_horas', 2),
-                params.get('min_operaciones', 5)
-            )
-        elif codigo == 'TIP007':
-            detecciones = detectar_cadenas_transferencia(
-                caso_id,
-                params.get('min_eslabones', 3),
-                params.get('ventana_dias', 7)
-            )
-        elif codigo == 'TIP008':
-            detecciones = detectar_transferencias_inmediatas(caso_id, params)
-        elif codigo == 'TIP009':
-            detecciones = detectar_frecuencia_inusual(
-                caso_id,
-                params.get('ventana_dias', 7),
-                params.get('factor_incremento', 3)
-            )
-        elif codigo == 'TIP010':
-            detecciones = detectar_montos_redondos(caso_id, params)
-        
-        if detecciones:
-            resultados.extend(
-                procesar_detecciones(caso_id, tipologia, detecciones)
-            )
+    # Tipologías definidas solo en el catálogo: la regla declarativa hace
+    # de detector
+    if registro is None and 'regla' in leer_parametros(tipologia):
+        registro = {
+            'detector': lambda caso_id, params, limit=None: ejecutar_regla(caso_id, params['regla'], limit=limit),
+            'parametros': {},
+            'costo': leer_parametros(tipologia).get('costo', 'MEDIO')
+        }
+    
+    if registro is None:
+        estado = 'SIN_DETECTOR'
+    else:
+        try:
+            params = validar_parametros(registro['parametros'], leer_parametros(tipologia))
+            timeout = params.get('timeout_segundos', TIMEOUT_POR_COSTO.get(registro['costo'], 180))
+            
+            limite = params.get('max_detecciones', MAX_DETECCIONES)
+            with limitar_tiempo_sentencias(timeout * 1000):
+                detecciones = registro['detector'](caso_id, params, limit=limite) or []
+            # Un resultado que llegó al tope puede haber dejado fuera
+            # detecciones válidas: no se marcan como no vigentes
+            completo = limite is None or len(detecciones) < limite
+            resultados = procesar_detecciones(caso_id, tipologia, detecciones, marcar_obsoletas=completo)
+        except OperationalError as e:
+            estado = 'TIMEOUT' if 'statement timeout' in str(e) else 'ERROR'
+            error = str(e)
+        except Exception as e:
+            estado = 'ERROR'
+            error = str(e)
+    
+    registrar_ejecucion_tipologia(
+        caso_id, tipologia, int((time.time() - inicio) * 1000), len(resultados), estado, error
+    )
+    return resultados
+
+def registrar_ejecucion_tipologia(caso_id, tipologia, duracion_ms, num_detecciones, estado, error=None):
+    with get_db() as db:
+        query = text("""
+            INSERT INTO ejecuciones_tipologias 
+            (caso_id, tipologia_id, codigo, duracion_ms, num_detecciones, estado, error)
+            VALUES (:caso_id, :tipologia_id, :codigo, :duracion_ms, :num_detecciones, :estado, :error)
+        """)
+        db.execute(query, {
+            'caso_id': caso_id,
+            'tipologia_id': tipologia['tipologia_id'],
+            'codigo': tipologia['codigo'],
+            'duracion_ms': duracion_ms,
+            'num_detecciones': num_detecciones,
+            'estado': estado,
+            'error': error
+        })
+
+def ejecutar_deteccion_tipologias(caso_id, max_paralelas=MAX_TIPOLOGIAS_PARALELAS, version_datos=None):
+    # Una sola consulta de versión por corrida para todas las tipologías que
+    # leen el cubo del caso
+    fijar_version_caso(caso_id, version_datos)
+    tipologias = obtener_tipologias_activas()
+    
+    # Las más costosas primero para no dejarlas al final de la corrida
+    orden_costo = {'ALTO': 0, 'MEDIO': 1, 'BAJO': 2}
+    tipologias.sort(key=lambda t: orden_costo.get(
+        REGISTRO_TIPOLOGIAS.get(t['codigo'], {}).get('costo') or leer_parametros(t).get('costo'), 3
+    ))
+    
+    resultados = []
+    with ThreadPoolExecutor(max_workers=max_paralelas) as pool:
+        for detecciones in pool.map(lambda t: ejecutar_tipologia(caso_id, t), tipologias):
+            resultados.extend(detecciones)
     
     return resultados
 
@@ -84,43 +205,104 @@ def obtener_tipologias_activas():
         query = text("SELECT * FROM catalogos_tipologias WHERE activo = TRUE ORDER BY nivel_riesgo DESC")
         return [dict(row._mapping) for row in db.execute(query).fetchall()]
 
-def procesar_detecciones(caso_id, tipologia, detecciones):
-    resultados = []
+def procesar_detecciones(caso_id, tipologia, detecciones, marcar_obsoletas=True):
+    # Serializar todo antes de abrir la transacción; una huella repetida
+    # en la misma corrida se guarda una sola vez
+    filas = {}
+    for deteccion in detecciones:
+        persona_id = extraer_persona_id(deteccion)
+        transacciones_ids = sorted({int(trx_id) for trx_id in extraer_transacciones_ids(deteccion)})
+        huella = calcular_huella(tipologia['codigo'], persona_id, transacciones_ids, deteccion)
+        if huella in filas:
+            continue
+        filas[huella] = (
+            persona_id,
+            construir_evidencias(deteccion),
+            comprimir_detalle(deteccion),
+            transacciones_ids,
+            huella
+        )
+    
+    # Confianza de toda la corrida en una pasada, desde el mismo resumen que
+    # se guarda en evidencias
+    confianzas = calcular_confianza_lote(tipologia, [resumen for _, resumen, _, _, _ in filas.values()])
+    filas = [
+        (
+            caso_id,
+            tipologia['tipologia_id'],
+            persona_id,
+            float(confianza),
+            json.dumps(resumen, default=str),
+            detalle,
+            transacciones_ids,
+            len(transacciones_ids),
+            huella
+        )
+        for (persona_id, resumen, detalle, transacciones_ids, huella), confianza
+        in zip(filas.values(), confianzas)
+    ]
     
+    # Upsert multi-fila por tipología: una detección ya existente refresca
+    # confianza y evidencias y conserva su estado de revisión
     with get_db() as db:
-        for deteccion in detecciones:
-            persona_id = extraer_persona_id(deteccion)
-            evidencias = construir_evidencias(deteccion)
-            transacciones_ids = extraer_transacciones_ids(deteccion)
-            nivel_confianza = calcular_nivel_confianza(tipologia, deteccion)
-            
-            # Serializar evidencias para la BD
-            evidencias_json = json.dumps(evidencias, default=str)
-            
-            query = text("""
+        ids = {}
+        if filas:
+            cursor = db.connection().connection.cursor()
+            # RETURNING no garantiza el orden de VALUES entre páginas: cada id
+            # se asocia a su fila por la huella
+            retornadas = execute_values(cursor, """
                 INSERT INTO tipologias_detectadas 
-                (caso_id, tipologia_id, persona_id, nivel_confianza, evidencias, transacciones_relacionadas)
-                VALUES (:caso_id, :tipologia_id, :persona_id, :confianza, :evidencias, :transacciones)
-                RETURNING deteccion_id
-            """)
-            
-            result = db.execute(query, {
+                (caso_id, tipologia_id, persona_id, nivel_confianza, evidencias, evidencias_detalle,
+                 transacciones_relacionadas, num_transacciones, huella)
+                VALUES %s
+                ON CONFLICT (caso_id, tipologia_id, huella) DO UPDATE SET
+                    nivel_confianza = EXCLUDED.nivel_confianza,
+                    evidencias = EXCLUDED.evidencias,
+                    evidencias_detalle = EXCLUDED.evidencias_detalle,
+                    transacciones_relacionadas = EXCLUDED.transacciones_relacionadas,
+                    num_transacciones = EXCLUDED.num_transacciones,
+                    vigente = TRUE,
+                    fecha_actualizacion = CURRENT_TIMESTAMP
+                RETURNING deteccion_id, huella
+            """, filas, template="(%s, %s, %s, %s, %s::jsonb, %s, %s::integer[], %s, %s)",
+                page_size=TAMANO_LOTE_INSERCION, fetch=True)
+            ids = {huella: deteccion_id for deteccion_id, huella in retornadas}
+        
+        # Las detecciones que ya no aparecen quedan como no vigentes
+        if marcar_obsoletas:
+            db.execute(text("""
+                UPDATE tipologias_detectadas SET
+                    vigente = FALSE,
+                    fecha_actualizacion = CURRENT_TIMESTAMP
+                WHERE caso_id = :caso_id
+                    AND tipologia_id = :tipologia_id
+                    AND vigente
+                    AND NOT (huella = ANY(:huellas))
+            """), {
                 'caso_id': caso_id,
                 'tipologia_id': tipologia['tipologia_id'],
-                'persona_id': persona_id,
-                'confianza': nivel_confianza,
-                'evidencias': evidencias_json,
-                'transacciones': transacciones_ids
-            })
-            
-            resultados.append({
-                'deteccion_id': result.fetchone()[0],
-                'tipologia': tipologia['nombre'],
-                'persona_id': persona_id,
-                'nivel_confianza': nivel_confianza
+                'huellas': [fila[8] for fila in filas]
             })
     
-    return resultados
+    return [
+        {
+            'deteccion_id': ids[fila[8]],
+            'tipologia': tipologia['nombre'],
+            'persona_id': fila[2],
+            'nivel_confianza': fila[3]
+        }
+        for fila in filas
+    ]
+
+def calcular_huella(codigo, persona_id, transacciones_ids, deteccion):
+    # Sin transacciones asociadas se identifica por el periodo o ventana
+    if transacciones_ids:
+        clave = ','.join(str(trx_id) for trx_id in transacciones_ids)
+    else:
+        clave = '|'.join(
+            str(deteccion.get(campo)) for campo in ('rol', 'periodo', 'fecha_inicio', 'inicio_ventana')
+        ) if isinstance(deteccion, dict) else ''
+    return calcular_hash(f"{codigo}|{persona_id}|{clave}")
 
 def extraer_persona_id(deteccion):
     if isinstance(deteccion, dict):
@@ -128,6 +310,9 @@ def extraer_persona_id(deteccion):
     return None
 
 def extraer_transacciones_ids(deteccion):
+    # Cadenas (TIP007): lista de tramos, cada uno con su transaccion_id
+    if isinstance(deteccion, list):
+        return [tramo['transaccion_id'] for tramo in deteccion if isinstance(tramo, dict) and 'transaccion_id' in tramo]
     if isinstance(deteccion, dict):
         ids = deteccion.get('transacciones_ids') or deteccion.get('todas_transacciones', [])
         
@@ -142,127 +327,227 @@ def extraer_transacciones_ids(deteccion):
     return []
 
 def construir_evidencias(deteccion):
-    if isinstance(deteccion, dict):
-        return deteccion
+    # Resumen escalar (conteos, montos, fechas) para listados y puntaje; los
+    # ids ya quedan en transacciones_relacionadas
+    if isinstance(deteccion, (dict, list)):
+        return resumir_deteccion(deteccion)
     return {}
 
-def calcular_nivel_confianza(tipologia, deteccion):
-    nivel_base = tipologia['nivel_riesgo'] * 10
-    
+def comprimir_detalle(deteccion):
+    # Detalle completo (tramos, pares, caminos) comprimido; solo se lee al
+    # abrir la detección
     if isinstance(deteccion, dict):
-        num_operaciones = deteccion.get('total_operaciones', 0) or deteccion.get('num_operaciones', 0)
-        monto_total = deteccion.get('monto_total', 0) or deteccion.get('monto_acumulado', 0)
-    else:
-        num_operaciones = 0
-        monto_total = 0
-    
-    if num_operaciones > 10:
-        nivel_base += 10
-    if num_operaciones > 50:
-        nivel_base += 10
-    
-    if monto_total > 100000:
-        nivel_base += 10
-    if monto_total > 1000000:
-        nivel_base += 10
+        deteccion = {
+            clave: valor for clave, valor in deteccion.items()
+            if clave not in ('transacciones_ids', 'todas_transacciones')
+        }
+    return zlib.compress(json.dumps(deteccion, default=str).encode())
+
+def descomprimir_detalle(detalle):
+    if detalle is None:
+        return None
+    return json.loads(zlib.decompress(bytes(detalle)).decode())
+
+def leer_umbrales_confianza(tipologia):
+    umbrales = dict(UMBRALES_CONFIANZA)
+    umbrales.update(leer_parametros(tipologia).get('confianza') or {})
+    return umbrales
+
+def extraer_caracteristicas(codigo, resumenes):
+    # Una columna por característica; como antes, un valor 0 o ausente cae
+    # al siguiente campo candidato
+    df = pd.DataFrame(resumenes)
+    campos = {**CARACTERISTICAS_CONFIANZA, **CARACTERISTICAS_POR_TIPOLOGIA.get(codigo, {})}
+    caracteristicas = pd.DataFrame(index=df.index)
+    for nombre, candidatos in campos.items():
+        valores = pd.Series(0.0, index=df.index)
+        for campo in reversed(candidatos):
+            if campo in df.columns:
+                columna = pd.to_numeric(df[campo], errors='coerce').fillna(0.0)
+                valores = columna.where(columna != 0, valores)
+        caracteristicas[nombre] = valores.astype(float)
+    return caracteristicas
+
+def calcular_confianza_lote(tipologia, resumenes):
+    if not resumenes:
+        return np.array([])
+    umbrales = leer_umbrales_confianza(tipologia)
+    caracteristicas = extraer_caracteristicas(tipologia['codigo'], resumenes)
     
-    return min(nivel_base, 100)
+    # searchsorted cuenta cuántos umbrales quedan estrictamente por debajo
+    superados = sum(
+        np.searchsorted(np.sort(np.asarray(umbrales[nombre], dtype=float)), caracteristicas[nombre].to_numpy(), side='left')
+        for nombre in ('operaciones', 'monto')
+    )
+    return np.minimum((tipologia['nivel_riesgo'] or 0) * 10 + superados * umbrales['puntos'], 100)
 
-def detectar_concentracion_beneficiarios(caso_id, params):
-    with get_db() as db:
-        query = text("""
-            SELECT 
-                t.beneficiario_id as persona_id,
-                pb.documento_encriptado,
-                COUNT(DISTINCT t.ordenante_id) as num_ordenantes,
-                COUNT(DISTINCT t.transaccion_id) as total_operaciones,
-                SUM(t.monto) as monto_total,
-                ARRAY_AGG(DISTINCT t.transaccion_id) as transacciones_ids
-            FROM transacciones t
-            JOIN personas pb ON t.beneficiario_id = pb.persona_id
-            JOIN casos_personas cp ON t.beneficiario_id = cp.persona_id
-            WHERE cp.caso_id = :caso_id
-                AND t.fecha_operacion >= CURRENT_DATE - INTERVAL ':ventana days'
-            GROUP BY t.beneficiario_id, pb.documento_encriptado
-            HAVING COUNT(DISTINCT t.ordenante_id) >= :min_ordenantes
-            ORDER BY monto_total DESC
-        """)
-        return [dict(row._mapping) for row in db.execute(query, {
-            'caso_id': caso_id,
-            'ventana': params.get('ventana_dias', 30),
-            'min_ordenantes': params.get('min_ordenantes', 5)
-        }).fetchall()]
+def calcular_nivel_confianza(tipologia, deteccion):
+    return float(calcular_confianza_lote(tipologia, [construir_evidencias(deteccion)])[0])
 
-def detectar_concentracion_ordenantes(caso_id, params):
+def recalcular_confianza_historica(codigo=None, caso_id=None):
+    # Re-puntúa detecciones guardadas con los umbrales actuales del catálogo
+    # sin volver a ejecutar los detectores
     with get_db() as db:
         query = text("""
-            SELECT 
-                t.ordenante_id as persona_id,
-                po.documento_encriptado,
-                COUNT(DISTINCT t.beneficiario_id) as num_beneficiarios,
-                COUNT(DISTINCT t.transaccion_id) as total_operaciones,
-                SUM(t.monto) as monto_total,
-                ARRAY_AGG(DISTINCT t.transaccion_id) as transacciones_ids
-            FROM transacciones t
-            JOIN personas po ON t.ordenante_id = po.persona_id
-            JOIN casos_personas cp ON t.ordenante_id = cp.persona_id
-            WHERE cp.caso_id = :caso_id
-                AND t.fecha_operacion >= CURRENT_DATE - INTERVAL ':ventana days'
-            GROUP BY t.ordenante_id, po.documento_encriptado
-            HAVING COUNT(DISTINCT t.beneficiario_id) >= :min_beneficiarios
-            ORDER BY monto_total DESC
+            SELECT td.deteccion_id, td.nivel_confianza, td.evidencias,
+                   ct.codigo, ct.nivel_riesgo, ct.parametros
+            FROM tipologias_detectadas td
+            JOIN catalogos_tipologias ct ON td.tipologia_id = ct.tipologia_id
+            WHERE (CAST(:codigo AS VARCHAR) IS NULL OR ct.codigo = :codigo)
+                AND (CAST(:caso_id AS INTEGER) IS NULL OR td.caso_id = :caso_id)
+            ORDER BY ct.codigo
         """)
-        return [dict(row._mapping) for row in db.execute(query, {
-            'caso_id': caso_id,
-            'ventana': params.get('ventana_dias', 30),
-            'min_beneficiarios': params.get('min_beneficiarios', 10)
-        }).fetchall()]
+        filas = db.execute(query, {'codigo': codigo, 'caso_id': caso_id}).fetchall()
+        
+        cambios = []
+        for _, grupo in groupby(filas, key=lambda f: f.codigo):
+            grupo = list(grupo)
+            tipologia = dict(grupo[0]._mapping)
+            confianzas = calcular_confianza_lote(tipologia, [
+                f.evidencias if isinstance(f.evidencias, dict) else json.loads(f.evidencias or '{}')
+                for f in grupo
+            ])
+            cambios.extend(
+                (f.deteccion_id, float(c)) for f, c in zip(grupo, confianzas)
+                if f.nivel_confianza is None or float(f.nivel_confianza) != float(c)
+            )
+        
+        if cambios:
+            cursor = db.connection().connection.cursor()
+            execute_values(cursor, """
+                UPDATE tipologias_detectadas AS td SET
+                    nivel_confianza = v.nivel_confianza,
+                    fecha_actualizacion = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(deteccion_id, nivel_confianza)
+                WHERE td.deteccion_id = v.deteccion_id
+            """, cambios, template="(%s, %s::numeric)", page_size=TAMANO_LOTE_INSERCION)
+    
+    return len(cambios)
+
+@registrar_tipologia('TIP002', {'min_ordenantes': 5, 'ventana_dias': 30}, 'BAJO')
+def detectar_concentracion_beneficiarios(caso_id, params, limit=None, offset=0, solo_resumen=False):
+    return paginar_detecciones(concentracion_por_rol(
+        caso_id, 'BENEFICIARIO', 'num_ordenantes',
+        params.get('min_ordenantes', 5), params.get('ventana_dias', 30)
+    ), limit, offset, solo_resumen)
 
-def detectar_transferencias_inmediatas(caso_id, params):
+@registrar_tipologia('TIP003', {'min_beneficiarios': 10, 'ventana_dias': 30}, 'BAJO')
+def detectar_concentracion_ordenantes(caso_id, params, limit=None, offset=0, solo_resumen=False):
+    return paginar_detecciones(concentracion_por_rol(
+        caso_id, 'ORDENANTE', 'num_beneficiarios',
+        params.get('min_beneficiarios', 10), params.get('ventana_dias', 30)
+    ), limit, offset, solo_resumen)
+
+@registrar_tipologia('TIP008', {'ventana_minutos': 30, 'tolerancia_monto': 0.1, 'min_operaciones': 3}, 'MEDIO')
+def detectar_transferencias_inmediatas(caso_id, params, limit=None, offset=0, solo_resumen=False):
     with get_db() as db:
         query = text("""
-            WITH transacciones_ordenadas AS (
-                SELECT 
-                    t1.transaccion_id as trx_recibida_id,
-                    t1.beneficiario_id as intermediario_id,
-                    t1.fecha_operacion as fecha_recepcion,
-                    t1.hora_operacion as hora_recepcion,
-                    t1.monto as monto_recibido,
-                    t2.transaccion_id as trx_enviada_id,
-                    t2.beneficiario_id as beneficiario_final_id,
-                    t2.fecha_operacion as fecha_envio,
-                    t2.hora_operacion as hora_envio,
-                    t2.monto as monto_enviado,
-                    EXTRACT(EPOCH FROM (
-                        (t2.fecha_operacion::timestamp + COALESCE(t2.hora_operacion::time, '00:00:00'::time)) -
-                        (t1.fecha_operacion::timestamp + COALESCE(t1.hora_operacion::time, '00:00:00'::time))
-                    )) / 60 as minutos_diferencia
-                FROM transacciones t1
-                JOIN transacciones t2 ON t1.beneficiario_id = t2.ordenante_id
-                JOIN casos_personas cp ON t1.beneficiario_id = cp.persona_id
-                WHERE cp.caso_id = :caso_id
+            WITH intermediarios AS (
+                SELECT DISTINCT persona_id FROM casos_personas WHERE caso_id = :caso_id
             )
             SELECT 
-                intermediario_id as persona_id,
-                p.documento_encriptado,
-                COUNT(*) as num_operaciones,
-                SUM(monto_enviado) as monto_total,
-                AVG(minutos_diferencia) as promedio_minutos,
-                ARRAY_AGG(trx_recibida_id) || ARRAY_AGG(trx_enviada_id) as transacciones_ids
-            FROM transacciones_ordenadas to_
-            JOIN personas p ON to_.intermediario_id = p.persona_id
-            WHERE minutos_diferencia <= :ventana_minutos
-                AND ABS(monto_recibido - monto_enviado) / monto_recibido < 0.1
-            GROUP BY intermediario_id, p.documento_encriptado
-            HAVING COUNT(*) >= 3
-            ORDER BY num_operaciones DESC
+                t.beneficiario_id as intermediario_id,
+                'E' as sentido,
+                t.transaccion_id,
+                t.monto,
+                (t.fecha_operacion::timestamp + 
+                 COALESCE(t.hora_operacion::time, '00:00:00'::time)) as momento
+            FROM transacciones t
+            JOIN intermediarios i ON t.beneficiario_id = i.persona_id
+            UNION ALL
+            SELECT 
+                t.ordenante_id as intermediario_id,
+                'S' as sentido,
+                t.transaccion_id,
+                t.monto,
+                (t.fecha_operacion::timestamp + 
+                 COALESCE(t.hora_operacion::time, '00:00:00'::time)) as momento
+            FROM transacciones t
+            JOIN intermediarios i ON t.ordenante_id = i.persona_id
+            ORDER BY intermediario_id, momento, sentido
         """)
-        return [dict(row._mapping) for row in db.execute(query, {
-            'caso_id': caso_id,
-            'ventana_minutos': params.get('ventana_minutos', 30)
-        }).fetchall()]
+        eventos = db.execute(query, {'caso_id': caso_id}).fetchall()
+        
+        detecciones = emparejar_transferencias_inmediatas(
+            eventos,
+            params.get('ventana_minutos', 30),
+            params.get('tolerancia_monto', 0.1),
+            params.get('min_operaciones', 3)
+        )
+        detecciones = detecciones[offset:None if limit is None else offset + limit]
+        
+        if detecciones:
+            documentos = db.execute(
+                text("SELECT persona_id, documento_encriptado FROM personas WHERE persona_id = ANY(:ids)"),
+                {'ids': [d['persona_id'] for d in detecciones]}
+            ).fetchall()
+            documentos = {row.persona_id: row.documento_encriptado for row in documentos}
+            for deteccion in detecciones:
+                deteccion['documento_encriptado'] = documentos.get(deteccion['persona_id'])
+    
+    return paginar_detecciones(detecciones, solo_resumen=solo_resumen)
+
+def emparejar_transferencias_inmediatas(eventos, ventana_minutos, tolerancia_monto=0.1, min_operaciones=3):
+    # eventos: filas (intermediario_id, sentido, transaccion_id, monto, momento)
+    # ordenadas por intermediario y momento. Cada salida se empareja con la
+    # entrada pendiente de monto más cercano dentro de la ventana.
+    ventana = timedelta(minutes=ventana_minutos)
+    detecciones = []
+    
+    for intermediario_id, grupo in groupby(eventos, key=lambda e: e[0]):
+        pendientes = []
+        por_vencer = []
+        pares = []
+        
+        for _, sentido, trx_id, monto, momento in grupo:
+            monto = float(monto)
+            
+            while por_vencer and por_vencer[0][0] < momento - ventana:
+                entrada = heapq.heappop(por_vencer)
+                clave = (entrada[1], entrada[0], entrada[2])
+                pos = bisect_left(pendientes, clave)
+                if pos < len(pendientes) and pendientes[pos] == clave:
+                    del pendientes[pos]
+            
+            if sentido == 'E':
+                if monto > 0:
+                    insort(pendientes, (monto, momento, trx_id))
+                    heapq.heappush(por_vencer, (momento, monto, trx_id))
+                continue
+            
+            pos = bisect_left(pendientes, (monto,))
+            candidatos = [p for p in (pos - 1, pos) if 0 <= p < len(pendientes)]
+            candidatos = [
+                p for p in candidatos
+                if abs(pendientes[p][0] - monto) / pendientes[p][0] < tolerancia_monto
+            ]
+            if not candidatos:
+                continue
+            
+            mejor = min(candidatos, key=lambda p: abs(pendientes[p][0] - monto))
+            monto_recibido, momento_recibido, trx_recibida_id = pendientes.pop(mejor)
+            pares.append({
+                'trx_recibida_id': trx_recibida_id,
+                'trx_enviada_id': trx_id,
+                'monto_recibido': monto_recibido,
+                'monto_enviado': monto,
+                'minutos': (momento - momento_recibido).total_seconds() / 60
+            })
+        
+        if len(pares) >= min_operaciones:
+            detecciones.append({
+                'persona_id': intermediario_id,
+                'num_operaciones': len(pares),
+                'monto_total': sum(p['monto_enviado'] for p in pares),
+                'promedio_minutos': sum(p['minutos'] for p in pares) / len(pares),
+                'transacciones_ids': [p['trx_recibida_id'] for p in pares] + [p['trx_enviada_id'] for p in pares],
+                'pares': pares
+            })
+    
+    return sorted(detecciones, key=lambda d: d['num_operaciones'], reverse=True)
 
-def detectar_montos_redondos(caso_id, params):
+@registrar_tipologia('TIP010', {'min_operaciones': 5}, 'BAJO')
+def detectar_montos_redondos(caso_id, params, limit=None, offset=0, solo_resumen=False):
     with get_db() as db:
         query = text("""
             SELECT 
@@ -279,15 +564,19 @@ def detectar_montos_redondos(caso_id, params):
             GROUP BY t.ordenante_id, p.documento_encriptado
             HAVING COUNT(*) >= :min_operaciones
             ORDER BY num_operaciones DESC
+            LIMIT :limit OFFSET :offset
         """)
-        return [dict(row._mapping) for row in db.execute(query, {
+        return paginar_detecciones([dict(row._mapping) for row in db.execute(query, {
             'caso_id': caso_id,
-            'min_operaciones': params.get('min_operaciones', 5)
-        }).fetchall()]
+            'min_operaciones': params.get('min_operaciones', 5),
+            'limit': limit,
+            'offset': offset
+        }).fetchall()], solo_resumen=solo_resumen)
 
-def obtener_tipologias_por_caso(caso_id):
+def obtener_tipologias_por_caso(caso_id, incluir_no_vigentes=False, incluir_resumen=False):
+    # El listado no lee evidencias; incluir_resumen agrega solo el resumen escalar
     with get_db() as db:
-        query = text("""
+        query = text(f"""
             SELECT 
                 td.deteccion_id,
                 ct.codigo,
@@ -298,17 +587,47 @@ def obtener_tipologias_por_caso(caso_id):
                 td.persona_id,
                 p.documento_encriptado,
                 td.nivel_confianza,
-                td.evidencias,
-                td.transacciones_relacionadas,
+                td.num_transacciones,{' td.evidencias,' if incluir_resumen else ''}
                 td.fecha_deteccion,
+                td.fecha_actualizacion,
+                td.vigente,
                 td.estado
             FROM tipologias_detectadas td
             JOIN catalogos_tipologias ct ON td.tipologia_id = ct.tipologia_id
             LEFT JOIN personas p ON td.persona_id = p.persona_id
             WHERE td.caso_id = :caso_id
+                AND (td.vigente OR :incluir_no_vigentes)
             ORDER BY ct.nivel_riesgo DESC, td.nivel_confianza DESC
         """)
-        return [dict(row._mapping) for row in db.execute(query, {'caso_id': caso_id}).fetchall()]
+        return [dict(row._mapping) for row in db.execute(query, {
+            'caso_id': caso_id,
+            'incluir_no_vigentes': incluir_no_vigentes
+        }).fetchall()]
+
+def obtener_detalle_deteccion(deteccion_id):
+    with get_db() as db:
+        query = text("""
+            SELECT 
+                td.deteccion_id,
+                ct.codigo,
+                ct.nombre,
+                td.persona_id,
+                td.nivel_confianza,
+                td.evidencias,
+                td.evidencias_detalle,
+                td.transacciones_relacionadas,
+                td.observaciones,
+                td.estado
+            FROM tipologias_detectadas td
+            JOIN catalogos_tipologias ct ON td.tipologia_id = ct.tipologia_id
+            WHERE td.deteccion_id = :deteccion_id
+        """)
+        result = db.execute(query, {'deteccion_id': deteccion_id}).fetchone()
+        if not result:
+            return None
+        detalle = dict(result._mapping)
+        detalle['evidencias_detalle'] = descomprimir_detalle(detalle['evidencias_detalle'])
+        return detalle
 
 def actualizar_estado_tipologia(deteccion_id, nuevo_estado, observaciones=''):
     with get_db() as db: